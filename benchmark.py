@@ -0,0 +1,198 @@
+"""
+Offline benchmark of the full turn pipeline (decision, web search, document
+context, answer, history, logging) against StubBackend. The stub's injected
+latency is known, so whatever is left over is our own overhead.
+
+    python benchmark.py [--turns 50] [--concurrency 1 8 32] [--latency 0.2] [--tokens-per-sec 400]
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+import numpy as np
+from chat_session import SharedResources, ChatSession
+from llm_backend import StubBackend, format_stats, MAX_CONCURRENT_CALLS
+from memory_store import MemoryStore
+from file_store import LocalFileStore
+
+QUESTIONS = [
+    "How does a SIP work?",
+    "What is the price of gold today?",
+    "Should a portfolio be rebalanced every year?",
+    "Explain index funds",
+    "Latest news on Reliance Industries",
+]
+STAGES = ("decision", "web_search", "doc_context", "answer", "total")
+
+
+def token_counter():
+    try:
+        import tiktoken
+        enc = tiktoken.encoding_for_model("gpt-4")
+        return lambda text: len(enc.encode(text))
+    except Exception as e:
+        print(f"[WARN] tiktoken unavailable ({e}); counting whitespace tokens instead.")
+        return lambda text: len(text.split())
+
+
+def stub_resources(folder: str, backend: StubBackend, workers: int = 8) -> SharedResources:
+    """Real agents and stores wired to a stub backend, with all state kept under folder."""
+    from evaluator import DecisionAgent
+    from naming_agent import NamingAgent
+    from web_search import webQuery, QueryCache
+    return SharedResources(
+        decision_agent=DecisionAgent(backend=backend),
+        web_agent=webQuery(backend=backend, cache=QueryCache()),
+        naming_agent=NamingAgent(backend=backend),
+        backend=backend,
+        count_tokens=token_counter(),
+        memory_store=MemoryStore(os.path.join(folder, "memory.sqlite3")),
+        file_store=LocalFileStore(os.path.join(folder, "files")),
+        stage_workers=workers
+    )
+
+
+def expected_timings(backend: StubBackend, decision: dict, streamed: bool) -> dict:
+    """Stage times if our code added nothing on top of the stub's waits."""
+    expected = {
+        "decision": backend.expected_seconds("structured"),
+        "doc_context": 0.0,
+        "answer": backend.expected_seconds("stream" if streamed else "chat"),
+    }
+    if decision["Need_web"] == "yes":
+        expected["web_search"] = backend.expected_seconds("search")
+        # The web search starts speculatively alongside the decision
+        expected["total"] = max(expected["decision"], expected["web_search"]) + expected["answer"]
+    else:
+        expected["total"] = expected["decision"] + expected["answer"]
+    return expected
+
+
+async def run_level(resources, folder, concurrency, turns, stream):
+    """concurrency sessions, each asking turns // concurrency questions back to back."""
+    sessions = [
+        ChatSession(resources, user_id=f"bench{i}", folder=os.path.join(folder, f"bench{i}"),
+                    stream=stream, on_token=lambda text: None)
+        for i in range(concurrency)
+    ]
+    results = []
+
+    async def drive(index, session):
+        for n in range(max(turns // concurrency, 1)):
+            # Unique suffix so the web search cache does not hide the search stage
+            question = f"{QUESTIONS[(index + n) % len(QUESTIONS)]} #{concurrency}-{index}-{n}"
+            start = time.perf_counter()
+            turn = await session.ask_async(question)
+            results.append((time.perf_counter() - start, turn))
+
+    start = time.perf_counter()
+    await asyncio.gather(*[drive(i, s) for i, s in enumerate(sessions)])
+    elapsed = time.perf_counter() - start
+    for session in sessions:
+        session.close()
+    return elapsed, results
+
+
+def report(backend, concurrency, elapsed, results, stream):
+    latencies = np.array([latency for latency, _ in results])
+    overheads = {stage: [] for stage in STAGES}
+    for _, turn in results:
+        expected = expected_timings(backend, turn["decision"], stream)
+        for stage in STAGES:
+            if stage in turn["timings"] and stage in expected:
+                overheads[stage].append(turn["timings"][stage] - expected[stage])
+    print(f"\n[INFO] concurrency={concurrency}: {len(results)} turns in {elapsed:.2f}s "
+          f"({len(results) / elapsed:.1f} turns/sec)")
+    print(f"[INFO] turn latency p50={np.percentile(latencies, 50) * 1000:.0f}ms "
+          f"p99={np.percentile(latencies, 99) * 1000:.0f}ms")
+    for stage in STAGES:
+        values = np.array(overheads[stage])
+        if len(values):
+            print(f"[INFO]   {stage:<12} overhead mean={values.mean() * 1000:7.2f}ms "
+                  f"p50={np.percentile(values, 50) * 1000:7.2f}ms p99={np.percentile(values, 99) * 1000:7.2f}ms")
+
+
+def import_time_check() -> bool:
+    """Cold `import document_saver` must stay within its budget (no models or DB clients at import)."""
+    import subprocess
+    import document_saver
+    try:
+        seconds = document_saver.measure_import_seconds()
+    except subprocess.CalledProcessError as e:
+        last_line = (e.stderr.strip().splitlines() or [""])[-1]
+        print(f"[ERROR] import document_saver failed: {last_line}")
+        return False
+    within = seconds <= document_saver.IMPORT_BUDGET_SECONDS
+    print(f"[{'INFO' if within else 'ERROR'}] import document_saver took {seconds:.2f}s "
+          f"(budget {document_saver.IMPORT_BUDGET_SECONDS:.2f}s)")
+    return within
+
+
+def upload_memory(resources, folder, count: int, megabytes: int):
+    """Upload count files of the given size into one session; report peak Python heap growth."""
+    import tracemalloc
+    session = ChatSession(resources, user_id="uploads", folder=os.path.join(folder, "uploads"))
+    paths = []
+    for i in range(count):
+        path = os.path.join(folder, f"upload{i}.pdf")
+        with open(path, "wb") as f:
+            # Uploads are typed by content, so the file needs a PDF signature to be stored
+            f.write(b"%PDF-1.4\n")
+            for _ in range(megabytes):
+                f.write(os.urandom(1 << 20))
+        paths.append(path)
+    tracemalloc.start()
+    start = time.perf_counter()
+    for path in paths:
+        session.upload(path)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    session.close()
+    print(f"\n[INFO] uploaded {count} x {megabytes}MB in {elapsed:.2f}s: "
+          f"peak heap {peak / 1e6:.1f}MB, retained {retained / 1e6:.2f}MB")
+
+
+async def main(args):
+    backend = StubBackend(latency=args.latency, tokens_per_sec=args.tokens_per_sec,
+                          output_tokens=args.tokens, search_latency=args.search_latency, jitter=args.jitter,
+                          rate_limit_every=args.rate_limit_every, max_concurrency=args.max_concurrency)
+    stream = not args.no_stream
+    import_ok = args.skip_import_check or import_time_check()
+    with tempfile.TemporaryDirectory() as folder:
+        resources = stub_resources(folder, backend, workers=max(8, 4 * max(args.concurrency)))
+        print(f"[INFO] Stub backend: latency={args.latency}s, {args.tokens_per_sec} tokens/sec, "
+              f"{args.tokens} tokens/answer, search={args.search_latency}s, stream={stream}")
+        if args.uploads:
+            upload_memory(resources, folder, args.uploads, args.upload_mb)
+        for concurrency in args.concurrency:
+            elapsed, results = await run_level(resources, folder, concurrency, args.turns, stream)
+            report(backend, concurrency, elapsed, results, stream)
+        resources.close()
+    print("")
+    for line in format_stats(backend.stats.snapshot()):
+        print(f"[LLM] {line}")
+    return 0 if import_ok else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline benchmark of the turn pipeline with a stub LLM backend.")
+    parser.add_argument("--turns", type=int, default=50, help="turns per concurrency level")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--latency", type=float, default=0.2, help="stub latency before the first token")
+    parser.add_argument("--tokens-per-sec", type=float, default=400.0)
+    parser.add_argument("--tokens", type=int, default=60, help="tokens per stub answer")
+    parser.add_argument("--search-latency", type=float, default=0.5)
+    parser.add_argument("--jitter", type=float, default=0.0, help="e.g. 0.2 for +/-20%% latency noise")
+    parser.add_argument("--max-concurrency", type=int, default=MAX_CONCURRENT_CALLS,
+                        help="concurrent LLM calls allowed by the backend")
+    parser.add_argument("--rate-limit-every", type=int, default=0, help="simulate a 429 on every Nth call")
+    parser.add_argument("--uploads", type=int, default=0, help="also measure memory while uploading N files")
+    parser.add_argument("--upload-mb", type=int, default=20, help="size of each uploaded file")
+    parser.add_argument("--no-stream", action="store_true", help="use a single chat call instead of streaming")
+    parser.add_argument("--skip-import-check", action="store_true",
+                        help="do not time a cold import of document_saver against its budget")
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,479 @@
+import os
+import time
+import uuid
+import asyncio
+import threading
+from datetime import datetime
+from concurrent.futures import wait
+from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
+from summary_cache import SummaryCache
+from file_store import hash_file, detect_mime_type, model_readable
+from history_window import TokenBudgetHistory
+import conversation_log
+from conversation_log import ConversationLog
+from memory_store import MemoryStore, DEFAULT_USER, format_facts
+from turn_orchestrator import TurnOrchestrator
+
+TOKEN_LIMIT = 100000
+CONTEXT_RESERVE_TOKENS = 8000  # room left for document and web context each turn
+SUMMARY_MODEL = "gemini-2.5-flash"
+CONVERSATION_DIR = "conversation"
+TURN_LOCK_POLL_SECONDS = 0.01
+MAX_INLINE_DOCUMENT_CHARS = 200000  # text sent in-prompt for types the model cannot read as files
+
+
+class SharedResources:
+    """
+    Clients, models and stores shared by every chat session in the process.
+    Sessions only hold per-conversation state and borrow everything here.
+    """
+
+    def __init__(self, decision_agent, web_agent, naming_agent, backend, count_tokens,
+                 memory_store, file_store, summary_cache=None, response_cache=None,
+                 speculative_web: bool = True, stage_workers: int = 8, background_workers: int = 2):
+        """
+        backend: llm_backend.GeminiBackend or StubBackend, used for answers,
+            history summaries and describing documents not in ChromaDB
+        count_tokens(text) -> int
+        file_store: file_store.LocalFileStore or GeminiFileStore holding uploads
+        """
+        self.decision_agent = decision_agent
+        self.web_agent = web_agent
+        self.naming_agent = naming_agent
+        self.backend = backend
+        self.count_tokens = count_tokens
+        self.memory_store = memory_store
+        self.file_store = file_store
+        self.summary_cache = summary_cache
+        self.response_cache = response_cache
+        self.orchestrator = TurnOrchestrator(
+            decision_agent, web_agent, speculative_web=speculative_web,
+            stage_workers=stage_workers, background_workers=background_workers
+        )
+
+    @classmethod
+    def from_env(cls, api_key: str = None, backend=None, **overrides) -> "SharedResources":
+        """
+        Build the shared resources, honouring the same env flags as main.py.
+        The LLM backend comes from LLM_BACKEND unless one is passed in.
+        """
+        import tiktoken
+        from llm_backend import get_backend
+        from file_store import get_file_store
+        from evaluator import DecisionAgent
+        from naming_agent import NamingAgent
+        from web_search import webQuery
+        from response_cache import SemanticResponseCache, cache_enabled
+
+        enc = tiktoken.encoding_for_model("gpt-4")
+        backend = backend or get_backend(api_key)
+
+        pre_classifier = None
+        if os.getenv("LOCAL_CLASSIFIER", "1") == "1":
+            from query_classifier import QueryPreClassifier
+            embed = None
+            if os.getenv("LOCAL_CLASSIFIER_EMBEDDINGS", "0") == "1":
+                import document_saver
+                document_saver.warm_up(image=False)
+                embed = document_saver.embed_query_text
+            pre_classifier = QueryPreClassifier(embed=embed)
+
+        memory_embed = None
+        if os.getenv("MEMORY_EMBEDDINGS", "0") == "1":
+            import document_saver
+            memory_embed = document_saver.embed_query_text
+
+        response_cache = None
+        if cache_enabled():
+            import document_saver
+            document_saver.warm_up(image=False)
+            response_cache = SemanticResponseCache(document_saver.embed_query_text)
+
+        params = dict(
+            decision_agent=DecisionAgent(pre_classifier=pre_classifier, backend=backend),
+            web_agent=webQuery(backend=backend),
+            naming_agent=NamingAgent(backend=backend),
+            backend=backend,
+            count_tokens=lambda text: len(enc.encode(text)),
+            memory_store=MemoryStore(embed=memory_embed),
+            file_store=get_file_store(backend),
+            summary_cache=SummaryCache(),
+            response_cache=response_cache,
+            speculative_web=os.getenv("SPECULATIVE_WEB", "1") == "1"
+        )
+        params.update(overrides)
+        return cls(**params)
+
+    def close(self):
+        self.orchestrator.shutdown()
+
+
+def summary_prompt(filename):
+    return f"Give a detailed description of this document: {filename}"
+
+def restore_document(doc_ref):
+    """
+    Rebuild an uploaded document entry from a saved conversation reference.
+    Only references are kept: the file-store handle if there is one, else the
+    original path (stored again on first use) and the hash, so a cached
+    summary can be reused even when the file is gone.
+    """
+    doc = {k: v for k, v in doc_ref.items() if k != "content"}
+    path = doc.get("path")
+    if not doc.get("sha256") and path and os.path.exists(path):
+        doc["sha256"] = hash_file(path)
+    # Older logs guessed image/png for anything that was not a PDF
+    if path and os.path.exists(path):
+        doc["mime_type"] = detect_mime_type(path)
+    doc.setdefault("mime_type", detect_mime_type(doc["filename"]))
+    return doc
+
+
+class ChatSession:
+    """
+    One user's conversation: token-budgeted history, uploaded documents and
+    the append-only log. Turns are serialized per session; many sessions can
+    run concurrently on the same SharedResources.
+    """
+
+    def __init__(self, resources: SharedResources, user_id: str = DEFAULT_USER,
+                 conversation_path: str = None, folder: str = CONVERSATION_DIR,
+                 memory_mirror_path: str = None, stream: bool = True, on_token=None):
+        """
+        memory_mirror_path: optional text file that new memory facts are also appended to
+        on_token(text): called with each streamed chunk of the answer
+        """
+        self.resources = resources
+        self.user_id = user_id
+        self.folder = folder
+        self.memory_mirror_path = memory_mirror_path
+        self.stream = stream
+        self.on_token = on_token
+        self.uploaded_docs = []
+        self.user_messages = []
+        self.naming_started = False
+        self._background = []
+        self._turn_lock = threading.Lock()
+        self.chat_history = TokenBudgetHistory(
+            self.create_system_prompt(), resources.count_tokens, TOKEN_LIMIT,
+            summarizer=self._summarize_history, message_factory=lambda text: SystemMessage(content=text)
+        )
+        self.conversation_data = {
+            "conversation_id": str(uuid.uuid4()),
+            "conversation_name": "Unnamed Conversation",
+            "created_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "documents": []
+        }
+        if conversation_path and os.path.exists(conversation_path):
+            self._resume(conversation_path)
+        # Every turn is appended to the log as it happens
+        self.log = ConversationLog(
+            self.conversation_data["conversation_id"],
+            self.conversation_data["conversation_name"],
+            self.conversation_data["created_at"],
+            folder=folder,
+            turns=len(self.user_messages)
+        )
+
+    @property
+    def conversation_id(self) -> str:
+        return self.conversation_data["conversation_id"]
+
+    # Loading
+    def _add_history_message(self, role, content):
+        if role == "user":
+            self.chat_history.append(HumanMessage(content=content))
+            self.user_messages.append(content)
+        elif role == "assistant":
+            self.chat_history.append(AIMessage(content=content))
+
+    def _resume(self, conversation_path):
+        if conversation_path.endswith(".json"):
+            # Legacy whole-file conversation: migrate it to an append-only log once
+            conversation_path = conversation_log.compact(conversation_path, self.folder)
+        # Stream the log straight into the history instead of materializing it
+        for record in conversation_log.iter_records(conversation_path):
+            kind = record.get("type")
+            if kind == "header":
+                for key in ("conversation_id", "conversation_name", "created_at"):
+                    self.conversation_data[key] = record.get(key) or self.conversation_data[key]
+            elif kind == "rename":
+                self.conversation_data["conversation_name"] = record["conversation_name"]
+            elif kind == "message":
+                self._add_history_message(record["role"], record["content"])
+            elif kind == "document":
+                doc_ref = {k: v for k, v in record.items() if k != "type"}
+                if doc_ref not in self.conversation_data["documents"]:
+                    self.conversation_data["documents"].append(doc_ref)
+        self.uploaded_docs = [restore_document(doc) for doc in self.conversation_data["documents"]]
+        if self.uploaded_docs:
+            # Documents may be served from ChromaDB; load the embedding models
+            # in the background while the user types their first message
+            import document_saver
+            document_saver.warm_up()
+
+    # Memory and prompts
+    def create_system_prompt(self, query=""):
+        # Only facts relevant to this query are injected, so the prompt stays
+        # the same size however much memory accumulates
+        facts = self.resources.memory_store.relevant_facts(query, self.user_id)
+        return SystemMessage(content=f"""
+You are a highly knowledgeable financial advisor.
+Answer clearly and professionally.
+
+User memory (facts relevant to this question):
+{format_facts(facts)}
+
+You can use the above user memory to assist the user in their queries.
+""")
+
+    def update_user_memory(self, new_info: str):
+        if self.memory_mirror_path:
+            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            with open(self.memory_mirror_path, "a", encoding="utf-8") as f:
+                f.write(f"\n[{timestamp}] {new_info}")
+        status = self.resources.memory_store.add_fact(new_info, self.user_id)
+        print(f"[INFO] User memory {status}: {new_info}")
+        # Keep the token accounting in step with the pinned facts
+        self.chat_history.set_system(self.create_system_prompt())
+        return status
+
+    def _summarize_history(self, previous_summary, messages):
+        """Fold messages that fall out of the token window into a running summary."""
+        transcript = "\n".join(
+            f"{'User' if isinstance(msg, HumanMessage) else 'Assistant'}: {msg.content}" for msg in messages
+        )
+        prompt = [
+            SystemMessage(content="Summarize this earlier part of a financial advisory chat in a short paragraph. "
+                                  "Keep facts about the user, decisions made and open questions."),
+            HumanMessage(content=f"Previous summary: {previous_summary or 'None'}\n\nConversation:\n{transcript}")
+        ]
+        return self.resources.backend.chat(prompt, caller="history_summary")
+
+    # Documents
+    def upload(self, file_path: str) -> dict:
+        """
+        Hash and store the file once; the session keeps only a reference to it.
+        Types the model cannot read as a file (e.g. DOCX) are not stored; their
+        text is extracted when the summary is made.
+        """
+        mime_type = detect_mime_type(file_path)
+        file_hash = hash_file(file_path)
+        handle = None
+        if model_readable(mime_type):
+            handle = self.resources.file_store.put(file_path, mime_type, file_hash)
+        doc_ref = {
+            "filename": os.path.basename(file_path),
+            "path": file_path,
+            "mime_type": mime_type,
+            "sha256": file_hash,
+            "handle": handle
+        }
+        self.uploaded_docs.append(doc_ref)
+        self.conversation_data["documents"].append(doc_ref)
+        self.log.append_document(doc_ref)
+        return doc_ref
+
+    def _document_handle(self, doc):
+        """A valid file-store handle for doc, storing the original file again if the old one expired."""
+        store = self.resources.file_store
+        if store.is_valid(doc.get("handle")):
+            return doc["handle"]
+        path = doc.get("path")
+        if not path or not os.path.exists(path) or not model_readable(doc["mime_type"]):
+            return None
+        doc["handle"] = store.put(path, doc["mime_type"], doc.get("sha256") or hash_file(path))
+        return doc["handle"]
+
+    def _summarize_document(self, doc):
+        prompt = summary_prompt(doc["filename"])
+        backend = self.resources.backend
+
+        def generate():
+            if not model_readable(doc["mime_type"]):
+                return self._summarize_document_text(doc, prompt)
+            handle = self._document_handle(doc)
+            if handle is None:
+                return None
+            return backend.describe_document(handle, prompt, model=SUMMARY_MODEL, caller="document_summary")
+        cache = self.resources.summary_cache
+        if cache is None or not doc.get("sha256"):
+            return generate()
+        return cache.get_or_create(doc["sha256"], SUMMARY_MODEL, prompt, generate, filename=doc["filename"])
+
+    def _summarize_document_text(self, doc, prompt):
+        path = doc.get("path")
+        if not path or not os.path.exists(path):
+            return None
+        import document_saver
+        text = document_saver.extract_document_text(path)[:MAX_INLINE_DOCUMENT_CHARS]
+        if not text.strip():
+            return None
+        return self.resources.backend.chat([HumanMessage(content=f"{prompt}\n\n{text}")],
+                                           caller="document_summary")
+
+    def build_doc_context(self, user_input):
+        # Documents already embedded in ChromaDB are served by retrieval;
+        # only documents that were never indexed fall back to a summary.
+        doc_summaries = []
+        indexed = set()
+        if self.uploaded_docs:
+            try:
+                import retriever
+                doc_names = {doc["filename"] for doc in self.uploaded_docs}
+                indexed = retriever.indexed_sources(doc_names)
+                if indexed:
+                    hits = retriever.retrieve(user_input, indexed)
+                    if hits:
+                        doc_summaries.append(retriever.format_context(hits))
+                    else:
+                        # Removed between the lookup and the query: summarize instead
+                        indexed = set()
+            except Exception as e:
+                print(f"[ERROR] Document retrieval failed: {e}")
+                indexed = set()
+        for doc in self.uploaded_docs:
+            if doc["filename"] in indexed:
+                continue
+            try:
+                summary_text = self._summarize_document(doc)
+                if summary_text is None:
+                    print(f"[WARN] {doc['filename']} is no longer available and has no cached summary.")
+                    continue
+                doc_summaries.append(f"[Summary of {doc['filename']}]: {summary_text}")
+            except Exception as e:
+                print(f"[ERROR] Failed to summarize {doc['filename']}: {e}")
+        return doc_summaries
+
+    # Answering
+    def _generate_answer(self, user_input, doc_summaries, web_context, web_sources, on_token=None):
+        messages_to_send = (
+            [self.create_system_prompt(user_input)]
+            + self.chat_history.as_list()[1:]
+            + [HumanMessage(content=user_input)]
+        )
+        if doc_summaries:
+            messages_to_send.append(HumanMessage(content="\n".join(doc_summaries)))
+        if web_context:
+            messages_to_send.append(HumanMessage(content=f"[Web Search Results]: {web_context}\nSources: {', '.join(web_sources)}"))
+        if not self.stream or on_token is None:
+            return self.resources.backend.chat(messages_to_send, caller="answer")
+        return self._stream_answer(messages_to_send, on_token)
+
+    def _stream_answer(self, messages_to_send, on_token):
+        """
+        Hand tokens to on_token as they arrive and return the full text together
+        with time-to-first-token and generation speed for the turn.
+        """
+        start = time.perf_counter()
+        first_token_at = None
+        parts = []
+        for text in self.resources.backend.stream(messages_to_send, caller="answer"):
+            if first_token_at is None:
+                first_token_at = time.perf_counter()
+            parts.append(text)
+            on_token(text)
+        end = time.perf_counter()
+        ai_response = "".join(parts)
+        output_tokens = self.resources.count_tokens(ai_response)
+        generation_seconds = end - (first_token_at or end)
+        return {
+            "text": ai_response,
+            "streamed": True,
+            "ttft": (first_token_at or end) - start,
+            "output_tokens": output_tokens,
+            "tokens_per_sec": output_tokens / generation_seconds if generation_seconds > 0 else 0.0
+        }
+
+    def _record_turn(self, user_input, ai_response):
+        self._add_history_message("user", user_input)
+        self._add_history_message("assistant", ai_response)
+        self.log.append_message("user", user_input)
+        self.log.append_message("assistant", ai_response)
+
+    def _name_conversation(self, messages):
+        name = self.resources.naming_agent.generate_name(messages)
+        self.conversation_data["conversation_name"] = name
+        self.log.rename(name)
+        print(f"[INFO] Conversation named: {name}")
+
+    def _submit_background(self, name, func, *args):
+        self._background = [f for f in self._background if not f.done()]
+        self._background.append(self.resources.orchestrator.submit_background(name, func, *args))
+
+    def _ask_blocking_prelude(self, user_input):
+        # Keep history under the token budget (oldest turns are summarized, not fatal)
+        trimmed = self.chat_history.fit(self.resources.count_tokens(user_input) + CONTEXT_RESERVE_TOKENS)
+        cache = self.resources.response_cache
+        cached, query_embedding = None, None
+        # Answers that depend on uploaded documents are never served from cache
+        if cache is not None and not self.uploaded_docs:
+            try:
+                cached, query_embedding = cache.lookup(user_input, scope=self.user_id)
+            except Exception as e:
+                print(f"[ERROR] Response cache lookup failed: {e}")
+        return trimmed, cached, query_embedding
+
+    def _cache_store(self, user_input, turn, query_embedding):
+        cache = self.resources.response_cache
+        decision = turn["decision"]
+        # Personal statements ("my email is ...") are never cached
+        if cache is None or self.uploaded_docs or decision["update_user_data"]:
+            return
+        try:
+            cache.store(
+                user_input, turn["response"],
+                need_web=decision["Need_web"] == "yes",
+                latency=turn["timings"]["total"],
+                sources=turn["web_sources"],
+                embedding=query_embedding,
+                scope=self.user_id
+            )
+        except Exception as e:
+            print(f"[ERROR] Failed to cache response: {e}")
+
+    async def ask_async(self, user_input: str, on_token=None) -> dict:
+        """
+        Run one turn. Returns a dict with response, web_sources, timings,
+        answer_stats, trimmed (messages folded into the summary) and cached
+        (the cache hit, if the answer came from the semantic cache).
+        """
+        on_token = on_token or self.on_token
+        # Polled rather than blocking so queued turns do not pin worker threads,
+        # and so the same session works under successive event loops (CLI)
+        while not self._turn_lock.acquire(blocking=False):
+            await asyncio.sleep(TURN_LOCK_POLL_SECONDS)
+        try:
+            trimmed, cached, query_embedding = await asyncio.to_thread(self._ask_blocking_prelude, user_input)
+            if cached:
+                await asyncio.to_thread(self._record_turn, user_input, cached["answer"])
+                return {"response": cached["answer"], "web_sources": cached["sources"], "timings": {},
+                        "answer_stats": {}, "trimmed": trimmed, "cached": cached}
+
+            # Decision, web search and document context run concurrently;
+            # the main model answers once the context it needs is ready
+            def answer(user_input, doc_summaries, web_context, web_sources):
+                return self._generate_answer(user_input, doc_summaries, web_context, web_sources, on_token)
+            turn = await self.resources.orchestrator.run_turn(user_input, self.build_doc_context, answer)
+            await asyncio.to_thread(self._cache_store, user_input, turn, query_embedding)
+            await asyncio.to_thread(self._record_turn, user_input, turn["response"])
+
+            # Naming and memory updates stay off the critical path
+            if self.conversation_data["conversation_name"] == "Unnamed Conversation" and not self.naming_started:
+                self.naming_started = True
+                self._submit_background("naming", self._name_conversation, self.user_messages[:])
+            decision = turn["decision"]
+            if decision["update_user_data"] and decision.get("new_info"):
+                self._submit_background("memory_update", self.update_user_memory, decision["new_info"])
+
+            return dict(turn, trimmed=trimmed, cached=None)
+        finally:
+            self._turn_lock.release()
+
+    def ask(self, user_input: str, on_token=None) -> dict:
+        return asyncio.run(self.ask_async(user_input, on_token))
+
+    def close(self):
+        """Wait for this session's background work, then close its log."""
+        wait(self._background)
+        self.log.close()
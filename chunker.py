@@ -0,0 +1,250 @@
+"""
+Token-aware text chunking for the embedding model.
+
+Chunks are measured in the embedding model's own tokens and packed across
+page boundaries, so short pages no longer become many tiny chunks and
+sentences that run over a page break stay together. Each chunk records the
+pages it spans.
+
+    python chunker.py bench [files...] [--synthetic 200] [--embed]
+"""
+import os
+import re
+import sys
+import time
+import zlib
+import argparse
+import threading
+from collections import namedtuple
+
+TOKENIZER_NAME = "nomic-ai/nomic-embed-text-v1.5"
+CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", "512"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "48"))
+SPECIAL_TOKENS = 2          # [CLS] and [SEP] added by the model
+MIN_CHUNK_FRACTION = 0.5    # content-defined cuts only once a chunk is at least this full
+CUT_EVERY = 8               # on average one sentence in CUT_EVERY is a cut point
+
+# Sentence ends, or blank lines between paragraphs
+UNIT_BOUNDARY = re.compile(r"(?<=[.!?])\s+|\n\s*\n")
+
+Chunk = namedtuple("Chunk", ["text", "page_start", "page_end", "tokens"])
+
+
+class HFTokenCounter:
+    """Counts and splits with the embedding model's tokenizer."""
+
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+        # Only counting here; silences the "longer than max length" warning
+        self.tokenizer.model_max_length = 1 << 30
+
+    def count(self, texts) -> list:
+        if not texts:
+            return []
+        return [len(ids) for ids in self.tokenizer(list(texts), add_special_tokens=False)["input_ids"]]
+
+    def split(self, text: str, max_tokens: int) -> list:
+        offsets = self.tokenizer(text, add_special_tokens=False, return_offsets_mapping=True)["offset_mapping"]
+        return [text[offsets[start][0]:offsets[min(start + max_tokens, len(offsets)) - 1][1]]
+                for start in range(0, len(offsets), max_tokens)]
+
+
+class WhitespaceTokenCounter:
+    """Fallback when the tokenizer cannot be loaded: one token per word."""
+
+    def count(self, texts) -> list:
+        return [len(text.split()) for text in texts]
+
+    def split(self, text: str, max_tokens: int) -> list:
+        words = text.split()
+        return [" ".join(words[start:start + max_tokens]) for start in range(0, len(words), max_tokens)]
+
+
+_token_counter = None
+_token_counter_lock = threading.Lock()
+
+def get_token_counter():
+    global _token_counter
+    if _token_counter is None:
+        with _token_counter_lock:
+            if _token_counter is None:
+                try:
+                    from transformers import AutoTokenizer
+                    _token_counter = HFTokenCounter(AutoTokenizer.from_pretrained(TOKENIZER_NAME))
+                except Exception as e:
+                    print(f"[WARN] Tokenizer {TOKENIZER_NAME} unavailable ({e}); counting whitespace tokens instead.")
+                    _token_counter = WhitespaceTokenCounter()
+    return _token_counter
+
+
+class TokenChunker:
+    """
+    Packs sentences into chunks of at most max_tokens model tokens, across
+    pages. Pages are fed in order; completed chunks are returned as soon as
+    they are full, so extraction and embedding stay streamed.
+
+    Cut points are partly content-defined (a sentence whose hash hits
+    1/CUT_EVERY ends the chunk once it is half full), so an edit early in a
+    document only changes the chunks around it and later chunks keep their
+    content ids on re-ingestion.
+    """
+
+    def __init__(self, max_tokens: int = CHUNK_TOKENS, overlap_tokens: int = CHUNK_OVERLAP_TOKENS,
+                 counter=None):
+        self.max_tokens = max_tokens - SPECIAL_TOKENS
+        self.overlap_tokens = overlap_tokens
+        self.min_tokens = int(self.max_tokens * MIN_CHUNK_FRACTION)
+        self.counter = counter or get_token_counter()
+        self._units = []    # (text, page, tokens) of the chunk being built
+        self._tokens = 0
+        self._fresh = 0     # units added since the last chunk, i.e. not just overlap
+
+    def _split_units(self, text: str) -> list:
+        units = [u.strip() for u in UNIT_BOUNDARY.split(text) if u and u.strip()]
+        counted = []
+        for unit, tokens in zip(units, self.counter.count(units)):
+            if tokens <= self.max_tokens:
+                counted.append((unit, tokens))
+                continue
+            pieces = self.counter.split(unit, self.max_tokens)
+            counted.extend(zip(pieces, self.counter.count(pieces)))
+        return counted
+
+    def _emit(self) -> Chunk:
+        pages = [page for _, page, _ in self._units if page is not None]
+        chunk = Chunk(" ".join(text for text, _, _ in self._units),
+                      min(pages) if pages else None, max(pages) if pages else None, self._tokens)
+        # Carry the last sentences over as overlap
+        carried, carried_tokens = [], 0
+        for unit in reversed(self._units):
+            if carried_tokens + unit[2] > self.overlap_tokens:
+                break
+            carried.insert(0, unit)
+            carried_tokens += unit[2]
+        self._units, self._tokens, self._fresh = carried, carried_tokens, 0
+        return chunk
+
+    def feed(self, page, text: str) -> list:
+        """Add one page of text; returns the chunks completed by it."""
+        done = []
+        for unit, tokens in self._split_units(text):
+            if self._tokens + tokens > self.max_tokens:
+                if self._fresh:
+                    done.append(self._emit())
+                if self._tokens + tokens > self.max_tokens:
+                    # The overlap alone leaves no room for this sentence
+                    self._units, self._tokens = [], 0
+            self._units.append((unit, page, tokens))
+            self._tokens += tokens
+            self._fresh += 1
+            if self._tokens >= self.min_tokens and zlib.crc32(unit.encode("utf-8")) % CUT_EVERY == 0:
+                done.append(self._emit())
+        return done
+
+    def finish(self) -> list:
+        """Flush the last partial chunk (unless it holds only overlap) and reset."""
+        done = [self._emit()] if self._fresh else []
+        self._units, self._tokens, self._fresh = [], 0, 0
+        return done
+
+
+def chunk_pages(pages, max_tokens: int = CHUNK_TOKENS, overlap_tokens: int = CHUNK_OVERLAP_TOKENS) -> list:
+    """Chunk an iterable of (page, text) in one go."""
+    chunker = TokenChunker(max_tokens, overlap_tokens)
+    chunks = []
+    for page, text in pages:
+        chunks.extend(chunker.feed(page, text))
+    chunks.extend(chunker.finish())
+    return chunks
+
+
+# Benchmark
+LEGACY_CHUNK_CHARS = 2000
+LEGACY_OVERLAP_CHARS = 200
+BENCH_BATCH_SIZE = 32
+
+def legacy_chunks(pages) -> list:
+    """The old behaviour: each page split on its own into 2000-character chunks."""
+    try:
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+        split = RecursiveCharacterTextSplitter(chunk_size=LEGACY_CHUNK_CHARS,
+                                               chunk_overlap=LEGACY_OVERLAP_CHARS).split_text
+    except ImportError:
+        print("[WARN] langchain unavailable; approximating the old splitter with fixed character windows.")
+        step = LEGACY_CHUNK_CHARS - LEGACY_OVERLAP_CHARS
+        split = lambda text: [text[i:i + LEGACY_CHUNK_CHARS] for i in range(0, max(len(text) - LEGACY_OVERLAP_CHARS, 1), step)]
+    return [chunk for _, text in pages if text.strip() for chunk in split(text) if chunk.strip()]
+
+def synthetic_pages(count: int, seed: int = 0) -> list:
+    """Statement-like pages: many short ones, some long, sentences running over page breaks."""
+    import random
+    rng = random.Random(seed)
+    words = ("account balance transaction credit debit interest statement payment fund equity "
+             "portfolio dividend tax return period opening closing charges transfer deposit").split()
+    pages, carry = [], ""
+    for page in range(count):
+        n_words = rng.choice([15, 40, 80, 120]) if rng.random() < 0.6 else rng.randint(300, 900)
+        text = carry + " ".join(rng.choice(words) for _ in range(n_words))
+        # Roughly one sentence end every 18 words; the last sentence continues on the next page
+        parts = text.split(" ")
+        sentence = " ".join(w + ("." if rng.random() < 1 / 18 else "") for w in parts)
+        cut = sentence.rfind(". ")
+        carry = sentence[cut + 2:] + " " if rng.random() < 0.5 and cut > 0 else ""
+        pages.append((page, sentence[:cut + 1] if carry else sentence))
+    return pages
+
+def document_pages(paths) -> list:
+    pages = []
+    for path in paths:
+        if path.endswith(".txt"):
+            with open(path, "r", encoding="utf-8", errors="replace") as f:
+                # Form feeds mark page breaks in text exports
+                pages.extend(enumerate(f.read().split("\f")))
+        else:
+            import document_saver
+            pages.extend((page, text) for page, text, _ in document_saver.iter_document_pages(path))
+    return pages
+
+def padded_tokens(token_counts, batch_size: int = BENCH_BATCH_SIZE) -> int:
+    """Tokens the model actually runs over when chunks are embedded in padded batches."""
+    return sum(max(token_counts[i:i + batch_size]) * len(token_counts[i:i + batch_size])
+               for i in range(0, len(token_counts), batch_size))
+
+def bench(pages, embed: bool = False):
+    counter = get_token_counter()
+    results = {}
+    for name, texts in (("per-page 2000 chars", legacy_chunks(pages)),
+                        (f"token {CHUNK_TOKENS}", [c.text for c in chunk_pages(pages)])):
+        counts = [n + SPECIAL_TOKENS for n in counter.count(texts)]
+        stats = {"chunks": len(texts), "tokens": sum(counts), "padded_tokens": padded_tokens(counts),
+                 "mean_tokens": sum(counts) / max(len(counts), 1),
+                 "small_chunks": sum(1 for n in counts if n < CHUNK_TOKENS // 4)}
+        if embed:
+            import document_saver
+            start = time.perf_counter()
+            document_saver.embed_text_chunks(texts, BENCH_BATCH_SIZE)
+            stats["embed_seconds"] = time.perf_counter() - start
+        results[name] = stats
+        print(f"[INFO] {name:<20} chunks={stats['chunks']:6d} tokens={stats['tokens']:8d} "
+              f"padded={stats['padded_tokens']:8d} mean={stats['mean_tokens']:6.1f} "
+              f"under {CHUNK_TOKENS // 4} tokens={stats['small_chunks']:5d}"
+              + (f" embed={stats['embed_seconds']:.2f}s" if embed else ""))
+    old, new = results.values()
+    print(f"[INFO] chunk count -{1 - new['chunks'] / old['chunks']:.0%}, "
+          f"padded tokens -{1 - new['padded_tokens'] / old['padded_tokens']:.0%}"
+          + (f", embedding time -{1 - new['embed_seconds'] / old['embed_seconds']:.0%}" if embed else ""))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the old per-page splitter with the token chunker.")
+    parser.add_argument("command", choices=["bench"])
+    parser.add_argument("paths", nargs="*", help="documents (PDF/DOCX/.txt with form-feed page breaks)")
+    parser.add_argument("--synthetic", type=int, default=0, help="add N synthetic statement pages")
+    parser.add_argument("--embed", action="store_true", help="also time embedding with the real model")
+    args = parser.parse_args()
+    corpus = document_pages(args.paths) + synthetic_pages(args.synthetic)
+    if not corpus:
+        sys.exit("[ERROR] No pages: pass documents or --synthetic N")
+    print(f"[INFO] {len(corpus)} pages")
+    bench(corpus, embed=args.embed)
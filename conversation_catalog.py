@@ -0,0 +1,247 @@
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+CONVERSATION_DIR = "conversation"
+CATALOG_FILENAME = "catalog.sqlite3"
+
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+
+def get_catalog(folder: str = CONVERSATION_DIR) -> "ConversationCatalog":
+    """One shared catalog per conversation folder."""
+    key = os.path.abspath(folder)
+    with _catalogs_lock:
+        if key not in _catalogs:
+            _catalogs[key] = ConversationCatalog(folder)
+        return _catalogs[key]
+
+
+def _fts_query(terms: str) -> str:
+    # Quote every term so user input cannot break the FTS5 query syntax
+    return " ".join('"' + term.replace('"', '""') + '"' for term in terms.split())
+
+
+class ConversationCatalog:
+    """
+    SQLite catalog of saved conversations: id, name, created_at, turn count
+    and document references, plus a full-text index over message content.
+    Kept up to date on every save, and synced against files on disk by
+    (mtime, size) so only changed files are ever parsed.
+    """
+
+    def __init__(self, folder: str = CONVERSATION_DIR):
+        os.makedirs(folder, exist_ok=True)
+        self.folder = folder
+        self.path = os.path.join(folder, CATALOG_FILENAME)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self.has_fts = self._create_schema()
+
+    def _create_schema(self) -> bool:
+        with self._conn:
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS conversations (
+                    conversation_id TEXT PRIMARY KEY,
+                    conversation_name TEXT,
+                    created_at TEXT,
+                    updated_at TEXT,
+                    turns INTEGER DEFAULT 0,
+                    filename TEXT
+                );
+                CREATE TABLE IF NOT EXISTS documents (
+                    conversation_id TEXT,
+                    filename TEXT,
+                    path TEXT,
+                    sha256 TEXT,
+                    UNIQUE (conversation_id, filename, sha256)
+                );
+                CREATE TABLE IF NOT EXISTS files (
+                    filename TEXT PRIMARY KEY,
+                    conversation_id TEXT,
+                    mtime REAL,
+                    size INTEGER
+                );
+            """)
+            try:
+                self._conn.execute(
+                    "CREATE VIRTUAL TABLE IF NOT EXISTS messages USING fts5("
+                    "conversation_id UNINDEXED, role UNINDEXED, content)"
+                )
+                return True
+            except sqlite3.OperationalError:
+                # SQLite built without FTS5: fall back to LIKE search
+                self._conn.execute(
+                    "CREATE TABLE IF NOT EXISTS messages (conversation_id TEXT, role TEXT, content TEXT)"
+                )
+                return False
+
+    # Writes
+    def upsert_conversation(self, conversation_id: str, **fields):
+        fields["updated_at"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        columns = ", ".join(fields)
+        placeholders = ", ".join("?" for _ in fields)
+        updates = ", ".join(f"{name}=excluded.{name}" for name in fields)
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"INSERT INTO conversations (conversation_id, {columns}) VALUES (?, {placeholders}) "
+                f"ON CONFLICT(conversation_id) DO UPDATE SET {updates}",
+                (conversation_id, *fields.values())
+            )
+
+    def add_message(self, conversation_id: str, role: str, content: str):
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO messages (conversation_id, role, content) VALUES (?, ?, ?)",
+                (conversation_id, role, content)
+            )
+            self._conn.execute(
+                "UPDATE conversations SET turns = turns + ?, updated_at = ? WHERE conversation_id = ?",
+                (1 if role == "user" else 0, now, conversation_id)
+            )
+
+    def add_document(self, conversation_id: str, doc_ref: dict):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO documents (conversation_id, filename, path, sha256) VALUES (?, ?, ?, ?)",
+                (conversation_id, doc_ref.get("filename"), doc_ref.get("path"), doc_ref.get("sha256"))
+            )
+
+    def mark_file_synced(self, filename: str, conversation_id: str):
+        """Record the file's current (mtime, size) so sync() will not re-parse it."""
+        stat = os.stat(os.path.join(self.folder, filename))
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO files (filename, conversation_id, mtime, size) VALUES (?, ?, ?, ?)",
+                (filename, conversation_id, stat.st_mtime, stat.st_size)
+            )
+
+    def index_file(self, filename: str):
+        """(Re)build the catalog entry for one conversation file on disk."""
+        from conversation_log import load_conversation
+        data = load_conversation(os.path.join(self.folder, filename))
+        conversation_id = data.get("conversation_id")
+        if not conversation_id:
+            return
+        chat = data.get("chat", data.get("messages", []))
+        with self._lock:
+            owner = self._conn.execute(
+                "SELECT filename FROM conversations WHERE conversation_id = ?", (conversation_id,)
+            ).fetchone()
+        # A legacy .json that has already been migrated to a log is not the source of truth
+        if filename.endswith(".json") and owner and owner[0] != filename and owner[0].endswith(".jsonl") \
+                and os.path.exists(os.path.join(self.folder, owner[0])):
+            self.mark_file_synced(filename, conversation_id)
+            return
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM messages WHERE conversation_id = ?", (conversation_id,))
+            self._conn.execute("DELETE FROM documents WHERE conversation_id = ?", (conversation_id,))
+            self._conn.executemany(
+                "INSERT INTO messages (conversation_id, role, content) VALUES (?, ?, ?)",
+                [(conversation_id, msg.get("role"), msg.get("content", "")) for msg in chat]
+            )
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO documents (conversation_id, filename, path, sha256) VALUES (?, ?, ?, ?)",
+                [(conversation_id, d.get("filename"), d.get("path"), d.get("sha256")) for d in data.get("documents", [])]
+            )
+        self.upsert_conversation(
+            conversation_id,
+            conversation_name=data.get("conversation_name"),
+            created_at=data.get("created_at"),
+            turns=sum(1 for msg in chat if msg.get("role") == "user"),
+            filename=filename
+        )
+        self.mark_file_synced(filename, conversation_id)
+
+    def sync(self) -> int:
+        """Index new or changed conversation files and forget deleted ones. Returns files parsed."""
+        with self._lock:
+            known = {row[0]: (row[1], row[2]) for row in
+                     self._conn.execute("SELECT filename, mtime, size FROM files")}
+        on_disk = set()
+        parsed = 0
+        for name in os.listdir(self.folder):
+            if not name.endswith((".json", ".jsonl")):
+                continue
+            on_disk.add(name)
+            stat = os.stat(os.path.join(self.folder, name))
+            if known.get(name) == (stat.st_mtime, stat.st_size):
+                continue
+            try:
+                self.index_file(name)
+                parsed += 1
+            except Exception as e:
+                print(f"[WARN] Could not index {name}: {e}")
+        for name in set(known) - on_disk:
+            self._forget_file(name)
+        return parsed
+
+    def _forget_file(self, filename: str):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM files WHERE filename = ?", (filename,))
+            row = self._conn.execute(
+                "SELECT conversation_id FROM conversations WHERE filename = ?", (filename,)
+            ).fetchone()
+            if row:
+                for table in ("messages", "documents", "conversations"):
+                    self._conn.execute(f"DELETE FROM {table} WHERE conversation_id = ?", row)
+
+    # Reads
+    def list_conversations(self, limit: int = None) -> list:
+        sql = ("SELECT conversation_id, conversation_name, created_at, updated_at, turns, filename "
+               "FROM conversations ORDER BY updated_at DESC")
+        params = ()
+        if limit:
+            sql += " LIMIT ?"
+            params = (limit,)
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        keys = ("conversation_id", "conversation_name", "created_at", "updated_at", "turns", "filename")
+        return [dict(zip(keys, row)) for row in rows]
+
+    def documents(self, conversation_id: str) -> list:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT filename, path, sha256 FROM documents WHERE conversation_id = ?", (conversation_id,)
+            ).fetchall()
+        return [{"filename": f, "path": p, "sha256": h} for f, p, h in rows]
+
+    def search(self, terms: str, limit: int = 20) -> list:
+        """Full-text search over message content; one result per conversation, best match first."""
+        if not terms.strip():
+            return []
+        with self._lock:
+            if self.has_fts:
+                rows = self._conn.execute(
+                    "SELECT m.conversation_id, c.conversation_name, c.filename, "
+                    "snippet(messages, 2, '[', ']', '...', 12), bm25(messages) AS rank "
+                    "FROM messages m JOIN conversations c ON c.conversation_id = m.conversation_id "
+                    "WHERE messages MATCH ? ORDER BY rank",
+                    (_fts_query(terms),)
+                ).fetchall()
+            else:
+                rows = self._conn.execute(
+                    "SELECT m.conversation_id, c.conversation_name, c.filename, substr(m.content, 1, 120), 0 "
+                    "FROM messages m JOIN conversations c ON c.conversation_id = m.conversation_id "
+                    "WHERE m.content LIKE ?",
+                    (f"%{terms}%",)
+                ).fetchall()
+        results, seen = [], set()
+        for conversation_id, name, filename, snippet, _ in rows:
+            if conversation_id in seen:
+                continue
+            seen.add(conversation_id)
+            results.append({"conversation_id": conversation_id, "conversation_name": name,
+                            "filename": filename, "snippet": snippet})
+            if len(results) >= limit:
+                break
+        return results
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
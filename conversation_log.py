@@ -0,0 +1,213 @@
+import os
+import sys
+import json
+import time
+import threading
+from datetime import datetime
+from conversation_catalog import get_catalog
+
+CONVERSATION_DIR = "conversation"
+FSYNC_EVERY = 8
+FSYNC_INTERVAL = 2.0
+MIGRATED_SUFFIX = ".migrated"
+
+
+# Log
+class ConversationLog:
+    """
+    Append-only JSONL log for one conversation.
+
+    Every turn is written as soon as it happens, so a crash loses at most
+    the records that have not been fsynced yet (bounded by fsync_every and
+    fsync_interval; a timer syncs an idle log once the interval has passed).
+    The file is created on the first record and is never rewritten except
+    by compact().
+    """
+
+    def __init__(self, conversation_id: str, conversation_name: str, created_at: str,
+                 folder: str = CONVERSATION_DIR, fsync_every: int = FSYNC_EVERY,
+                 fsync_interval: float = FSYNC_INTERVAL, turns: int = 0, catalog=None):
+        os.makedirs(folder, exist_ok=True)
+        self.folder = folder
+        self.conversation_id = conversation_id
+        self.conversation_name = conversation_name
+        self.created_at = created_at
+        self.filename = f"{conversation_id}.jsonl"
+        self.path = os.path.join(folder, self.filename)
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.turns = turns
+        self._lock = threading.Lock()
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self._file = None
+        self._sync_timer = None
+        self.catalog = catalog or get_catalog(folder)
+
+    def _open(self):
+        is_new = not os.path.exists(self.path)
+        self._file = open(self.path, "a", encoding="utf-8")
+        if is_new:
+            self._file.write(json.dumps({
+                "type": "header",
+                "conversation_id": self.conversation_id,
+                "conversation_name": self.conversation_name,
+                "created_at": self.created_at
+            }, ensure_ascii=False) + "\n")
+            self.catalog.upsert_conversation(
+                self.conversation_id,
+                conversation_name=self.conversation_name,
+                created_at=self.created_at,
+                turns=self.turns,
+                filename=self.filename
+            )
+
+    def _write(self, record: dict, force_sync: bool = False):
+        with self._lock:
+            if self._file is None:
+                self._open()
+                force_sync = True
+            self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._file.flush()
+            self._unsynced += 1
+            now = time.monotonic()
+            if force_sync or self._unsynced >= self.fsync_every or now - self._last_sync >= self.fsync_interval:
+                self._sync()
+            elif self._sync_timer is None:
+                # Nothing may be written for a while; do not leave these records unsynced until close()
+                self._sync_timer = threading.Timer(self.fsync_interval, self._sync_on_timer)
+                self._sync_timer.daemon = True
+                self._sync_timer.start()
+
+    def _sync(self):
+        # Caller holds self._lock
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def _sync_on_timer(self):
+        with self._lock:
+            self._sync_timer = None
+            if self._file is not None and not self._file.closed and self._unsynced:
+                self._sync()
+
+    def append_message(self, role: str, content: str):
+        self._write({"type": "message", "role": role, "content": content})
+        self.catalog.add_message(self.conversation_id, role, content)
+        if role == "user":
+            self.turns += 1
+
+    def append_document(self, doc_ref: dict):
+        self._write({"type": "document", **doc_ref})
+        self.catalog.add_document(self.conversation_id, doc_ref)
+
+    def rename(self, conversation_name: str):
+        self.conversation_name = conversation_name
+        self._write({"type": "rename", "conversation_name": conversation_name}, force_sync=True)
+        self.catalog.upsert_conversation(self.conversation_id, conversation_name=conversation_name)
+
+    def close(self):
+        with self._lock:
+            if self._sync_timer is not None:
+                self._sync_timer.cancel()
+                self._sync_timer = None
+            if self._file is None or self._file.closed:
+                return
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+        self.catalog.mark_file_synced(self.filename, self.conversation_id)
+
+
+# Reading
+def iter_records(path: str):
+    """Stream records from a log, skipping a torn final line left by a crash."""
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                print(f"[WARN] Skipping unreadable record in {path}")
+
+def load_conversation(path: str) -> dict:
+    """Load a JSONL log (or a legacy whole-file JSON conversation) into the legacy dict shape."""
+    if path.endswith(".json"):
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    data = {"conversation_id": None, "conversation_name": "Unnamed Conversation",
+            "created_at": None, "chat": [], "documents": []}
+    for record in iter_records(path):
+        kind = record.get("type")
+        if kind == "header":
+            data.update({k: record[k] for k in ("conversation_id", "conversation_name", "created_at") if k in record})
+        elif kind == "rename":
+            data["conversation_name"] = record["conversation_name"]
+        elif kind == "message":
+            data["chat"].append({"role": record["role"], "content": record["content"]})
+        elif kind == "document":
+            doc = {k: v for k, v in record.items() if k != "type"}
+            if doc not in data["documents"]:
+                data["documents"].append(doc)
+    return data
+
+def list_conversations(folder: str = CONVERSATION_DIR, limit: int = None) -> list:
+    """List conversations from the catalog, indexing only files changed since the last run."""
+    catalog = get_catalog(folder)
+    catalog.sync()
+    return catalog.list_conversations(limit)
+
+
+# Compaction / migration
+def write_compacted(data: dict, folder: str = CONVERSATION_DIR) -> str:
+    """Write a conversation dict as a minimal log (header, documents, messages)."""
+    os.makedirs(folder, exist_ok=True)
+    filename = f"{data['conversation_id']}.jsonl"
+    path = os.path.join(folder, filename)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(json.dumps({
+            "type": "header",
+            "conversation_id": data["conversation_id"],
+            "conversation_name": data.get("conversation_name") or "Unnamed Conversation",
+            "created_at": data.get("created_at") or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        }, ensure_ascii=False) + "\n")
+        for doc in data.get("documents", []):
+            f.write(json.dumps({"type": "document", **doc}, ensure_ascii=False) + "\n")
+        for msg in data.get("chat", []):
+            f.write(json.dumps({"type": "message", "role": msg["role"], "content": msg["content"]}, ensure_ascii=False) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    get_catalog(folder).index_file(filename)
+    return path
+
+def compact(path: str, folder: str = CONVERSATION_DIR) -> str:
+    """
+    Rewrite a log without rename records or duplicate documents. Legacy
+    .json conversations are migrated to a log once; the original file is
+    kept as .json.migrated. A legacy file whose log already exists is never
+    compacted over it, since the log may have newer turns.
+    """
+    data = load_conversation(path)
+    if not path.endswith(".json"):
+        return write_compacted(data, folder)
+    log_path = os.path.join(folder, f"{data['conversation_id']}.jsonl")
+    if not os.path.exists(log_path):
+        write_compacted(data, folder)
+    os.replace(path, path + MIGRATED_SUFFIX)
+    return log_path
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] != ["compact"]:
+        print("Usage: python conversation_log.py compact [file ...]")
+        sys.exit(1)
+    targets = sys.argv[2:] or [
+        os.path.join(CONVERSATION_DIR, f) for f in sorted(os.listdir(CONVERSATION_DIR))
+        if f.endswith((".jsonl", ".json"))
+    ]
+    for target in targets:
+        print(f"[INFO] Compacted {target} -> {compact(target)}")
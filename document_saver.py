@@ -1,66 +1,352 @@
 import os
 import io
+import sys
+import json
+import time
+import hashlib
+import threading
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 import fitz  
 import docx
 from PIL import Image
-import torch
 import numpy as np
-import chromadb
-from sentence_transformers import SentenceTransformer
-from transformers import CLIPProcessor, CLIPModel
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+from file_store import hash_file, detect_mime_type, PDF_MIME, DOCX_MIME
+from chunker import TokenChunker, CHUNK_TOKENS
 
 
 PERSIST_DIR = "embeddings7/chromadb8"
 CHUNKS_DIR = "chunks"
 TEXT_MODEL_NAME = "nomic-ai/nomic-embed-text-v1.5"
 IMAGE_MODEL_NAME = "openai/clip-vit-large-patch14"
-MAX_WORDS_PER_CHUNK = 2000
-device = "cuda" if torch.cuda.is_available() else "cpu"
+# nomic text vectors and CLIP image vectors live in unrelated spaces, so each
+# modality gets its own collection and queries only ever compare like with like
+COLLECTION_NAMES = {"text": "text_embeddings", "image": "image_embeddings"}
+LEGACY_COLLECTION_NAME = "multimodal_embeddings"
+# HNSW index settings. space/construction_ef/M are fixed when a collection is
+# created; search_ef is applied to existing collections when it changes.
+HNSW_SPACE = os.getenv("HNSW_SPACE", "cosine")
+HNSW_CONSTRUCTION_EF = int(os.getenv("HNSW_CONSTRUCTION_EF", "200"))
+HNSW_M = int(os.getenv("HNSW_M", "32"))
+HNSW_SEARCH_EF = int(os.getenv("HNSW_SEARCH_EF", "100"))
+MIGRATE_BATCH_SIZE = 500
+# {doc_id: {"doc_hash", "items"}} for documents whose every chunk and image is stored
+INGEST_MANIFEST_PATH = os.path.join(os.path.dirname(PERSIST_DIR), "ingested_documents.json")
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")   # "chroma", or "local" for local_index.py
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "32"))
+EXTRACT_WORKERS = int(os.getenv("EXTRACT_WORKERS", str(os.cpu_count() or 1)))
+PAGES_PER_TASK = int(os.getenv("PAGES_PER_TASK", "8"))
+# Start method for the extraction pool; None is the platform default. "spawn"
+# re-imports the caller's __main__ in every worker, so only guarded entry
+# points (the Pathway daemon) may use it; main.py runs at module level.
+EXTRACT_START_METHOD = os.getenv("EXTRACT_START_METHOD") or None
+IMPORT_BUDGET_SECONDS = 2.0
+OCR_ENABLED = os.getenv("OCR_ENABLED", "1") == "1"
+OCR_DPI = int(os.getenv("OCR_DPI", "300"))
+OCR_LANG = os.getenv("OCR_LANG", "eng")
+MIN_TEXT_LAYER_CHARS = 20   # pages with less extractable text than this are treated as scanned
 
-#embeddings
-text_model = SentenceTransformer(TEXT_MODEL_NAME, device=device, trust_remote_code=True)
-text_model.max_seq_length = 4096
-text_model.eval()
+os.makedirs(CHUNKS_DIR, exist_ok=True)
 
-clip_model = CLIPModel.from_pretrained(IMAGE_MODEL_NAME).to(device)
-clip_processor = CLIPProcessor.from_pretrained(IMAGE_MODEL_NAME)
-clip_model.eval()
+# Lazy model handles
+# torch, sentence-transformers, transformers and chromadb are only imported
+# (and the models only loaded) the first time something actually needs them.
+_text_model = None
+_clip = None
+_client = None
+_collections = {}
+_text_lock = threading.Lock()
+_clip_lock = threading.Lock()
+_collection_lock = threading.Lock()
 
-os.makedirs(CHUNKS_DIR, exist_ok=True)
+def get_device() -> str:
+    import torch
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+def get_text_model():
+    global _text_model
+    if _text_model is None:
+        with _text_lock:
+            if _text_model is None:
+                from sentence_transformers import SentenceTransformer
+                model = SentenceTransformer(TEXT_MODEL_NAME, device=get_device(), trust_remote_code=True)
+                # Chunks are packed to CHUNK_TOKENS, so nothing is truncated
+                model.max_seq_length = CHUNK_TOKENS
+                model.eval()
+                _text_model = model
+    return _text_model
+
+def get_clip():
+    """Return (clip_model, clip_processor), loading them on first use."""
+    global _clip
+    if _clip is None:
+        with _clip_lock:
+            if _clip is None:
+                from transformers import CLIPProcessor, CLIPModel
+                model = CLIPModel.from_pretrained(IMAGE_MODEL_NAME).to(get_device())
+                model.eval()
+                _clip = (model, CLIPProcessor.from_pretrained(IMAGE_MODEL_NAME))
+    return _clip
+
+def hnsw_metadata() -> dict:
+    return {
+        "hnsw:space": HNSW_SPACE,
+        "hnsw:construction_ef": HNSW_CONSTRUCTION_EF,
+        "hnsw:M": HNSW_M,
+        "hnsw:search_ef": HNSW_SEARCH_EF,
+    }
+
+def get_client():
+    global _client
+    if _client is None:
+        with _collection_lock:
+            if _client is None:
+                import chromadb
+                _client = chromadb.PersistentClient(path=PERSIST_DIR)
+                if LEGACY_COLLECTION_NAME in _collection_names(_client):
+                    print(f"[WARN] Found the old '{LEGACY_COLLECTION_NAME}' collection; "
+                          f"run `python document_saver.py migrate` to move it into per-modality collections.")
+    return _client
+
+def _collection_names(client) -> set:
+    # Older chromadb returns Collection objects, newer versions return names
+    return {getattr(c, "name", c) for c in client.list_collections()}
+
+def _hnsw_settings(collection) -> dict:
+    """The collection's current HNSW settings, keyed like hnsw_metadata()."""
+    config = getattr(collection, "configuration", None)
+    if isinstance(config, dict) and config.get("hnsw"):
+        # chromadb >= 1.0 keeps the live values in the collection configuration
+        hnsw = config["hnsw"]
+        return {"hnsw:space": hnsw.get("space"), "hnsw:construction_ef": hnsw.get("ef_construction"),
+                "hnsw:M": hnsw.get("max_neighbors"), "hnsw:search_ef": hnsw.get("ef_search")}
+    return collection.metadata or {}
+
+def _set_search_ef(collection):
+    try:
+        collection.modify(configuration={"hnsw": {"ef_search": HNSW_SEARCH_EF}})
+    except TypeError:
+        # chromadb < 1.0 has no configuration; search_ef lives in the metadata
+        collection.modify(metadata={**(collection.metadata or {}), "hnsw:search_ef": HNSW_SEARCH_EF})
+
+def _open_collection(client, kind: str):
+    collection = client.get_or_create_collection(name=COLLECTION_NAMES[kind], metadata=hnsw_metadata())
+    current = _hnsw_settings(collection)
+    if current.get("hnsw:search_ef") != HNSW_SEARCH_EF:
+        try:
+            _set_search_ef(collection)
+        except Exception as e:
+            print(f"[WARN] Could not set hnsw:search_ef on {collection.name}: {e}")
+    fixed = {key: value for key, value in hnsw_metadata().items() if key != "hnsw:search_ef"}
+    changed = {key: current.get(key) for key, value in fixed.items() if current.get(key, value) != value}
+    if changed:
+        print(f"[WARN] {collection.name} was built with {changed}; rebuild it (migrate --rebuild) for the new settings.")
+    return collection
 
-#Splitter 
-splitter = RecursiveCharacterTextSplitter(
-    chunk_size=MAX_WORDS_PER_CHUNK,
-    chunk_overlap=200
-)
+def get_collection(kind: str = "text"):
+    """
+    The vector collection for one modality: "text" (nomic) or "image" (CLIP).
+    A Chroma collection, or a LocalVectorIndex with the same interface when
+    VECTOR_BACKEND=local.
+    """
+    if kind not in _collections:
+        if VECTOR_BACKEND == "local":
+            from local_index import LocalVectorIndex
+            with _collection_lock:
+                if kind not in _collections:
+                    _collections[kind] = LocalVectorIndex(COLLECTION_NAMES[kind])
+            return _collections[kind]
+        if VECTOR_BACKEND != "chroma":
+            raise ValueError(f"Unknown VECTOR_BACKEND: {VECTOR_BACKEND} (expected 'chroma' or 'local')")
+        client = get_client()
+        with _collection_lock:
+            if kind not in _collections:
+                _collections[kind] = _open_collection(client, kind)
+    return _collections[kind]
 
+def warm_up(text: bool = True, image: bool = True, background: bool = True):
+    """Load the requested models ahead of first use, optionally on a daemon thread."""
+    def _load():
+        try:
+            if text:
+                get_text_model()
+            if image:
+                get_clip()
+        except Exception as e:
+            print(f"[ERROR] Model warm-up failed: {e}")
+    if not background:
+        _load()
+        return None
+    thread = threading.Thread(target=_load, name="document-saver-warmup", daemon=True)
+    thread.start()
+    return thread
+
+#Splitter (token-aware, see chunker.py)
 def split_text_to_chunks(text: str):
     if not text.strip():
         return []
-    return splitter.split_text(text)
+    chunker = TokenChunker()
+    return [chunk.text for chunk in chunker.feed(None, text) + chunker.finish()]
 
-# Extraction 
-def extract_text_from_pdf(pdf_path: str):
-    txts = []
-    with fitz.open(pdf_path) as doc:
-        for page in doc:
-            txts.append(page.get_text("text"))
-    return txts
+# Hashing (hash_file comes from file_store)
+def hash_bytes(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
 
-def extract_images_from_pdf(pdf_path: str):
-    images = []
+
+def document_id(doc_path: str) -> str:
+    """Identity of a document in the store; two files named report.pdf in different folders stay apart."""
+    return os.path.abspath(doc_path)
+
+def content_id(doc_id: str, kind: str, content_hash: str, occurrence: int) -> str:
+    """Stable id derived from the document and the content, so unchanged chunks keep their id when pages shift."""
+    doc_key = hash_bytes(doc_id.encode("utf-8"))[:12]
+    return f"{os.path.basename(doc_id)}_{doc_key}_{kind}_{content_hash[:16]}_{occurrence}"
+
+# OCR
+# pytesseract and OpenCV are optional; without them scanned pages simply stay
+# empty. Checked once per process, since this also runs in extraction workers.
+_ocr_available = None
+
+def ocr_available() -> bool:
+    global _ocr_available
+    if _ocr_available is None:
+        try:
+            import cv2
+            import pytesseract
+            pytesseract.get_tesseract_version()
+            _ocr_available = True
+        except Exception as e:
+            print(f"[WARN] OCR unavailable ({e}); pages without a text layer will not be searchable.")
+            _ocr_available = False
+    return _ocr_available
+
+def ocr_image(image: np.ndarray) -> str:
+    """Grayscale, denoise and Otsu-binarize with OpenCV, then run Tesseract."""
+    import cv2
+    import pytesseract
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+    image = cv2.medianBlur(image, 3)
+    _, binary = cv2.threshold(image, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    return pytesseract.image_to_string(binary, lang=OCR_LANG)
+
+def _ocr_pdf_page(page) -> str:
+    pix = page.get_pixmap(dpi=OCR_DPI, colorspace=fitz.csGRAY)
+    image = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width, pix.n)
+    return ocr_image(image[:, :, 0])
+
+def needs_ocr(text: str) -> bool:
+    return OCR_ENABLED and len(text.strip()) < MIN_TEXT_LAYER_CHARS and ocr_available()
+
+# Extraction 
+def _extract_pdf_page_range(pdf_path: str, start: int, stop: int):
+    """
+    Worker: open the PDF once and return ((page, text, images) for pages
+    [start, stop), pages that were OCR'd), with images already decoded as
+    (img_index, image, hash). Only pages without a usable text layer are
+    rendered and OCR'd, so born-digital PDFs cost nothing extra.
+    """
+    pages = []
+    ocr_pages = []
     with fitz.open(pdf_path) as doc:
-        for i, page in enumerate(doc):
+        for i in range(start, stop):
+            page = doc[i]
+            images = []
             for img_index, img in enumerate(page.get_images(full=True)):
                 try:
                     xref = img[0]
                     base_image = doc.extract_image(xref)
                     pil_image = Image.open(io.BytesIO(base_image["image"])).convert("RGB")
-                    image_id = f"{os.path.basename(pdf_path)}_page_{i}_img_{img_index}"
-                    images.append((i, pil_image, image_id))
+                    images.append((img_index, pil_image, hash_bytes(base_image["image"])))
                 except Exception as e:
                     print(f"[!] Error extracting image {img_index} on page {i}: {e}")
+            text = page.get_text("text")
+            if needs_ocr(text):
+                try:
+                    ocr_text = _ocr_pdf_page(page)
+                    if len(ocr_text.strip()) > len(text.strip()):
+                        text = ocr_text
+                        ocr_pages.append(i)
+                except Exception as e:
+                    print(f"[!] OCR failed on page {i}: {e}")
+            pages.append((i, text, images))
+    return pages, ocr_pages
+
+def iter_pdf_pages(pdf_path: str, workers: int = EXTRACT_WORKERS, pages_per_task: int = PAGES_PER_TASK):
+    """
+    Single-pass, page-parallel PDF extraction. Page ranges are farmed out to
+    a process pool and yielded in page order as soon as each range is ready,
+    so the caller can embed early pages while later ones are still extracting.
+    OCR of scanned pages happens inside the same workers.
+    """
+    with fitz.open(pdf_path) as doc:
+        page_count = doc.page_count
+    ocr_count = 0
+    if workers <= 1 or page_count <= pages_per_task:
+        pages, ocr_pages = _extract_pdf_page_range(pdf_path, 0, page_count)
+        ocr_count = len(ocr_pages)
+        yield from pages
+    else:
+        context = multiprocessing.get_context(EXTRACT_START_METHOD)
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+            futures = [
+                pool.submit(_extract_pdf_page_range, pdf_path, start, min(start + pages_per_task, page_count))
+                for start in range(0, page_count, pages_per_task)
+            ]
+            for future in futures:
+                pages, ocr_pages = future.result()
+                ocr_count += len(ocr_pages)
+                yield from pages
+    if ocr_count:
+        print(f"[INFO] OCR'd {ocr_count} of {page_count} pages in {os.path.basename(pdf_path)} (no text layer).")
+
+def iter_document_pages(doc_path: str):
+    """
+    Yield (page, text, images) for a PDF, DOCX (one paragraph per page),
+    standalone image (OCR'd for its text) or plain text file. The type is
+    sniffed from the content, not the extension.
+    """
+    mime_type = detect_mime_type(doc_path)
+    if mime_type == PDF_MIME:
+        yield from iter_pdf_pages(doc_path)
+    elif mime_type == DOCX_MIME:
+        for i, paragraph in enumerate(extract_text_from_docx(doc_path)):
+            yield i, paragraph, []
+    elif mime_type.startswith("image/"):
+        try:
+            with open(doc_path, "rb") as f:
+                raw = f.read()
+            img = Image.open(io.BytesIO(raw)).convert("RGB")
+        except Exception as e:
+            print(f"[ERROR] Failed to load image {os.path.basename(doc_path)}: {e}")
+            return
+        text = ""
+        if needs_ocr(text):
+            try:
+                text = ocr_image(np.asarray(img))
+            except Exception as e:
+                print(f"[!] OCR failed on {os.path.basename(doc_path)}: {e}")
+        yield None, text, [(0, img, hash_bytes(raw))]
+    elif mime_type.startswith("text/"):
+        with open(doc_path, "r", encoding="utf-8", errors="replace") as f:
+            yield None, f.read(), []
+    else:
+        print(f"[WARN] Unsupported document type {mime_type}: {os.path.basename(doc_path)}")
+
+def extract_document_text(doc_path: str) -> str:
+    """All text of a document, including OCR'd pages, as one string."""
+    return "\n\n".join(text for _, text, _ in iter_document_pages(doc_path) if text.strip())
+
+def extract_text_from_pdf(pdf_path: str):
+    return [text for _, text, _ in iter_pdf_pages(pdf_path)]
+
+def extract_images_from_pdf(pdf_path: str):
+    images = []
+    for i, _, page_images in iter_pdf_pages(pdf_path):
+        for img_index, pil_image, img_hash in page_images:
+            image_id = f"{os.path.basename(pdf_path)}_page_{i}_img_{img_index}"
+            images.append((i, pil_image, image_id, img_hash))
     return images
 
 def extract_text_from_docx(path: str):
@@ -71,79 +357,414 @@ def extract_text_from_docx(path: str):
 def embed_text_chunk(text: str) -> np.ndarray:
     if not text.strip():
         return None
-    emb = text_model.encode(text, convert_to_tensor=True, normalize_embeddings=True)
+    emb = get_text_model().encode(text, convert_to_tensor=True, normalize_embeddings=True)
     return emb.cpu().numpy()
 
 def embed_image(image: Image.Image) -> np.ndarray:
-    inputs = clip_processor(images=image, return_tensors="pt").to(device)
+    import torch
+    clip_model, clip_processor = get_clip()
+    inputs = clip_processor(images=image, return_tensors="pt").to(get_device())
     with torch.no_grad():
         features = clip_model.get_image_features(**inputs)
         features = features / features.norm(dim=-1, keepdim=True)
     return features.squeeze().cpu().numpy()
 
+def embed_text_chunks(texts, batch_size: int = EMBED_BATCH_SIZE) -> np.ndarray:
+    """Encode a list of chunks in batches of batch_size; returns an (n, dim) array."""
+    return get_text_model().encode(
+        list(texts),
+        batch_size=batch_size,
+        convert_to_numpy=True,
+        normalize_embeddings=True,
+        show_progress_bar=False
+    )
+
+def embed_images(images, batch_size: int = EMBED_BATCH_SIZE) -> np.ndarray:
+    """Run CLIP over images in batches of batch_size; returns an (n, dim) array."""
+    import torch
+    clip_model, clip_processor = get_clip()
+    device = get_device()
+    batches = []
+    for start in range(0, len(images), batch_size):
+        inputs = clip_processor(images=images[start:start + batch_size], return_tensors="pt").to(device)
+        with torch.no_grad():
+            features = clip_model.get_image_features(**inputs)
+            features = features / features.norm(dim=-1, keepdim=True)
+        batches.append(features.cpu().numpy())
+    return np.concatenate(batches) if batches else np.empty((0, 0), dtype=np.float32)
+
+def embed_query_text(query: str) -> np.ndarray:
+    return embed_text_chunk(query)
+
+def embed_text_for_image_search(text: str) -> np.ndarray:
+    """CLIP text features, comparable with the stored CLIP image vectors."""
+    import torch
+    clip_model, clip_processor = get_clip()
+    inputs = clip_processor(text=[text], return_tensors="pt", padding=True, truncation=True).to(get_device())
+    with torch.no_grad():
+        features = clip_model.get_text_features(**inputs)
+        features = features / features.norm(dim=-1, keepdim=True)
+    return features.squeeze().cpu().numpy()
+
 # database
-client = chromadb.PersistentClient(path=PERSIST_DIR)
-collection_name = "multimodal_embeddings"
-if collection_name in [c.name for c in client.list_collections()]:
-    col = client.get_collection(collection_name)
-else:
-    col = client.create_collection(name=collection_name)
-
-def store_in_chroma(ids, embeddings, metadatas, documents):
+def store_in_chroma(kind, ids, embeddings, metadatas, documents):
     if not embeddings:
         print("[WARN] No embeddings to store, skipping.")
         return
-    col.add(ids=ids, embeddings=embeddings, metadatas=metadatas, documents=documents)
+    get_collection(kind).upsert(ids=ids, embeddings=embeddings, metadatas=metadatas, documents=documents)
+
+def _get_entries(where: dict) -> dict:
+    entries = {}
+    for kind in COLLECTION_NAMES:
+        result = get_collection(kind).get(where=where, include=["metadatas"])
+        entries.update(zip(result["ids"], result["metadatas"]))
+    return entries
+
+def get_stored_entries(doc_id: str) -> dict:
+    """Return {id: metadata} for everything stored for one document (see document_id), across both collections."""
+    return _get_entries({"doc_id": doc_id})
+
+def _legacy_entries(doc_name: str) -> dict:
+    # Entries written before documents had an id only carry the file name;
+    # they are replaced the first time a document of that name is re-ingested
+    return {item_id: meta for item_id, meta in _get_entries({"source": doc_name}).items() if "doc_id" not in meta}
+
+def _ids_by_kind(ids, metadatas: dict) -> dict:
+    grouped = {}
+    for item_id in ids:
+        grouped.setdefault(metadatas[item_id].get("type", "text"), []).append(item_id)
+    return grouped
+
+def _delete_entries(ids, metadatas: dict):
+    for kind, kind_ids in _ids_by_kind(ids, metadatas).items():
+        get_collection(kind).delete(ids=kind_ids)
+
+def delete_document(doc_id: str) -> int:
+    """Remove every entry of one document, given its document_id."""
+    stored = get_stored_entries(doc_id)
+    _delete_entries(stored, stored)
+    _set_ingested(doc_id, None)
+    return len(stored)
+
+# Completion records
+_manifest_lock = threading.Lock()
+
+def _load_manifest() -> dict:
+    if not os.path.exists(INGEST_MANIFEST_PATH):
+        return {}
+    try:
+        with open(INGEST_MANIFEST_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _set_ingested(doc_id: str, record):
+    """Record (or with None, forget) that a document is fully stored."""
+    with _manifest_lock:
+        manifest = _load_manifest()
+        if record is None and doc_id not in manifest:
+            return
+        if record is None:
+            manifest.pop(doc_id)
+        else:
+            manifest[doc_id] = record
+        os.makedirs(os.path.dirname(INGEST_MANIFEST_PATH) or ".", exist_ok=True)
+        tmp = INGEST_MANIFEST_PATH + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp, INGEST_MANIFEST_PATH)
+
+def migrate_legacy_collection(keep_legacy: bool = False, rebuild: bool = False) -> dict:
+    """
+    Copy the vectors of the old single multimodal_embeddings collection into
+    the per-modality collections, routed by their "type" metadata, then drop
+    it. No re-embedding is needed. rebuild=True also recreates the current
+    collections first, e.g. after changing HNSW_SPACE, HNSW_M or
+    HNSW_CONSTRUCTION_EF.
+    """
+    if VECTOR_BACKEND != "chroma":
+        print("[ERROR] migrate works on the Chroma store; use `python local_index.py import-chroma` "
+              "to fill the local index.")
+        return {}
+    client = get_client()
+    names = _collection_names(client)
+    sources = {}
+    if rebuild:
+        for kind, name in COLLECTION_NAMES.items():
+            if name in names:
+                sources.setdefault(name, client.get_collection(name))
+    if LEGACY_COLLECTION_NAME in names:
+        sources[LEGACY_COLLECTION_NAME] = client.get_collection(LEGACY_COLLECTION_NAME)
+    if not sources:
+        print("[INFO] Nothing to migrate.")
+        return {}
+
+    # Read everything out before any collection is recreated
+    pending = {kind: [] for kind in COLLECTION_NAMES}
+    for name, collection in sources.items():
+        for offset in range(0, collection.count(), MIGRATE_BATCH_SIZE):
+            batch = collection.get(limit=MIGRATE_BATCH_SIZE, offset=offset,
+                                   include=["embeddings", "metadatas", "documents"])
+            for row in zip(batch["ids"], batch["embeddings"], batch["metadatas"], batch["documents"]):
+                kind = "image" if row[2].get("type") == "image" else "text"
+                pending[kind].append(row)
+    if rebuild:
+        with _collection_lock:
+            _collections.clear()
+        for name in sources:
+            if name != LEGACY_COLLECTION_NAME:
+                client.delete_collection(name)
+
+    counts = {}
+    for kind, rows in pending.items():
+        collection = get_collection(kind)
+        for start in range(0, len(rows), MIGRATE_BATCH_SIZE):
+            ids, embeddings, metadatas, documents = zip(*rows[start:start + MIGRATE_BATCH_SIZE])
+            collection.upsert(ids=list(ids), embeddings=[list(map(float, e)) for e in embeddings],
+                              metadatas=list(metadatas), documents=list(documents))
+        counts[kind] = collection.count()
+        print(f"[INFO] {COLLECTION_NAMES[kind]}: {len(rows)} vectors migrated, {counts[kind]} total.")
+    if LEGACY_COLLECTION_NAME in sources and not keep_legacy:
+        client.delete_collection(LEGACY_COLLECTION_NAME)
+        print(f"[INFO] Removed the old '{LEGACY_COLLECTION_NAME}' collection.")
+    return counts
+
+def index_recall(kind: str = "text", k: int = 10, samples: int = 100, seed: int = 0) -> dict:
+    """
+    Recall@k and query latency of the HNSW index against exact search,
+    using stored vectors as queries. For tuning HNSW_SEARCH_EF and HNSW_M.
+    """
+    collection = get_collection(kind)
+    data = collection.get(include=["embeddings"])
+    if not data["ids"]:
+        print(f"[INFO] {COLLECTION_NAMES[kind]} is empty.")
+        return {}
+    ids = np.array(data["ids"])
+    vectors = np.asarray(data["embeddings"], dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-12
+    k = min(k, len(ids))
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(len(ids), size=min(samples, len(ids)), replace=False)
+    hits, latencies = 0, []
+    for i in picks:
+        # Vectors are normalized, so cosine, l2 and ip agree on the exact top-k
+        exact = set(ids[np.argsort(-(vectors @ vectors[i]))[:k]])
+        start = time.perf_counter()
+        result = collection.query(query_embeddings=[vectors[i].tolist()], n_results=k, include=[])
+        latencies.append(time.perf_counter() - start)
+        hits += len(exact & set(result["ids"][0]))
+    stats = {
+        "collection": COLLECTION_NAMES[kind],
+        "vectors": len(ids),
+        "recall": hits / (k * len(picks)),
+        "p50_ms": float(np.percentile(latencies, 50) * 1000),
+        "p99_ms": float(np.percentile(latencies, 99) * 1000),
+    }
+    settings = f"M={HNSW_M}, construction_ef={HNSW_CONSTRUCTION_EF}, search_ef={HNSW_SEARCH_EF}"
+    if VECTOR_BACKEND == "local":
+        from local_index import VECTOR_DTYPE, IVF_PROBE
+        settings = f"local {VECTOR_DTYPE}, ivf probe={IVF_PROBE}"
+    print(f"[INFO] {stats['collection']}: {stats['vectors']} vectors, recall@{k}={stats['recall']:.3f}, "
+          f"query p50={stats['p50_ms']:.1f}ms p99={stats['p99_ms']:.1f}ms ({settings})")
+    return stats
+
+# Batching
+class IngestionBatcher:
+    """
+    Collects text chunks and images across documents and embeds them
+    batch_size at a time, with a single upsert per flushed batch.
+    """
+
+    def __init__(self, batch_size: int = EMBED_BATCH_SIZE):
+        self.batch_size = batch_size
+        self.pending = {"text": [], "image": []}
+        self._after_flush = []
+        self.counts = {"text": 0, "image": 0}
+        self.embed_seconds = {"text": 0.0, "image": 0.0}
+        self.started_at = time.perf_counter()
+
+    def add_text(self, item_id: str, text: str, metadata: dict):
+        if not text.strip():
+            return
+        self.pending["text"].append((item_id, text, metadata))
+        if len(self.pending["text"]) >= self.batch_size:
+            self.flush("text")
+
+    def add_image(self, item_id: str, image: Image.Image, metadata: dict):
+        self.pending["image"].append((item_id, image, metadata))
+        if len(self.pending["image"]) >= self.batch_size:
+            self.flush("image")
+
+    def flush(self, kind: str = None):
+        for k in ([kind] if kind else ["text", "image"]):
+            batch = self.pending[k]
+            if not batch:
+                continue
+            self.pending[k] = []
+            ids = [item_id for item_id, _, _ in batch]
+            metadatas = [meta for _, _, meta in batch]
+            start = time.perf_counter()
+            try:
+                if k == "text":
+                    documents = [text for _, text, _ in batch]
+                    embeddings = embed_text_chunks(documents, self.batch_size)
+                else:
+                    documents = [""] * len(batch)
+                    embeddings = embed_images([img for _, img, _ in batch], self.batch_size)
+                self.embed_seconds[k] += time.perf_counter() - start
+                self.counts[k] += len(batch)
+                store_in_chroma(k, ids, embeddings.tolist(), metadatas, documents)
+            except Exception:
+                # The documents in the lost batch are incomplete: keep their
+                # old entries and do not mark them ingested
+                self._after_flush = []
+                raise
+        if self._after_flush and not any(self.pending.values()):
+            # Every queued item is stored now, so the work waiting on it can run
+            after_flush, self._after_flush = self._after_flush, []
+            for func, args in after_flush:
+                func(*args)
+
+    def after_flush(self, func, *args):
+        """Run func(*args) once everything queued so far has been embedded and stored."""
+        if any(self.pending.values()):
+            self._after_flush.append((func, args))
+        else:
+            func(*args)
+
+    def report(self) -> dict:
+        wall = time.perf_counter() - self.started_at
+        stats = {
+            "batch_size": self.batch_size,
+            "text_chunks": self.counts["text"],
+            "images": self.counts["image"],
+            "wall_seconds": wall,
+            "text_chunks_per_sec": self.counts["text"] / self.embed_seconds["text"] if self.embed_seconds["text"] else 0.0,
+            "images_per_sec": self.counts["image"] / self.embed_seconds["image"] if self.embed_seconds["image"] else 0.0,
+        }
+        print(
+            f"[INFO] Embedded {stats['text_chunks']} chunks ({stats['text_chunks_per_sec']:.1f} chunks/sec) "
+            f"and {stats['images']} images ({stats['images_per_sec']:.1f} images/sec) "
+            f"with batch_size={self.batch_size} in {wall:.1f}s"
+        )
+        return stats
 
 # Main
-def save_documents_for_future(documents):
+def _chunk_item(chunk, doc_meta: dict):
+    page_meta = {}
+    if chunk.page_start is not None:
+        # "page" stays the first page so older readers still work
+        page_meta = {"page": chunk.page_start, "page_start": chunk.page_start, "page_end": chunk.page_end}
+    return "text", hash_bytes(chunk.text.encode("utf-8")), chunk.text, {"type": "text", **doc_meta, **page_meta}
+
+def _iter_document_items(doc_path: str, doc_meta: dict):
+    """
+    Yield (kind, content_hash, payload, metadata) for every chunk and image,
+    streamed page by page. Text chunks are packed across page boundaries.
+    """
+    chunker = TokenChunker()
+    for i, page_text, page_images in iter_document_pages(doc_path):
+        for chunk in chunker.feed(i, page_text):
+            yield _chunk_item(chunk, doc_meta)
+        page_meta = {} if i is None else {"page": i}
+        for _, img, img_hash in page_images:
+            yield "img", img_hash, img, {"type": "image", **doc_meta, **page_meta}
+    for chunk in chunker.finish():
+        yield _chunk_item(chunk, doc_meta)
+
+def ingest_document(doc_path: str, batcher: "IngestionBatcher") -> dict:
+    """
+    Incrementally (re)ingest one document. Chunks already stored under the
+    same content id are skipped, new ones are upserted, and entries that no
+    longer exist in the document are deleted once the batcher has stored
+    their replacements, so a failed ingest never leaves the document
+    unindexed. The document is only skipped as unchanged when an ingest of
+    this exact content completed.
+    """
+    doc_id = document_id(doc_path)
+    doc_name = os.path.basename(doc_path)
+    doc_hash = hash_file(doc_path)
+    stored = get_stored_entries(doc_id)
+    legacy = _legacy_entries(doc_name)
+    stats = {"source": doc_name, "doc_id": doc_id, "added": 0, "kept": 0, "deleted": 0, "unchanged": False}
+
+    completed = _load_manifest().get(doc_id)
+    if stored and not legacy and completed == {"doc_hash": doc_hash, "items": len(stored)}:
+        stats["unchanged"] = True
+        stats["kept"] = len(stored)
+        print(f"[INFO] {doc_name} is unchanged, skipping.")
+        return stats
+
+    seen_ids = set()
+    occurrences = {}
+    update_ids, update_metas = [], []
+    for kind, item_hash, payload, metadata in _iter_document_items(doc_path, {"source": doc_name, "doc_id": doc_id}):
+        occurrence = occurrences.get((kind, item_hash), 0)
+        occurrences[(kind, item_hash)] = occurrence + 1
+        if kind == "text" and not payload.strip():
+            continue
+        item_id = content_id(doc_id, kind, item_hash, occurrence)
+        seen_ids.add(item_id)
+        metadata.update({"doc_hash": doc_hash, "chunk_hash": item_hash})
+
+        if item_id in stored:
+            # Same content, only the page or document hash may have moved
+            stats["kept"] += 1
+            if stored[item_id] != metadata:
+                update_ids.append(item_id)
+                update_metas.append(metadata)
+            continue
+        stats["added"] += 1
+        if kind == "text":
+            batcher.add_text(item_id, payload, metadata)
+        else:
+            batcher.add_image(item_id, payload, metadata)
+
+    # New items stay queued in the batcher so batches can span documents;
+    # the stale entries they replace are removed only after they are stored
+    new_metas = dict(zip(update_ids, update_metas))
+    for kind, ids in _ids_by_kind(update_ids, stored).items():
+        get_collection(kind).update(ids=ids, metadatas=[new_metas[item_id] for item_id in ids])
+    stale = {item_id: meta for item_id, meta in stored.items() if item_id not in seen_ids}
+    stale.update(legacy)
+    if stale:
+        batcher.after_flush(_delete_entries, stale, stale)
+    batcher.after_flush(_set_ingested, doc_id, {"doc_hash": doc_hash, "items": len(seen_ids)})
+    stats["deleted"] = len(stale)
+    print(f"[INFO] {doc_name}: {stats['added']} queued for embedding, {stats['kept']} reused, {stats['deleted']} to be removed.")
+    return stats
+
+def save_documents_for_future(documents, batch_size: int = EMBED_BATCH_SIZE):
+    batcher = IngestionBatcher(batch_size)
     for doc in documents:
         doc_path = doc["path"]
-        doc_name = os.path.basename(doc_path)
-        embeddings = []
-        ids = []
-        metadatas = []
-        docs_text = []
-
-        # Text 
-        text_pages = []
-        if doc_path.lower().endswith(".pdf"):
-            text_pages = extract_text_from_pdf(doc_path)
-        elif doc_path.lower().endswith(".docx"):
-            text_pages = extract_text_from_docx(doc_path)
-
-        for i, page_text in enumerate(text_pages):
-            chunks = split_text_to_chunks(page_text)
-            for j, chunk in enumerate(chunks):
-                emb = embed_text_chunk(chunk)
-                if emb is not None:
-                    embeddings.append(emb)
-                    ids.append(f"{doc_name}_text_{i}_{j}")
-                    metadatas.append({"type": "text", "source": doc_name, "page": i})
-                    docs_text.append(chunk)
-
-        # Images in PDFs
-        if doc_path.lower().endswith(".pdf"):
-            images = extract_images_from_pdf(doc_path)
-            for i, img, img_id in images:
-                emb = embed_image(img)
-                embeddings.append(emb)
-                ids.append(img_id)
-                metadatas.append({"type": "image", "source": doc_name, "page": i})
-                docs_text.append("")
-
-        # Images 
-        if doc_path.lower().endswith((".png", ".jpg", ".jpeg")):
-            try:
-                img = Image.open(doc_path).convert("RGB")
-                emb = embed_image(img)
-                embeddings.append(emb)
-                ids.append(doc_name)
-                metadatas.append({"type": "image", "source": doc_name})
-                docs_text.append("")
-                print(f"[INFO] Embedded standalone image: {doc_name}")
-            except Exception as e:
-                print(f"[ERROR] Failed to embed image {doc_name}: {e}")
+        if not os.path.exists(doc_path):
+            print(f"[WARN] {doc_path} no longer exists, skipping.")
+            continue
+        ingest_document(doc_path, batcher)
+
+    # Embed whatever is left in partially filled batches
+    batcher.flush()
+    return batcher.report()
+
+def measure_import_seconds() -> float:
+    """Time a cold `import document_saver` in a fresh interpreter."""
+    code = "import time; t = time.perf_counter(); import document_saver; print(time.perf_counter() - t)"
+    out = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True, text=True, check=True
+    )
+    return float(out.stdout.strip().splitlines()[-1])
+
 
-        # Store in Chroma 
-        store_in_chroma(ids, embeddings, metadatas, docs_text)
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["check-import"]:
+        seconds = measure_import_seconds()
+        print(f"[INFO] import document_saver took {seconds:.2f}s (budget {IMPORT_BUDGET_SECONDS:.2f}s)")
+        sys.exit(0 if seconds <= IMPORT_BUDGET_SECONDS else 1)
+    if sys.argv[1:2] == ["migrate"]:
+        migrate_legacy_collection(keep_legacy="--keep-legacy" in sys.argv, rebuild="--rebuild" in sys.argv)
+    elif sys.argv[1:2] == ["index-recall"]:
+        for kind in COLLECTION_NAMES:
+            index_recall(kind)
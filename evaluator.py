@@ -1,15 +1,11 @@
-import os
 from dotenv import load_dotenv
 from typing import Dict, Optional
 from pydantic import BaseModel, Field
-from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.messages import SystemMessage, HumanMessage
+from llm_backend import get_backend
 
 
 load_dotenv()
-API_KEY_BACKUP = os.getenv("GOOGLE_API_KEY")
-if not API_KEY_BACKUP:
-    raise ValueError("Missing GOOGLE_API_KEY in .env file")
 
 
 # Schema
@@ -57,23 +53,46 @@ Always respond as **valid JSON only**:
 
 # Decision Agent 
 class DecisionAgent:
-    def __init__(self, api_key: Optional[str] = None):
-        if api_key is None:
-            api_key = API_KEY_BACKUP
-        self.model = ChatGoogleGenerativeAI(
-            model="gemini-2.5-flash",
-            google_api_key=api_key
-        )
-        self.structured_model = self.model.with_structured_output(MemoryDecision)
+    def __init__(self, api_key: Optional[str] = None, pre_classifier=None, backend=None):
+        self.pre_classifier = pre_classifier
+        self.backend = backend or get_backend(api_key)
 
-    def analyze_query(self, query: str) -> Dict:
-        """Analyze user query and extract decision."""
-        parsed_result: MemoryDecision = self.structured_model.invoke([
+    def local_decision(self, query: str) -> Optional[Dict]:
+        """The pre-classifier's decision if it is confident, else None (the LLM has to decide)."""
+        if self.pre_classifier is None:
+            return None
+        local = self.pre_classifier.classify(query)
+        if not self.pre_classifier.is_confident(local):
+            return None
+        return {
+            "Need_web": local["Need_web"],
+            "update_user_data": local["update_user_data"],
+            "new_info": local["new_info"]
+        }
+
+    def analyze_query(self, query: str, use_pre_classifier: bool = True, local_checked: bool = False) -> Dict:
+        """
+        Analyze user query and extract decision.
+        A confident local pre-classifier result skips the LLM call entirely;
+        local_checked=True means the caller already tried local_decision.
+        """
+        if use_pre_classifier and not local_checked:
+            local = self.local_decision(query)
+            if local is not None:
+                return local
+
+        parsed_result: MemoryDecision = self.backend.structured([
             SYSTEM_PROMPT,
             HumanMessage(content=query)
-        ])
-        return {
+        ], MemoryDecision, caller="decision")
+        decision = {
             "Need_web": parsed_result.Need_web,
             "update_user_data": parsed_result.update_user_data,
             "new_info": parsed_result.new_info
         }
+        if use_pre_classifier and self.pre_classifier is not None and not decision["update_user_data"]:
+            try:
+                self.pre_classifier.add_example(query, decision["Need_web"])
+            except Exception as e:
+                print(f"[ERROR] Failed to record classifier example: {e}")
+        return decision
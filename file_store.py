@@ -0,0 +1,188 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import mimetypes
+import threading
+import zipfile
+
+FILE_STORE_ENV = "FILE_STORE"        # "gemini" or "local"; defaults to match the LLM backend
+LOCAL_STORE_DIR = "file_store"
+GEMINI_INDEX_PATH = os.path.join(LOCAL_STORE_DIR, "gemini_files.json")
+COPY_CHUNK_BYTES = 1 << 20
+EXPIRY_MARGIN_SECONDS = 15 * 60      # re-upload a little before the Files API drops the file
+GEMINI_FILE_TTL_SECONDS = 48 * 3600
+SNIFF_BYTES = 4096
+
+PDF_MIME = "application/pdf"
+DOCX_MIME = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+XLSX_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+PPTX_MIME = "application/vnd.openxmlformats-officedocument.presentationml.presentation"
+MAGIC_NUMBERS = [
+    (b"%PDF-", PDF_MIME),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"II*\x00", "image/tiff"),
+    (b"MM\x00*", "image/tiff"),
+]
+# Office Open XML files are ZIP archives; the top-level folder tells them apart
+ZIP_MEMBER_TYPES = [("word/", DOCX_MIME), ("xl/", XLSX_MIME), ("ppt/", PPTX_MIME)]
+# What the model can read straight from a file reference
+MODEL_READABLE_PREFIXES = (PDF_MIME, "image/", "text/")
+
+
+def _zip_mime_type(path: str) -> str:
+    try:
+        with zipfile.ZipFile(path) as archive:
+            names = archive.namelist()
+    except zipfile.BadZipFile:
+        return "application/zip"
+    for prefix, mime_type in ZIP_MEMBER_TYPES:
+        if any(name.startswith(prefix) for name in names):
+            return mime_type
+    return "application/zip"
+
+def _looks_like_text(head: bytes) -> bool:
+    if b"\x00" in head:
+        return False
+    try:
+        head.decode("utf-8")
+    except UnicodeDecodeError as e:
+        # A multi-byte character cut off at the end of the sniffed block is fine
+        return e.start >= len(head) - 3
+    return True
+
+def detect_mime_type(path: str) -> str:
+    """MIME type from the file's magic bytes; the extension is only a fallback."""
+    guessed = mimetypes.guess_type(path)[0]
+    try:
+        with open(path, "rb") as f:
+            head = f.read(SNIFF_BYTES)
+    except OSError:
+        return guessed or "application/octet-stream"
+    for signature, mime_type in MAGIC_NUMBERS:
+        if head.startswith(signature):
+            return mime_type
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    if head.startswith(b"PK\x03\x04"):
+        return _zip_mime_type(path)
+    if head and _looks_like_text(head):
+        return guessed if guessed and guessed.startswith("text/") else "text/plain"
+    return guessed or "application/octet-stream"
+
+def model_readable(mime_type: str) -> bool:
+    return mime_type.startswith(MODEL_READABLE_PREFIXES)
+
+
+def hash_file(path: str) -> str:
+    """sha256 of a file, read in blocks so large PDFs never sit in memory."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(COPY_CHUNK_BYTES), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class LocalFileStore:
+    """
+    Content-addressed copy of uploads on local disk. Used with StubBackend
+    and as a fallback; handles point at the stored copy, so the original
+    upload may be moved or deleted afterwards.
+    """
+
+    kind = "local"
+
+    def __init__(self, folder: str = LOCAL_STORE_DIR):
+        os.makedirs(folder, exist_ok=True)
+        self.folder = folder
+
+    def put(self, path: str, mime_type: str, sha256: str) -> dict:
+        ext = os.path.splitext(path)[1].lower()
+        target = os.path.join(self.folder, sha256 + ext)
+        if not os.path.exists(target):
+            # Always a private copy in a fresh temp file: linking to the upload would let
+            # later edits of the original change the stored blob, and opening a shared
+            # temp name for writing could truncate someone else's file
+            fd, tmp = tempfile.mkstemp(dir=self.folder, prefix=sha256[:16], suffix=".tmp")
+            try:
+                with open(path, "rb") as src, os.fdopen(fd, "wb") as dst:
+                    shutil.copyfileobj(src, dst, COPY_CHUNK_BYTES)
+                    dst.flush()
+                    os.fsync(dst.fileno())
+                os.replace(tmp, target)
+            except BaseException:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+                raise
+        return {"store": self.kind, "uri": os.path.abspath(target), "mime_type": mime_type,
+                "sha256": sha256, "size": os.path.getsize(target)}
+
+    def is_valid(self, handle: dict) -> bool:
+        return bool(handle) and handle.get("store") == self.kind and os.path.exists(handle["uri"])
+
+
+class GeminiFileStore:
+    """
+    Uploads each distinct file once to the Gemini Files API and keeps the
+    returned handle, indexed by sha256, until shortly before it expires.
+    Turns then send a file reference instead of the file's bytes.
+    """
+
+    kind = "gemini"
+
+    def __init__(self, backend, index_path: str = GEMINI_INDEX_PATH):
+        self.backend = backend
+        self.index_path = index_path
+        self._lock = threading.Lock()
+        self._index = {}
+        if os.path.exists(index_path):
+            try:
+                with open(index_path, "r", encoding="utf-8") as f:
+                    self._index = json.load(f)
+            except (OSError, ValueError):
+                self._index = {}
+
+    def _save_index(self):
+        os.makedirs(os.path.dirname(self.index_path) or ".", exist_ok=True)
+        tmp = self.index_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self._index, f, indent=2)
+        os.replace(tmp, self.index_path)
+
+    def put(self, path: str, mime_type: str, sha256: str) -> dict:
+        with self._lock:
+            handle = self._index.get(sha256)
+        if self.is_valid(handle):
+            return handle
+        # The SDK streams the upload from the path
+        uploaded = self.backend.upload_file(path, mime_type)
+        expires_at = time.time() + GEMINI_FILE_TTL_SECONDS
+        if getattr(uploaded, "expiration_time", None) is not None:
+            expires_at = uploaded.expiration_time.timestamp()
+        handle = {"store": self.kind, "uri": uploaded.uri, "name": uploaded.name, "mime_type": mime_type,
+                  "sha256": sha256, "size": os.path.getsize(path), "expires_at": expires_at}
+        with self._lock:
+            self._index[sha256] = handle
+            self._index = {k: v for k, v in self._index.items() if v["expires_at"] > time.time()}
+            self._save_index()
+        return handle
+
+    def is_valid(self, handle: dict) -> bool:
+        return bool(handle) and handle.get("store") == self.kind \
+            and handle.get("expires_at", 0) - EXPIRY_MARGIN_SECONDS > time.time()
+
+
+def get_file_store(backend):
+    """FILE_STORE env var, else the Files API for Gemini and local disk for the stub."""
+    from llm_backend import GeminiBackend
+    kind = os.getenv(FILE_STORE_ENV) or ("gemini" if isinstance(backend, GeminiBackend) else "local")
+    if kind == "gemini":
+        return GeminiFileStore(backend)
+    if kind == "local":
+        return LocalFileStore()
+    raise ValueError(f"Unknown {FILE_STORE_ENV}: {kind} (expected 'gemini' or 'local')")
@@ -1,26 +1,88 @@
 import os
+import sys
+import json
+import time
+import sqlite3
+import hashlib
+import argparse
+import threading
 from dotenv import load_dotenv
-from web_search import webQuery
-from langchain_google_genai import ChatGoogleGenerativeAI
+from web_search import webQuery, QueryCache, DEFAULT_TTLS
+from llm_backend import get_backend
+from memory_store import DEFAULT_USER
 
 load_dotenv()
 
-class UserPreferencesAgent:
-    def __init__(self, user_details_path="user_details.txt", api_key=None):
-        self.user_details_path = user_details_path
-        if api_key is None:
-            api_key = os.getenv("GOOGLE_API_KEY")
-        if not api_key:
-            raise ValueError("Missing GOOGLE_API_KEY")
+NEWS_DIGEST_PATH = "news_digests.sqlite3"
+NEWS_REFRESH_SECONDS = float(os.getenv("NEWS_REFRESH_SECONDS", str(30 * 60)))   # prefetch interval
+NEWS_MAX_AGE_SECONDS = float(os.getenv("NEWS_MAX_AGE_SECONDS", str(6 * 3600)))  # never serve older digests
+NEWS_POLL_SECONDS = 60   # how often the prefetcher checks for due users and changed details
+NO_DETAILS = {"text": "No user details found.", "sources": []}
+
+
+def hash_text(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class NewsDigestStore:
+    """Latest news digest per user, with the search query and the user-details hash it came from."""
+
+    def __init__(self, path: str = NEWS_DIGEST_PATH):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS digests (
+                    user_id TEXT PRIMARY KEY,
+                    details_hash TEXT,
+                    query TEXT,
+                    text TEXT,
+                    sources TEXT,
+                    fetched_at REAL,
+                    fetch_seconds REAL
+                )
+            """)
+
+    def get(self, user_id: str):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT details_hash, query, text, sources, fetched_at, fetch_seconds FROM digests WHERE user_id = ?",
+                (user_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {"user_id": user_id, "details_hash": row[0], "query": row[1], "text": row[2],
+                "sources": json.loads(row[3]), "fetched_at": row[4], "fetch_seconds": row[5]}
 
-        # Web search agent
-        self.web_agent = webQuery(api_key=api_key)
+    def put(self, digest: dict):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO digests VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (digest["user_id"], digest["details_hash"], digest["query"], digest["text"],
+                 json.dumps(digest["sources"]), digest["fetched_at"], digest["fetch_seconds"])
+            )
 
+
+class UserPreferencesAgent:
+    """
+    Personalized news from user_details.txt. Digests are stored per user and
+    served from the store while fresh; the search query is only regenerated
+    when the details file actually changes.
+    """
+
+    def __init__(self, user_details_path="user_details.txt", api_key=None, backend=None,
+                 store: NewsDigestStore = None, user_id: str = DEFAULT_USER,
+                 max_age: float = NEWS_MAX_AGE_SECONDS):
+        self.user_details_path = user_details_path
+        self.user_id = user_id
+        self.max_age = max_age
+        self.store = store or NewsDigestStore()
         # Chat model for generating search query
-        self.model = ChatGoogleGenerativeAI(
-            model="gemini-2.5-flash",
-            google_api_key=api_key
-        )
+        self.backend = backend or get_backend(api_key)
+
+        # Web search agent; digests are the cache here, so searches always go upstream
+        self.web_agent = webQuery(backend=self.backend, caller="news_search",
+                                  cache=QueryCache({query_class: 0 for query_class in DEFAULT_TTLS}))
 
     def _read_user_details(self):
         if not os.path.exists(self.user_details_path):
@@ -30,7 +92,7 @@ class UserPreferencesAgent:
 
     def _generate_search_query(self, user_text: str) -> str:
         """
-        Use ChatGoogleGenerativeAI to generate a search query from user likes/dislikes.
+        Use the chat model to generate a search query from user likes/dislikes.
         """
         system_prompt = f"""
         You are a financial analyst AI.
@@ -38,7 +100,7 @@ class UserPreferencesAgent:
         Identify their most important likes and dislikes regarding stocks, markets, sectors, and investments.
         Generate a concise, actionable web search query that can be used to fetch news or updates relevant to these preferences
         the web query should ask for current and interesting news according to user details don't put unnecessary text and anything just give web query ."
-        
+
         """
 
         messages = [
@@ -46,25 +108,128 @@ class UserPreferencesAgent:
             {"role": "user", "content": user_text}
         ]
 
-        response = self.model.invoke(messages)
-        return str(response.content).strip()
+        return self.backend.chat(messages, caller="news_query").strip()
 
-    def fetch_news_based_on_preferences(self) -> dict:
+    def details_hash(self):
+        """sha256 of the current user details, or None when there are none."""
         user_text = self._read_user_details()
-        if not user_text.strip():
-            return {"text": "No user details found.", "sources": []}
+        return hash_text(user_text) if user_text.strip() else None
 
-        # Step 1: Generate search query
-        search_query = self._generate_search_query(user_text)
+    def is_due(self, refresh_seconds: float = NEWS_REFRESH_SECONDS) -> bool:
+        """True when there is no digest, the details changed, or the digest is older than refresh_seconds."""
+        details_hash = self.details_hash()
+        if details_hash is None:
+            return False
+        digest = self.store.get(self.user_id)
+        return digest is None or digest["details_hash"] != details_hash \
+            or time.time() - digest["fetched_at"] >= refresh_seconds
 
-        # Step 2: Query the web
+    def refresh(self) -> dict:
+        """Search now and store the digest. Reuses the stored query if the details are unchanged."""
+        user_text = self._read_user_details()
+        if not user_text.strip():
+            return dict(NO_DETAILS)
+        start = time.perf_counter()
+        details_hash = hash_text(user_text)
+        previous = self.store.get(self.user_id)
+        if previous is not None and previous["details_hash"] == details_hash:
+            search_query = previous["query"]
+        else:
+            search_query = self._generate_search_query(user_text)
         result = self.web_agent.query(search_query)
-        return result
+        digest = {"user_id": self.user_id, "details_hash": details_hash, "query": search_query,
+                  "text": result["text"], "sources": result["sources"], "fetched_at": time.time(),
+                  "fetch_seconds": time.perf_counter() - start}
+        self.store.put(digest)
+        return dict(digest, age=0.0, stale=False)
+
+    def fetch_news_based_on_preferences(self) -> dict:
+        """
+        The stored digest if it matches the current details and is within
+        max_age; otherwise a fresh one. If refreshing fails, an older digest
+        is returned marked stale rather than nothing.
+        """
+        details_hash = self.details_hash()
+        if details_hash is None:
+            return dict(NO_DETAILS)
+        digest = self.store.get(self.user_id)
+        if digest is not None:
+            age = time.time() - digest["fetched_at"]
+            if digest["details_hash"] == details_hash and age <= self.max_age:
+                return dict(digest, age=age, stale=False)
+        try:
+            return self.refresh()
+        except Exception as e:
+            if digest is None:
+                raise
+            print(f"[WARN] News refresh failed ({e}); serving the previous digest.")
+            return dict(digest, age=time.time() - digest["fetched_at"], stale=True)
+
+
+class NewsPrefetcher:
+    """
+    Background thread that keeps each agent's digest fresh. Every
+    poll_seconds it hashes the users' details and refreshes only those that
+    changed or whose digest is older than refresh_seconds, so requests are
+    served straight from the store.
+    """
+
+    def __init__(self, agents, refresh_seconds: float = NEWS_REFRESH_SECONDS,
+                 poll_seconds: float = NEWS_POLL_SECONDS):
+        self.agents = list(agents)
+        self.refresh_seconds = refresh_seconds
+        self.poll_seconds = min(poll_seconds, refresh_seconds)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="news-prefetch", daemon=True)
+
+    def run_once(self) -> int:
+        refreshed = 0
+        for agent in self.agents:
+            try:
+                if agent.is_due(self.refresh_seconds):
+                    digest = agent.refresh()
+                    refreshed += 1
+                    print(f"[INFO] Prefetched news for {agent.user_id} in {digest['fetch_seconds']:.2f}s.")
+            except Exception as e:
+                print(f"[ERROR] News prefetch failed for {agent.user_id}: {e}")
+        return refreshed
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.run_once()
+            self._stop.wait(self.poll_seconds)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
 
 
-# Example usage 
+# Example usage (LLM_BACKEND=stub runs offline)
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Personalized news from user_details.txt.")
+    parser.add_argument("--watch", action="store_true", help="keep prefetching in the foreground")
+    parser.add_argument("--interval", type=float, default=NEWS_REFRESH_SECONDS, help="refresh interval in seconds")
+    parser.add_argument("--refresh", action="store_true", help="ignore the stored digest")
+    args = parser.parse_args()
     agent = UserPreferencesAgent()
-    news = agent.fetch_news_based_on_preferences()
+    if args.watch:
+        prefetcher = NewsPrefetcher([agent], refresh_seconds=args.interval).start()
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            prefetcher.stop()
+            sys.exit(0)
+    start = time.perf_counter()
+    news = agent.refresh() if args.refresh else agent.fetch_news_based_on_preferences()
+    elapsed = time.perf_counter() - start
     print("AI-generated query results / Summary:", news["text"])
     print("Sources:", news["sources"])
+    if "fetched_at" in news:
+        print(f"[INFO] Served in {elapsed * 1000:.0f}ms; digest is {news['age'] / 60:.1f} min old"
+              f"{' (stale)' if news['stale'] else ''}.")
@@ -0,0 +1,152 @@
+import time
+
+
+class TokenBudgetHistory:
+    """
+    Chat history that keeps a token budget without re-encoding every turn.
+
+    Each message is counted once when it is added and the running total is
+    maintained incrementally. When a turn would not fit, the oldest messages
+    after the system prompt are dropped (sliding window) or, if a summarizer
+    is given, folded into a single running summary message.
+    """
+
+    SUMMARY_PREFIX = "[Summary of earlier conversation]: "
+
+    def __init__(self, system_message, count_tokens, token_limit: int,
+                 summarizer=None, keep_recent_messages: int = 6, message_factory=None):
+        """
+        count_tokens(text) -> int
+        summarizer(previous_summary, dropped_messages) -> summary text
+        message_factory(text) -> message object used for the summary entry
+        """
+        self.count_tokens = count_tokens
+        self.token_limit = token_limit
+        self.summarizer = summarizer
+        self.keep_recent_messages = keep_recent_messages
+        self.message_factory = message_factory
+        self.summary = None
+        self._messages = [system_message]
+        self._counts = [count_tokens(system_message.content)]
+        self.total_tokens = self._counts[0]
+
+    def __len__(self):
+        return len(self._messages)
+
+    def __iter__(self):
+        return iter(self._messages)
+
+    def __getitem__(self, index):
+        return self._messages[index]
+
+    def as_list(self) -> list:
+        return list(self._messages)
+
+    def set_system(self, system_message):
+        count = self.count_tokens(system_message.content)
+        self.total_tokens += count - self._counts[0]
+        self._messages[0] = system_message
+        self._counts[0] = count
+
+    def append(self, message):
+        count = self.count_tokens(message.content)
+        self._messages.append(message)
+        self._counts.append(count)
+        self.total_tokens += count
+
+    def extend(self, messages):
+        for message in messages:
+            self.append(message)
+
+    def _first_turn_index(self) -> int:
+        return 2 if self.summary is not None else 1
+
+    def _pop_oldest(self):
+        index = self._first_turn_index()
+        message = self._messages.pop(index)
+        self.total_tokens -= self._counts.pop(index)
+        return message
+
+    def _set_summary(self, text: str):
+        message = self.message_factory(self.SUMMARY_PREFIX + text)
+        count = self.count_tokens(message.content)
+        if self.summary is None:
+            self._messages.insert(1, message)
+            self._counts.insert(1, count)
+        else:
+            self.total_tokens -= self._counts[1]
+            self._messages[1] = message
+            self._counts[1] = count
+        self.total_tokens += count
+        self.summary = text
+
+    def fit(self, reserve_tokens: int = 0) -> int:
+        """
+        Make room for reserve_tokens (the incoming turn and its context).
+        Returns the number of messages removed from the window.
+        """
+        removed = []
+        while self.total_tokens + reserve_tokens > self.token_limit:
+            if len(self._messages) - self._first_turn_index() <= 0:
+                break
+            removed.append(self._pop_oldest())
+        if not removed:
+            return 0
+
+        if self.summarizer is not None and self.message_factory is not None:
+            # Fold a little more than the minimum so we do not summarize every turn
+            while len(self._messages) - self._first_turn_index() > self.keep_recent_messages:
+                removed.append(self._pop_oldest())
+            try:
+                self._set_summary(self.summarizer(self.summary, removed))
+            except Exception as e:
+                print(f"[ERROR] Failed to summarize older messages, dropping them instead: {e}")
+            # A long summary can itself push us over budget; fall back to the window
+            while self.total_tokens + reserve_tokens > self.token_limit:
+                if len(self._messages) - self._first_turn_index() <= 0:
+                    break
+                self._pop_oldest()
+        return len(removed)
+
+
+# Benchmark: 1,000-turn synthetic session
+if __name__ == "__main__":
+    from collections import namedtuple
+
+    try:
+        import tiktoken
+        enc = tiktoken.encoding_for_model("gpt-4")
+
+        def count(text):
+            return len(enc.encode(text))
+    except ImportError:
+        def count(text):
+            return len(text.split())
+
+    Message = namedtuple("Message", "content")
+    turns = 1000
+    limit = 20000
+    user_text = "How does a systematic investment plan compare with a lump sum in a volatile market? " * 3
+    ai_text = "A SIP spreads purchases over time, averaging the cost of units across market cycles. " * 20
+
+    # Old approach: re-encode the whole history every turn
+    history = [Message("You are a highly knowledgeable financial advisor.")]
+    start = time.perf_counter()
+    for _ in range(turns):
+        total = sum(count(m.content) for m in history + [Message(user_text)])
+        while total > limit and len(history) > 1:
+            total -= count(history.pop(1).content)
+        history.extend([Message(user_text), Message(ai_text)])
+    naive = time.perf_counter() - start
+
+    window = TokenBudgetHistory(Message("You are a highly knowledgeable financial advisor."), count, limit)
+    start = time.perf_counter()
+    for _ in range(turns):
+        window.fit(count(user_text))
+        window.append(Message(user_text))
+        window.append(Message(ai_text))
+    incremental = time.perf_counter() - start
+
+    print(f"[INFO] {turns} turns, limit {limit} tokens")
+    print(f"[INFO] re-encode every turn: {naive:.2f}s")
+    print(f"[INFO] incremental window:   {incremental:.2f}s ({naive / max(incremental, 1e-9):.0f}x faster)")
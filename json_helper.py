@@ -2,6 +2,7 @@ import os
 import json
 import datetime
 import uuid
+from conversation_catalog import get_catalog
 
 CONVERSATIONS_DIR = "conversations"
 
@@ -32,6 +33,7 @@ def save_conversation(conversation: dict):
     path = os.path.join(CONVERSATIONS_DIR, filename)
     with open(path, "w") as f:
         json.dump(conversation, f, indent=2)
+    get_catalog(CONVERSATIONS_DIR).index_file(filename)
     return path
 
 def load_conversation(filename: str) -> dict:
@@ -44,16 +46,25 @@ def load_conversation(filename: str) -> dict:
 
 def list_conversations() -> list:
     """
-    List all JSON conversation files.
-    """
-    files = [f for f in os.listdir(CONVERSATIONS_DIR) if f.endswith(".json")]
-    conversations = []
-    for f in files:
-        data = load_conversation(f)
-        conversations.append({
-            "filename": f,
-            "conversation_id": data.get("conversation_id"),
-            "conversation_name": data.get("conversation_name"),
-            "created_at": data.get("created_at")
-        })
-    return conversations
+    List conversations from the catalog instead of parsing every JSON file.
+    Only files added or changed since the last call are read.
+    """
+    catalog = get_catalog(CONVERSATIONS_DIR)
+    catalog.sync()
+    return [
+        {
+            "filename": c["filename"],
+            "conversation_id": c["conversation_id"],
+            "conversation_name": c["conversation_name"],
+            "created_at": c["created_at"]
+        }
+        for c in catalog.list_conversations()
+    ]
+
+def search_conversations(terms: str, limit: int = 20) -> list:
+    """
+    Full-text search over message content across saved conversations.
+    """
+    catalog = get_catalog(CONVERSATIONS_DIR)
+    catalog.sync()
+    return catalog.search(terms, limit)
@@ -0,0 +1,435 @@
+import os
+import re
+import time
+import random
+import threading
+from collections import Counter, deque
+import numpy as np
+
+DEFAULT_MODEL = "gemini-2.5-flash"
+BACKEND_ENV = "LLM_BACKEND"   # "gemini" (default) or "stub"
+
+# Stub defaults, roughly a flash-class model on a good connection
+STUB_LATENCY = 0.4            # seconds before the first token
+STUB_TOKENS_PER_SEC = 150.0
+STUB_OUTPUT_TOKENS = 120      # tokens per chat answer
+STUB_SHORT_TOKENS = 12        # names, structured decisions, search queries
+STUB_SEARCH_LATENCY = 1.5
+
+# Shared client limits; all agents in the process go through one backend
+MAX_CONCURRENT_CALLS = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+RETRY_BASE_SECONDS = 0.5
+RETRY_MAX_SECONDS = 8.0
+POOL_CONNECTIONS = 32
+POOL_KEEPALIVE = 16
+KEEPALIVE_SECONDS = 60.0
+LATENCY_WINDOW = 1000         # latency samples kept per caller for percentiles
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def get_backend(api_key: str = None, kind: str = None):
+    """
+    Shared backend for the process. kind defaults to the LLM_BACKEND env var;
+    one instance is kept per (kind, api_key) so every agent reuses its clients.
+    """
+    kind = (kind or os.getenv(BACKEND_ENV, "gemini")).lower()
+    if kind == "stub":
+        key = ("stub", None)
+    elif kind == "gemini":
+        api_key = api_key or os.getenv("GOOGLE_API_KEY")
+        key = ("gemini", api_key)
+    else:
+        raise ValueError(f"Unknown {BACKEND_ENV}: {kind} (expected 'gemini' or 'stub')")
+    with _backends_lock:
+        if key not in _backends:
+            _backends[key] = StubBackend() if kind == "stub" else GeminiBackend(api_key)
+        return _backends[key]
+
+
+def all_stats() -> dict:
+    """Counters for every backend in the registry, keyed by kind."""
+    with _backends_lock:
+        backends = dict(_backends)
+    return {kind: backend.stats.snapshot() for (kind, _), backend in backends.items()}
+
+
+def format_stats(snapshot: dict) -> list:
+    """One printable line per caller from CallStats.snapshot()."""
+    return [
+        f"{name}: calls={entry['calls']} errors={entry['errors']} retries={entry['retries']} "
+        f"rate_limited={entry['rate_limited']} avg={entry['avg_ms']:.0f}ms "
+        f"p50={entry['p50_ms']:.0f}ms p99={entry['p99_ms']:.0f}ms"
+        for name, entry in snapshot["callers"].items()
+    ]
+
+
+def _message_text(message) -> str:
+    if isinstance(message, dict):
+        return str(message.get("content", ""))
+    if isinstance(message, str):
+        return message
+    return str(getattr(message, "content", ""))
+
+
+class RateLimitError(Exception):
+    """Raised by StubBackend to simulate a 429 / RESOURCE_EXHAUSTED response."""
+    code = 429
+
+
+def is_rate_limited(error: Exception) -> bool:
+    """True for 429 / RESOURCE_EXHAUSTED from google-genai, google-api-core or the stub."""
+    for attr in ("code", "status_code"):
+        code = getattr(error, attr, None)
+        if not callable(code) and code == 429:
+            return True
+    text = str(error)
+    return text.startswith("429") or "RESOURCE_EXHAUSTED" in text or "rate limit" in text.lower()
+
+
+def backoff_seconds(attempt: int) -> float:
+    """Exponential backoff with full jitter."""
+    return random.uniform(0.0, min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * (2 ** attempt)))
+
+
+class CallStats:
+    """
+    Per-caller counters for monitoring. calls and errors count attempts, so a
+    call that succeeded after two rate-limited attempts adds calls=3,
+    errors=2, retries=2.
+    """
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self.window = window
+        self._lock = threading.Lock()
+        self._callers = {}
+        self.in_flight = 0
+
+    def _entry(self, caller: str) -> dict:
+        entry = self._callers.get(caller)
+        if entry is None:
+            entry = {"calls": 0, "errors": 0, "retries": 0, "rate_limited": 0, "seconds": 0.0,
+                     "latencies": deque(maxlen=self.window)}
+            self._callers[caller] = entry
+        return entry
+
+    def started(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def retried(self, caller: str, rate_limited: bool):
+        with self._lock:
+            entry = self._entry(caller)
+            entry["retries"] += 1
+            entry["rate_limited"] += int(rate_limited)
+
+    def finished(self, caller: str, seconds: float, ok: bool):
+        with self._lock:
+            self.in_flight -= 1
+            entry = self._entry(caller)
+            entry["calls"] += 1
+            entry["errors"] += int(not ok)
+            entry["seconds"] += seconds
+            entry["latencies"].append(seconds)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            callers = {name: dict(entry, latencies=list(entry["latencies"])) for name, entry in self._callers.items()}
+            in_flight = self.in_flight
+        report = {}
+        for name, entry in sorted(callers.items()):
+            latencies = np.array(entry.pop("latencies"))
+            seconds = entry.pop("seconds")
+            entry["avg_ms"] = 1000 * seconds / entry["calls"] if entry["calls"] else 0.0
+            entry["p50_ms"] = float(np.percentile(latencies, 50)) * 1000 if len(latencies) else 0.0
+            entry["p99_ms"] = float(np.percentile(latencies, 99)) * 1000 if len(latencies) else 0.0
+            report[name] = entry
+        return {"in_flight": in_flight, "callers": report}
+
+
+class _Backend:
+    """
+    Shared plumbing for every backend: a bounded number of concurrent calls,
+    retry with backoff on rate limits, and per-caller counters.
+    """
+
+    def __init__(self, max_concurrency: int = MAX_CONCURRENT_CALLS, max_retries: int = MAX_RETRIES):
+        self.max_retries = max_retries
+        self.stats = CallStats()
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+
+    def _call(self, caller: str, func, *args):
+        attempt = 0
+        while True:
+            with self._slots:
+                self.stats.started()
+                start = time.perf_counter()
+                try:
+                    result = func(*args)
+                except Exception as e:
+                    self.stats.finished(caller, time.perf_counter() - start, ok=False)
+                    error = e
+                else:
+                    self.stats.finished(caller, time.perf_counter() - start, ok=True)
+                    return result
+            # Back off outside the semaphore so waiting does not hold a slot
+            if attempt >= self.max_retries or not is_rate_limited(error):
+                raise error
+            self.stats.retried(caller, rate_limited=True)
+            time.sleep(backoff_seconds(attempt))
+            attempt += 1
+
+    def _stream(self, caller: str, open_stream):
+        """
+        Yield chunks from open_stream(). Rate limits are retried only before
+        the first chunk arrives; the slot is held until the stream ends.
+        """
+        attempt = 0
+        while True:
+            yielded, ok = False, False
+            self._slots.acquire()
+            self.stats.started()
+            start = time.perf_counter()
+            try:
+                for chunk in open_stream():
+                    yielded = True
+                    yield chunk
+                ok = True
+                return
+            except GeneratorExit:
+                ok = True   # the consumer stopped reading early
+                raise
+            except Exception as e:
+                if yielded or attempt >= self.max_retries or not is_rate_limited(e):
+                    raise
+            finally:
+                self.stats.finished(caller, time.perf_counter() - start, ok=ok)
+                self._slots.release()
+            self.stats.retried(caller, rate_limited=True)
+            time.sleep(backoff_seconds(attempt))
+            attempt += 1
+
+
+class GeminiBackend(_Backend):
+    """
+    All Gemini traffic goes through here: LangChain chat calls (plain,
+    streamed and structured) and google-genai calls (raw prompts, file
+    descriptions and grounded web search). Clients are created lazily,
+    once per process, and the google-genai client keeps a pool of
+    keep-alive connections instead of a handshake per agent.
+    """
+
+    def __init__(self, api_key: str = None, model: str = DEFAULT_MODEL,
+                 max_concurrency: int = MAX_CONCURRENT_CALLS, max_retries: int = MAX_RETRIES):
+        api_key = api_key or os.getenv("GOOGLE_API_KEY")
+        if not api_key:
+            raise ValueError("Missing GOOGLE_API_KEY in .env file")
+        super().__init__(max_concurrency, max_retries)
+        self.api_key = api_key
+        self.model = model
+        self._lock = threading.Lock()
+        self._chat_model = None
+        self._client = None
+        self._structured = {}
+
+    @property
+    def chat_model(self):
+        with self._lock:
+            if self._chat_model is None:
+                from langchain_google_genai import ChatGoogleGenerativeAI
+                # Retries are handled here, with backoff, so LangChain makes a single attempt
+                self._chat_model = ChatGoogleGenerativeAI(model=self.model, google_api_key=self.api_key,
+                                                          max_retries=1)
+            return self._chat_model
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                self._client = self._create_client()
+            return self._client
+
+    def _create_client(self):
+        from google import genai
+        from google.genai import types
+        try:
+            import httpx
+            limits = httpx.Limits(max_connections=POOL_CONNECTIONS, max_keepalive_connections=POOL_KEEPALIVE,
+                                  keepalive_expiry=KEEPALIVE_SECONDS)
+            http_options = types.HttpOptions(client_args={"limits": limits})
+            return genai.Client(api_key=self.api_key, http_options=http_options)
+        except Exception as e:
+            # Older google-genai releases do not accept client_args
+            print(f"[WARN] Using the default google-genai connection pool: {e}")
+            return genai.Client(api_key=self.api_key)
+
+    def chat(self, messages, caller: str = "chat") -> str:
+        return str(self._call(caller, self.chat_model.invoke, messages).content)
+
+    def stream(self, messages, caller: str = "chat"):
+        """Yield the answer as text chunks."""
+        for chunk in self._stream(caller, lambda: self.chat_model.stream(messages)):
+            text = str(chunk.content)
+            if text:
+                yield text
+
+    def structured(self, messages, schema, caller: str = "structured"):
+        """Invoke the chat model with structured output; returns a schema instance."""
+        model = self._structured.get(schema)
+        if model is None:
+            model = self.chat_model.with_structured_output(schema)
+            self._structured[schema] = model
+        return self._call(caller, model.invoke, messages)
+
+    def _generate_content(self, caller: str, **kwargs):
+        return self._call(caller, lambda: self.client.models.generate_content(**kwargs))
+
+    def generate(self, prompt: str, model: str = None, caller: str = "generate") -> str:
+        return self._generate_content(caller, model=model or self.model, contents=prompt).text
+
+    def upload_file(self, path: str, mime_type: str, caller: str = "file_upload"):
+        """Upload to the Gemini Files API; returns the SDK's File (uri, name, expiration_time)."""
+        config = {"mime_type": mime_type, "display_name": os.path.basename(path)}
+        return self._call(caller, lambda: self.client.files.upload(file=path, config=config))
+
+    def describe_document(self, handle: dict, prompt: str, model: str = None,
+                          caller: str = "describe_document") -> str:
+        """Describe a stored file (see file_store). Files API handles are sent by reference."""
+        from google.genai import types
+        if handle["store"] == "gemini":
+            part = types.Part.from_uri(file_uri=handle["uri"], mime_type=handle["mime_type"])
+        else:
+            with open(handle["uri"], "rb") as f:
+                part = types.Part.from_bytes(data=f.read(), mime_type=handle["mime_type"])
+        response = self._generate_content(caller, model=model or self.model, contents=[part, prompt])
+        return response.text
+
+    def grounded_search(self, query: str, caller: str = "web_search") -> dict:
+        """Answer with Google Search grounding. Returns {"text", "sources"}."""
+        response = self._generate_content(
+            caller,
+            model=self.model,
+            contents=query,
+            config={"tools": [{"google_search": {}}]}
+        )
+        sources = []
+        try:
+            chunks = response.candidates[0].grounding_metadata.grounding_chunks
+            for chunk in chunks:
+                if hasattr(chunk, "web"):
+                    title = getattr(chunk.web, "title", None)
+                    url = getattr(chunk.web, "url", None)
+                    if title:
+                        if url:
+                            sources.append(f"{title} ({url})")
+                        else:
+                            sources.append(title)
+        except Exception:
+            sources = []
+        return {"text": response.text, "sources": sources}
+
+
+class StubBackend(_Backend):
+    """
+    Local, deterministic stand-in for GeminiBackend. Every call waits for
+    latency + tokens / tokens_per_sec (optionally with seeded jitter) and
+    returns canned text derived from the input, so the pipeline around the
+    model can be benchmarked without network or API spend. Calls go through
+    the same concurrency limit, retry and counters as GeminiBackend;
+    rate_limit_every=N makes every Nth call fail with a simulated 429.
+    """
+
+    def __init__(self, latency: float = STUB_LATENCY, tokens_per_sec: float = STUB_TOKENS_PER_SEC,
+                 output_tokens: int = STUB_OUTPUT_TOKENS, short_tokens: int = STUB_SHORT_TOKENS,
+                 search_latency: float = STUB_SEARCH_LATENCY, jitter: float = 0.0, seed: int = 0,
+                 rate_limit_every: int = 0, max_concurrency: int = MAX_CONCURRENT_CALLS,
+                 max_retries: int = MAX_RETRIES):
+        """jitter: each wait is scaled by a factor drawn uniformly from [1 - jitter, 1 + jitter]"""
+        super().__init__(max_concurrency, max_retries)
+        self.rate_limit_every = rate_limit_every
+        self.latency = latency
+        self.tokens_per_sec = tokens_per_sec
+        self.output_tokens = output_tokens
+        self.short_tokens = short_tokens
+        self.search_latency = search_latency
+        self.jitter = jitter
+        self.calls = Counter()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def expected_seconds(self, kind: str) -> float:
+        """Injected wait for one call of this kind, before jitter."""
+        if kind == "search":
+            return self.search_latency
+        tokens = self.output_tokens if kind in ("chat", "stream") else self.short_tokens
+        return self.latency + tokens / self.tokens_per_sec
+
+    def _wait(self, kind: str, seconds: float):
+        with self._lock:
+            self.calls[kind] += 1
+            if self.rate_limit_every and sum(self.calls.values()) % self.rate_limit_every == 0:
+                raise RateLimitError("429 RESOURCE_EXHAUSTED (simulated)")
+            if self.jitter:
+                seconds *= self._random.uniform(1.0 - self.jitter, 1.0 + self.jitter)
+        time.sleep(seconds)
+        return seconds
+
+    def _words(self, text: str, count: int) -> list:
+        seed_words = re.findall(r"[A-Za-z0-9]+", text)[:8] or ["stub"]
+        return [seed_words[i % len(seed_words)] for i in range(count)]
+
+    def chat(self, messages, caller: str = "chat") -> str:
+        def call():
+            self._wait("chat", self.expected_seconds("chat"))
+            return " ".join(self._words(_message_text(messages[-1]), self.output_tokens))
+        return self._call(caller, call)
+
+    def stream(self, messages, caller: str = "chat"):
+        def open_stream():
+            start = time.perf_counter()
+            first_token_at = start + self._wait("stream", self.latency)
+            for i, word in enumerate(self._words(_message_text(messages[-1]), self.output_tokens)):
+                # Pace against absolute deadlines so sleep overshoot does not accumulate
+                delay = first_token_at + (i + 1) / self.tokens_per_sec - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                yield word + " "
+        return self._stream(caller, open_stream)
+
+    def structured(self, messages, schema, caller: str = "structured"):
+        def call():
+            self._wait("structured", self.expected_seconds("structured"))
+            text = _message_text(messages[-1])
+            if schema.__name__ == "MemoryDecision":
+                from query_classifier import PERSONAL_PATTERN
+                from web_search import classify_query
+                personal = PERSONAL_PATTERN.search(text) is not None
+                return schema(
+                    Need_web="yes" if classify_query(text) != "general" else "no",
+                    update_user_data=personal,
+                    new_info=text[:200] if personal else None
+                )
+            return schema()
+        return self._call(caller, call)
+
+    def generate(self, prompt: str, model: str = None, caller: str = "generate") -> str:
+        def call():
+            self._wait("generate", self.expected_seconds("generate"))
+            return " ".join(self._words(prompt.split("\n- ", 1)[-1], min(self.short_tokens, 5)))
+        return self._call(caller, call)
+
+    def describe_document(self, handle: dict, prompt: str, model: str = None,
+                          caller: str = "describe_document") -> str:
+        def call():
+            self._wait("describe_document", self.expected_seconds("chat"))
+            return f"Stub description of a {handle['size']} byte {handle['mime_type']} document."
+        return self._call(caller, call)
+
+    def grounded_search(self, query: str, caller: str = "web_search") -> dict:
+        def call():
+            self._wait("search", self.search_latency)
+            return {"text": "Stub search results: " + " ".join(self._words(query, self.short_tokens)),
+                    "sources": ["Stub Source (https://example.com)"]}
+        return self._call(caller, call)
@@ -0,0 +1,115 @@
+"""
+Drive the chat server with many concurrent users against a stubbed LLM
+backend, so server overhead can be measured without API keys or quota.
+
+    python load_test.py [--users 50] [--turns 5] [--latency 0.3] [--tokens 40] [--workers 64] [--websocket]
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+import numpy as np
+import aiohttp
+from aiohttp import web
+from benchmark import stub_resources
+from llm_backend import StubBackend
+from server import create_app
+
+
+def stub_backend(latency: float, tokens: int) -> StubBackend:
+    return StubBackend(latency=latency, output_tokens=tokens, tokens_per_sec=200.0,
+                       search_latency=latency, short_tokens=4)
+
+
+QUESTIONS = [
+    "How does a SIP work?",
+    "What is the price of gold today?",
+    "Should a portfolio be rebalanced every year?",
+    "Explain index funds",
+    "What is the price of Nifty 50 now?",
+]
+
+
+async def run_user(client, base_url, user_index, turns, use_websocket, latencies, ttfts):
+    user_id = f"user{user_index}"
+    headers = {"X-User-Id": user_id}
+    async with client.post(f"{base_url}/sessions", json={"user_id": user_id}) as resp:
+        session_id = (await resp.json())["session_id"]
+    ws = None
+    if use_websocket:
+        ws = await client.ws_connect(f"{base_url}/ws?session_id={session_id}&user_id={user_id}")
+    for turn in range(turns):
+        text = QUESTIONS[(user_index + turn) % len(QUESTIONS)]
+        start = time.perf_counter()
+        if ws is None:
+            async with client.post(f"{base_url}/sessions/{session_id}/messages",
+                                   json={"text": text}, headers=headers) as resp:
+                resp.raise_for_status()
+                await resp.json()
+        else:
+            await ws.send_json({"text": text})
+            first = None
+            while True:
+                event = await ws.receive_json()
+                if event["type"] == "token" and first is None:
+                    first = time.perf_counter()
+                if event["type"] in ("done", "error"):
+                    break
+            if first is not None:
+                ttfts.append(first - start)
+        latencies.append(time.perf_counter() - start)
+    if ws is not None:
+        await ws.close()
+    async with client.delete(f"{base_url}/sessions/{session_id}", headers=headers) as resp:
+        resp.raise_for_status()
+
+
+async def main(args):
+    with tempfile.TemporaryDirectory() as folder:
+        backend = stub_backend(args.latency, args.tokens)
+        resources = stub_resources(folder, backend, args.workers)
+        app = create_app(resources, conversation_root=os.path.join(folder, "conversations"),
+                         upload_root=os.path.join(folder, "uploads"))
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        base_url = f"http://127.0.0.1:{port}"
+
+        latencies, ttfts = [], []
+        start = time.perf_counter()
+        connector = aiohttp.TCPConnector(limit=0)
+        async with aiohttp.ClientSession(connector=connector) as client:
+            await asyncio.gather(*[
+                run_user(client, base_url, i, args.turns, args.websocket, latencies, ttfts)
+                for i in range(args.users)
+            ])
+        elapsed = time.perf_counter() - start
+        await runner.cleanup()
+
+    # Ideal turn time with zero server overhead for a question without web search:
+    # decision, then the answer ("price" questions also wait for the stub web search)
+    ideal_seconds = backend.expected_seconds("structured") + backend.expected_seconds("stream")
+    latencies = np.array(latencies)
+    print(f"[INFO] {args.users} users x {args.turns} turns = {len(latencies)} turns in {elapsed:.2f}s "
+          f"({len(latencies) / elapsed:.1f} turns/sec)")
+    print(f"[INFO] Turn latency p50={np.percentile(latencies, 50):.3f}s "
+          f"p99={np.percentile(latencies, 99):.3f}s max={latencies.max():.3f}s "
+          f"(ideal without web search {ideal_seconds:.3f}s)")
+    if ttfts:
+        ttfts = np.array(ttfts)
+        print(f"[INFO] Time to first token p50={np.percentile(ttfts, 50):.3f}s p99={np.percentile(ttfts, 99):.3f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the chat server with a stubbed LLM backend.")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--turns", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.3, help="stub model latency before the first token")
+    parser.add_argument("--tokens", type=int, default=40, help="tokens per stub answer")
+    parser.add_argument("--workers", type=int, default=64, help="shared stage pool size (blocking agent calls)")
+    parser.add_argument("--websocket", action="store_true", help="stream answers over the WebSocket endpoint")
+    sys.exit(asyncio.run(main(parser.parse_args())))
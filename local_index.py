@@ -0,0 +1,480 @@
+"""
+Compact on-disk vector index, an alternative to Chroma for read-heavy use
+(VECTOR_BACKEND=local).
+
+Vectors are kept as float16, or int8 with a per-row scale, in memory-mapped
+files; ids, metadata and documents live in a SQLite sidecar. Opening an
+index maps the files without reading them, so many worker processes share
+one index through the OS page cache at almost no startup or RAM cost.
+Search is a batched NumPy dot product over normalized vectors, optionally
+restricted to the nearest coarse partitions (IVF).
+
+    python local_index.py import-chroma
+    python local_index.py build-ivf --lists 256
+    python local_index.py bench --vectors 200000
+"""
+import os
+import re
+import sys
+import time
+import json
+import sqlite3
+import argparse
+import threading
+import numpy as np
+
+VECTOR_INDEX_DIR = os.getenv("VECTOR_INDEX_DIR", os.path.join("embeddings7", "local_index"))
+VECTOR_DTYPE = os.getenv("VECTOR_DTYPE", "float16")      # "float16" or "int8"
+IVF_PROBE = int(os.getenv("VECTOR_IVF_PROBE", "8"))       # partitions searched per query
+IVF_TRAIN_ITERATIONS = 10
+SEARCH_BLOCK_ROWS = 16384     # rows dequantized at a time, bounds search memory
+INITIAL_CAPACITY = 1024
+SQL_BATCH = 500               # stay below SQLite's bound-parameter limit
+DTYPES = {"float16": np.float16, "int8": np.int8}
+METADATA_KEY = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+COMPARISONS = {"$eq": "=", "$ne": "!=", "$gt": ">", "$gte": ">=", "$lt": "<", "$lte": "<="}
+
+
+def _normalize(vectors) -> np.ndarray:
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    return vectors / (np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-12)
+
+def _batches(items, size: int = SQL_BATCH):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+def _where_sql(where: dict):
+    """Translate the Chroma where subset we use ($and/$or, $in/$nin, comparisons) into SQL."""
+    clauses, params = [], []
+    for key, value in where.items():
+        if key in ("$and", "$or"):
+            parts = [_where_sql(w) for w in value]
+            clauses.append("(" + f" {key[1:].upper()} ".join(sql for sql, _ in parts) + ")")
+            params.extend(p for _, ps in parts for p in ps)
+            continue
+        if not METADATA_KEY.match(key):
+            raise ValueError(f"Unsupported metadata key: {key!r}")
+        field = f"json_extract(metadata, '$.{key}')"
+        op, operand = next(iter(value.items())) if isinstance(value, dict) else ("$eq", value)
+        if op in ("$in", "$nin"):
+            negate = "NOT " if op == "$nin" else ""
+            clauses.append(f"{field} {negate}IN ({','.join('?' * len(operand))})")
+            params.extend(operand)
+        elif op in COMPARISONS:
+            clauses.append(f"{field} {COMPARISONS[op]} ?")
+            params.append(operand)
+        else:
+            raise ValueError(f"Unsupported where operator: {op}")
+    return " AND ".join(clauses) or "1", params
+
+
+class LocalVectorIndex:
+    """
+    Chroma-like collection (upsert/get/update/delete/query/count) backed by
+    memory-mapped vectors and a SQLite sidecar. Distances are cosine
+    distances, as with hnsw:space=cosine. One writer at a time (SQLite
+    write lock); any number of readers in other processes pick up new rows
+    on their next call.
+    """
+
+    def __init__(self, name: str, folder: str = VECTOR_INDEX_DIR, dtype: str = VECTOR_DTYPE):
+        os.makedirs(folder, exist_ok=True)
+        self.name = name
+        self.metadata = {"backend": "local"}
+        base = os.path.join(folder, name)
+        self._paths = {kind: f"{base}.{kind}" for kind in ("vectors", "scales", "live", "lists")}
+        self._centroids_path = base + ".centroids.npy"
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(base + ".sqlite3", check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        with self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS items (
+                    id TEXT PRIMARY KEY,
+                    row INTEGER UNIQUE,
+                    metadata TEXT,
+                    document TEXT
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS items_source ON items (json_extract(metadata, '$.source'))")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS free_rows (row INTEGER PRIMARY KEY)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT)")
+        # An existing index keeps the dtype it was created with
+        self.dtype = self._setting("dtype") or dtype
+        if self.dtype not in DTYPES:
+            raise ValueError(f"Unknown VECTOR_DTYPE: {self.dtype} (expected 'float16' or 'int8')")
+        self.dim = int(self._setting("dim") or 0) or None
+        self._maps = {}
+        self._capacity = 0
+        self._centroids = None
+        self._centroids_mtime = None
+
+    # Settings and memory maps
+    def _setting(self, key: str):
+        row = self._conn.execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_setting(self, key: str, value):
+        self._conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (key, str(value)))
+
+    def _next_row(self) -> int:
+        return int(self._setting("next_row") or 0)
+
+    def _file_specs(self):
+        specs = {"vectors": (DTYPES[self.dtype], (self.dim,)), "live": (np.uint8, ()), "lists": (np.int32, ())}
+        if self.dtype == "int8":
+            specs["scales"] = (np.float32, ())
+        return specs
+
+    def _refresh(self):
+        """Remap if another process grew the files, and reload IVF centroids if they changed."""
+        if self.dim is None:
+            self.dim = int(self._setting("dim") or 0) or None
+            if self.dim is None:
+                return
+        live_path = self._paths["live"]
+        capacity = os.path.getsize(live_path) if os.path.exists(live_path) else 0
+        if capacity != self._capacity:
+            self._maps = {}
+            if capacity:
+                for kind, (dtype, shape) in self._file_specs().items():
+                    self._maps[kind] = np.memmap(self._paths[kind], dtype=dtype, mode="r+", shape=(capacity,) + shape)
+            self._capacity = capacity
+        mtime = os.path.getmtime(self._centroids_path) if os.path.exists(self._centroids_path) else None
+        if mtime != self._centroids_mtime:
+            self._centroids = np.load(self._centroids_path) if mtime else None
+            self._centroids_mtime = mtime
+
+    def _ensure_capacity(self, rows: int):
+        self._refresh()
+        if rows <= self._capacity:
+            return
+        previous = self._capacity
+        capacity = max(INITIAL_CAPACITY, previous)
+        while capacity < rows:
+            capacity *= 2
+        for kind, (dtype, shape) in self._file_specs().items():
+            row_bytes = np.dtype(dtype).itemsize * int(np.prod(shape or (1,)))
+            with open(self._paths[kind], "ab") as f:
+                f.truncate(capacity * row_bytes)
+        self._maps = {}
+        self._capacity = 0
+        self._refresh()
+        # The file grows with zeros; mark the new rows as unassigned to any partition
+        self._maps["lists"][previous:] = -1
+
+    def _allocate_rows(self, count: int) -> list:
+        free = [r for (r,) in self._conn.execute("SELECT row FROM free_rows ORDER BY row LIMIT ?", (count,))]
+        for batch in _batches(free):
+            self._conn.execute(f"DELETE FROM free_rows WHERE row IN ({','.join('?' * len(batch))})", batch)
+        next_row = self._next_row()
+        fresh = list(range(next_row, next_row + count - len(free)))
+        self._set_setting("next_row", next_row + len(fresh))
+        return free + fresh
+
+    def _rows_for_ids(self, ids) -> dict:
+        found = {}
+        for batch in _batches(list(ids)):
+            found.update(self._conn.execute(
+                f"SELECT id, row FROM items WHERE id IN ({','.join('?' * len(batch))})", batch))
+        return found
+
+    def _write_vectors(self, rows, vectors: np.ndarray):
+        order = np.asarray(rows)
+        if self.dtype == "int8":
+            scales = np.abs(vectors).max(axis=1) / 127.0
+            scales[scales == 0] = 1.0
+            self._maps["vectors"][order] = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+            self._maps["scales"][order] = scales
+        else:
+            self._maps["vectors"][order] = vectors.astype(np.float16)
+        if self._centroids is not None:
+            self._maps["lists"][order] = np.argmax(vectors @ self._centroids.T, axis=1)
+        self._maps["live"][order] = 1
+
+    def _dequantize(self, rows) -> np.ndarray:
+        vectors = self._maps["vectors"][rows].astype(np.float32)
+        if self.dtype == "int8":
+            vectors *= self._maps["scales"][rows][:, None]
+        return vectors
+
+    def _scores(self, queries: np.ndarray, index, buffer: np.ndarray) -> np.ndarray:
+        """Dot products of queries with the rows at index, converted into a reused float32 buffer."""
+        stored = self._maps["vectors"][index]
+        block = buffer[:len(stored)]
+        np.copyto(block, stored, casting="unsafe")
+        scores = queries @ block.T
+        if self.dtype == "int8":
+            scores *= self._maps["scales"][index]
+        return scores
+
+    def _flush(self):
+        for mapped in self._maps.values():
+            mapped.flush()
+
+    # Chroma-like interface
+    def count(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM items").fetchone()[0]
+
+    def upsert(self, ids, embeddings, metadatas=None, documents=None):
+        vectors = _normalize(embeddings)
+        metadatas = metadatas or [{}] * len(ids)
+        documents = documents or [""] * len(ids)
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                self._set_setting("dim", self.dim)
+                self._set_setting("dtype", self.dtype)
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"{self.name} holds {self.dim}-dim vectors, got {vectors.shape[1]}")
+            rows = self._rows_for_ids(ids)
+            new_ids = list(dict.fromkeys(i for i in ids if i not in rows))
+            rows.update(zip(new_ids, self._allocate_rows(len(new_ids))))
+            self._ensure_capacity(self._next_row())
+            self._write_vectors([rows[i] for i in ids], vectors)
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO items (id, row, metadata, document) VALUES (?, ?, ?, ?)",
+                [(i, rows[i], json.dumps(meta or {}), doc) for i, meta, doc in zip(ids, metadatas, documents)]
+            )
+            self._flush()
+
+    add = upsert
+
+    def update(self, ids, metadatas=None, documents=None, embeddings=None):
+        with self._lock, self._conn:
+            rows = self._rows_for_ids(ids)
+            known = [i for i in ids if i in rows]
+            if embeddings is not None:
+                self._refresh()
+                by_id = dict(zip(ids, _normalize(embeddings)))
+                self._write_vectors([rows[i] for i in known], np.stack([by_id[i] for i in known]))
+                self._flush()
+            if metadatas is not None:
+                self._conn.executemany("UPDATE items SET metadata = ? WHERE id = ?",
+                                       [(json.dumps(m or {}), i) for i, m in zip(ids, metadatas) if i in rows])
+            if documents is not None:
+                self._conn.executemany("UPDATE items SET document = ? WHERE id = ?",
+                                       [(d, i) for i, d in zip(ids, documents) if i in rows])
+
+    def delete(self, ids=None, where=None):
+        if ids is None and not where:
+            # Like Chroma: an empty filter is a caller bug, not a request to wipe the index
+            raise ValueError("delete() needs ids or a non-empty where filter")
+        with self._lock, self._conn:
+            if ids is not None:
+                rows = list(self._rows_for_ids(ids).items())
+            else:
+                sql, params = _where_sql(where)
+                rows = self._conn.execute(f"SELECT id, row FROM items WHERE {sql}", params).fetchall()
+            if not rows:
+                return
+            self._refresh()
+            freed = [row for _, row in rows]
+            self._maps["live"][freed] = 0
+            self._maps["lists"][freed] = -1
+            for batch in _batches([item_id for item_id, _ in rows]):
+                self._conn.execute(f"DELETE FROM items WHERE id IN ({','.join('?' * len(batch))})", batch)
+            self._conn.executemany("INSERT OR IGNORE INTO free_rows (row) VALUES (?)", [(r,) for r in freed])
+            self._flush()
+
+    def get(self, ids=None, where=None, limit=None, offset=None, include=("metadatas", "documents")):
+        sql, params = _where_sql(where or {})
+        if ids is not None:
+            ids = list(ids)
+            sql += f" AND id IN ({','.join('?' * len(ids))})"
+            params = params + ids
+        query = f"SELECT id, row, metadata, document FROM items WHERE {sql} ORDER BY row"
+        if limit is not None or offset:
+            query += " LIMIT ? OFFSET ?"
+            params = params + [-1 if limit is None else limit, offset or 0]
+        records = self._conn.execute(query, params).fetchall()
+        result = {"ids": [r[0] for r in records]}
+        if "metadatas" in include:
+            result["metadatas"] = [json.loads(r[2]) for r in records]
+        if "documents" in include:
+            result["documents"] = [r[3] for r in records]
+        if "embeddings" in include:
+            self._refresh()
+            rows = [r[1] for r in records]
+            result["embeddings"] = self._dequantize(rows) if rows else np.empty((0, self.dim or 0), np.float32)
+        return result
+
+    def _candidate_rows(self, query: np.ndarray, where):
+        """Rows worth scoring: the where-filtered rows, the probed IVF partitions, or None for all."""
+        if where:
+            sql, params = _where_sql(where)
+            return np.array([r for (r,) in self._conn.execute(f"SELECT row FROM items WHERE {sql}", params)],
+                            dtype=np.int64)
+        if self._centroids is None:
+            return None
+        probes = np.argsort(-(self._centroids @ query))[:IVF_PROBE]
+        return np.nonzero(np.isin(self._maps["lists"][:self._next_row()], probes))[0]
+
+    def _top_k(self, queries: np.ndarray, rows, k: int):
+        """Exact top-k by dot product over rows (None = every row), SEARCH_BLOCK_ROWS at a time."""
+        total = self._next_row() if rows is None else len(rows)
+        best_rows = np.empty((len(queries), 0), dtype=np.int64)
+        best_scores = np.empty((len(queries), 0), dtype=np.float32)
+        buffer = np.empty((min(SEARCH_BLOCK_ROWS, max(total, 1)), self.dim), dtype=np.float32)
+        for start in range(0, total, SEARCH_BLOCK_ROWS):
+            stop = min(start + SEARCH_BLOCK_ROWS, total)
+            # A plain slice reads the mapped rows without a gather
+            index = slice(start, stop) if rows is None else rows[start:stop]
+            block = np.arange(start, stop) if rows is None else index
+            scores = self._scores(queries, index, buffer)
+            scores[:, self._maps["live"][index] == 0] = -np.inf
+            best_rows = np.concatenate([best_rows, np.broadcast_to(block, scores.shape)], axis=1)
+            best_scores = np.concatenate([best_scores, scores], axis=1)
+            if best_scores.shape[1] > k:
+                keep = np.argpartition(-best_scores, k - 1, axis=1)[:, :k]
+                best_rows = np.take_along_axis(best_rows, keep, axis=1)
+                best_scores = np.take_along_axis(best_scores, keep, axis=1)
+        order = np.argsort(-best_scores, axis=1)
+        return np.take_along_axis(best_rows, order, axis=1), np.take_along_axis(best_scores, order, axis=1)
+
+    def query(self, query_embeddings, n_results: int = 10, where=None,
+              include=("metadatas", "documents", "distances")):
+        queries = _normalize(query_embeddings)
+        result = {"ids": [], "metadatas": [], "documents": [], "distances": []}
+        self._refresh()
+        if self.dim is None or not self._capacity:
+            return {key: [[] for _ in queries] for key in ("ids",) + tuple(include)}
+        if where or self._centroids is None:
+            # One pass over the shared candidates scores every query at once
+            hits = [self._top_k(queries, self._candidate_rows(queries[0], where), n_results)]
+        else:
+            hits = [self._top_k(q[None, :], self._candidate_rows(q, None), n_results) for q in queries]
+        for rows, scores in hits:
+            for row_list, score_list in zip(rows, scores):
+                valid = [(int(r), float(s)) for r, s in zip(row_list, score_list) if np.isfinite(s)]
+                records = {}
+                for batch in _batches([r for r, _ in valid]):
+                    for record in self._conn.execute(
+                            f"SELECT row, id, metadata, document FROM items WHERE row IN ({','.join('?' * len(batch))})",
+                            batch):
+                        records[record[0]] = record
+                # Rows a concurrent writer has not committed yet have no record and are skipped
+                found = [(records[r], s) for r, s in valid if r in records]
+                result["ids"].append([rec[1] for rec, _ in found])
+                result["metadatas"].append([json.loads(rec[2]) for rec, _ in found])
+                result["documents"].append([rec[3] for rec, _ in found])
+                result["distances"].append([max(0.0, 1.0 - s) for _, s in found])
+        return {key: result[key] for key in ("ids",) + tuple(include)}
+
+    # Coarse partitioning
+    def build_ivf(self, lists: int, iterations: int = IVF_TRAIN_ITERATIONS, seed: int = 0):
+        """
+        Train lists k-means centroids on the stored vectors and assign every
+        row to one. Queries then score only the IVF_PROBE nearest partitions.
+        lists=0 removes the partitioning again.
+        """
+        with self._lock:
+            self._refresh()
+            if lists <= 0:
+                if os.path.exists(self._centroids_path):
+                    os.remove(self._centroids_path)
+                self._centroids, self._centroids_mtime = None, None
+                return
+            live = np.nonzero(self._maps["live"][:self._next_row()])[0]
+            if len(live) < lists:
+                raise ValueError(f"{self.name} has {len(live)} vectors, fewer than {lists} lists")
+            vectors = self._dequantize(live)
+            rng = np.random.default_rng(seed)
+            centroids = vectors[rng.choice(len(vectors), lists, replace=False)]
+            for _ in range(iterations):
+                assign = np.concatenate([np.argmax(vectors[s:s + SEARCH_BLOCK_ROWS] @ centroids.T, axis=1)
+                                         for s in range(0, len(vectors), SEARCH_BLOCK_ROWS)])
+                sums = np.zeros_like(centroids)
+                np.add.at(sums, assign, vectors)
+                empty = np.bincount(assign, minlength=lists) == 0
+                sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()))]
+                centroids = _normalize(sums)
+            self._maps["lists"][:] = -1
+            self._maps["lists"][live] = assign
+            self._flush()
+            tmp = self._centroids_path + ".tmp.npy"
+            np.save(tmp, centroids.astype(np.float32))
+            os.replace(tmp, self._centroids_path)
+            self._centroids_mtime = None
+            self._refresh()
+            sizes = np.bincount(assign, minlength=lists)
+            print(f"[INFO] {self.name}: {lists} partitions over {len(live)} vectors "
+                  f"(sizes {sizes.min()}-{sizes.max()}, probing {IVF_PROBE})")
+
+
+def import_from_chroma(batch_size: int = SQL_BATCH) -> dict:
+    """Copy the Chroma text/image collections into local indexes of the same names."""
+    import document_saver
+    client = document_saver.get_client()
+    counts = {}
+    for kind, name in document_saver.COLLECTION_NAMES.items():
+        if name not in document_saver._collection_names(client):
+            continue
+        source = client.get_collection(name)
+        target = LocalVectorIndex(name)
+        total = source.count()
+        for offset in range(0, total, batch_size):
+            batch = source.get(limit=batch_size, offset=offset, include=["embeddings", "metadatas", "documents"])
+            target.upsert(batch["ids"], batch["embeddings"], batch["metadatas"], batch["documents"])
+        counts[kind] = target.count()
+        print(f"[INFO] {name}: {counts[kind]} vectors imported ({target.dtype}).")
+    return counts
+
+def bench(vectors: int, dim: int, queries: int, k: int, lists: int, folder: str):
+    """Build a random index and report open time, size on disk, search latency and IVF recall."""
+    rng = np.random.default_rng(0)
+    index = LocalVectorIndex("bench", folder=folder)
+    # Clustered like real embeddings; uniform random vectors have no structure for IVF to use
+    centers = rng.normal(size=(max(vectors // 100, 1), dim))
+    data = _normalize(centers[rng.integers(len(centers), size=vectors)] + rng.normal(scale=0.6, size=(vectors, dim)))
+    for start in range(0, vectors, 10000):
+        ids = [f"v{i}" for i in range(start, min(start + 10000, vectors))]
+        index.upsert(ids, data[start:start + 10000], [{"source": f"doc{i % 50}"} for i in range(len(ids))])
+    size = sum(os.path.getsize(p) for p in index._paths.values() if os.path.exists(p))
+    start = time.perf_counter()
+    reopened = LocalVectorIndex("bench", folder=folder)
+    reopened.count()
+    open_ms = (time.perf_counter() - start) * 1000
+    probes = data[rng.choice(vectors, queries, replace=False)] + rng.normal(scale=0.02, size=(queries, dim))
+
+    def run(label):
+        latencies, results = [], []
+        for q in probes:
+            start = time.perf_counter()
+            results.append(reopened.query([q], n_results=k, include=[])["ids"][0])
+            latencies.append(time.perf_counter() - start)
+        print(f"[INFO] {label:<12} p50={np.percentile(latencies, 50) * 1000:.1f}ms "
+              f"p99={np.percentile(latencies, 99) * 1000:.1f}ms")
+        return results
+
+    print(f"[INFO] {vectors} x {dim} {index.dtype}: {size / 1e6:.1f}MB on disk for {index._capacity} rows "
+          f"(float32 vectors alone: {index._capacity * dim * 4 / 1e6:.1f}MB), reopen {open_ms:.1f}ms")
+    exact = run("exact")
+    if lists:
+        reopened.build_ivf(lists)
+        approx = run(f"ivf {lists}")
+        recall = np.mean([len(set(a) & set(e)) / k for a, e in zip(approx, exact)])
+        print(f"[INFO] ivf recall@{k}={recall:.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local memory-mapped vector index.")
+    parser.add_argument("command", choices=["import-chroma", "build-ivf", "bench"])
+    parser.add_argument("--lists", type=int, default=0, help="IVF partitions (0 removes them)")
+    parser.add_argument("--vectors", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+    if args.command == "import-chroma":
+        import_from_chroma()
+    elif args.command == "build-ivf":
+        import document_saver
+        for name in document_saver.COLLECTION_NAMES.values():
+            LocalVectorIndex(name).build_ivf(args.lists)
+    else:
+        import tempfile
+        with tempfile.TemporaryDirectory() as folder:
+            bench(args.vectors, args.dim, args.queries, args.k, args.lists, folder)
+    sys.exit(0)
@@ -0,0 +1,181 @@
+import re
+import sqlite3
+import threading
+from datetime import datetime
+import numpy as np
+
+MEMORY_DB_PATH = "user_memory.sqlite3"
+DEFAULT_USER = "default"
+DUPLICATE_SIMILARITY = 0.9
+MAX_RELEVANT_FACTS = 8
+PINNED_CATEGORIES = ("identity", "account")
+
+# (key, category, pattern) for facts that hold a single value per user. Each
+# pattern needs the value itself (or an "X is ..." statement of it), so a
+# sentence that merely mentions email or an address does not replace it.
+SINGLE_VALUE_FACTS = [
+    ("email", "identity", re.compile(r"[\w.+-]+@[\w-]+(\.[\w-]+)+")),
+    ("phone", "identity", re.compile(r"\b(phone|mobile|contact)\b[^.\n]*?\+?\d[\d\s-]{6,}\d", re.I)),
+    ("name", "identity", re.compile(r"\b(my|user'?s) name\s*(is\b|:)", re.I)),
+    ("address", "identity", re.compile(r"\b(my|user'?s|home|residential|postal) address\s*(is\b|:)", re.I)),
+    ("bank_account", "account", re.compile(r"\b(bank account|account number|a/c)\b[^.\n]*?\d{4}", re.I)),
+]
+CATEGORY_PATTERNS = [
+    ("dislike", re.compile(r"\b(dislikes?|hates?|avoids?|does not like|doesn't like)\b", re.I)),
+    ("preference", re.compile(r"\b(loves?|likes?|prefers?|interested|enjoys?|tracks?|follows?|monitors?)\b", re.I)),
+    ("holding", re.compile(r"\b(owns?|holds?|bought|invested|portfolio)\b", re.I)),
+]
+TIMESTAMP_PREFIX = re.compile(r"^\[\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}\]\s*")
+WORD = re.compile(r"[a-z0-9]+")
+STOPWORDS = {
+    "a", "an", "and", "are", "about", "can", "do", "does", "for", "how", "i", "in", "is", "it", "me",
+    "my", "of", "on", "or", "should", "the", "to", "user", "user's", "what", "which", "with", "you"
+}
+
+
+def normalize_fact(text: str) -> str:
+    text = TIMESTAMP_PREFIX.sub("", text.strip()).replace("**", "")
+    return text.lstrip("*-• ").strip()
+
+def categorize(text: str):
+    """Return (key, category); key is None for multi-valued facts."""
+    for key, category, pattern in SINGLE_VALUE_FACTS:
+        if pattern.search(text):
+            return key, category
+    for category, pattern in CATEGORY_PATTERNS:
+        if pattern.search(text):
+            return None, category
+    return None, "note"
+
+
+class MemoryStore:
+    """
+    Structured user memory: one row per fact with key, category, timestamps
+    and an optional embedding. Writes are deduplicated (same single-value key,
+    same text, or a near-identical embedding updates the existing fact), and
+    only the facts relevant to the current query are put into the prompt.
+    """
+
+    def __init__(self, path: str = MEMORY_DB_PATH, embed=None,
+                 duplicate_similarity: float = DUPLICATE_SIMILARITY):
+        """embed(text) -> normalized 1-D numpy vector, or None for keyword matching"""
+        self.embed = embed
+        self.duplicate_similarity = duplicate_similarity
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS facts (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id TEXT,
+                    key TEXT,
+                    category TEXT,
+                    text TEXT,
+                    created_at TEXT,
+                    updated_at TEXT,
+                    embedding BLOB
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS facts_user ON facts (user_id, key)")
+
+    def _rows(self, user_id: str):
+        return self._conn.execute(
+            "SELECT id, key, category, text, updated_at, embedding FROM facts WHERE user_id = ?", (user_id,)
+        ).fetchall()
+
+    def count(self, user_id: str = DEFAULT_USER) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM facts WHERE user_id = ?", (user_id,)).fetchone()[0]
+
+    def add_fact(self, text: str, user_id: str = DEFAULT_USER) -> str:
+        """Insert or update a fact. Returns "inserted", "updated" or "duplicate"."""
+        text = normalize_fact(text)
+        if not text:
+            return "duplicate"
+        key, category = categorize(text)
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        embedding = None
+        if self.embed is not None:
+            vector = self.embed(text)
+            if vector is not None:
+                embedding = np.asarray(vector, dtype=np.float32)
+
+        with self._lock, self._conn:
+            rows = self._rows(user_id)
+            match_id = None
+            for row_id, row_key, _, row_text, _, row_embedding in rows:
+                if row_text.lower() == text.lower():
+                    self._conn.execute("UPDATE facts SET updated_at = ? WHERE id = ?", (now, row_id))
+                    return "duplicate"
+                if key is not None and row_key == key:
+                    match_id = row_id
+                    break
+                if embedding is not None and row_embedding is not None:
+                    similarity = float(np.frombuffer(row_embedding, dtype=np.float32) @ embedding)
+                    if similarity >= self.duplicate_similarity:
+                        match_id = row_id
+                        break
+            blob = embedding.tobytes() if embedding is not None else None
+            if match_id is not None:
+                # Newer statement of the same fact wins
+                self._conn.execute(
+                    "UPDATE facts SET text = ?, category = ?, updated_at = ?, embedding = ? WHERE id = ?",
+                    (text, category, now, blob, match_id)
+                )
+                return "updated"
+            self._conn.execute(
+                "INSERT INTO facts (user_id, key, category, text, created_at, updated_at, embedding) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (user_id, key, category, text, now, now, blob)
+            )
+            return "inserted"
+
+    def import_text(self, memory_text: str, user_id: str = DEFAULT_USER) -> int:
+        """One-off migration from the flat user_details.txt format."""
+        added = 0
+        for line in memory_text.splitlines():
+            line = normalize_fact(line)
+            if not line or line.lower() == "user memory initialized." or line.endswith(":"):
+                continue
+            if self.add_fact(line, user_id) != "duplicate":
+                added += 1
+        return added
+
+    def relevant_facts(self, query: str, user_id: str = DEFAULT_USER, limit: int = MAX_RELEVANT_FACTS) -> list:
+        """Pinned identity/account facts plus the facts most related to the query."""
+        with self._lock:
+            rows = self._rows(user_id)
+        pinned = [row for row in rows if row[2] in PINNED_CATEGORIES]
+        others = [row for row in rows if row[2] not in PINNED_CATEGORIES]
+        if not others or limit <= len(pinned):
+            return [row[3] for row in pinned]
+
+        use_embeddings = self.embed is not None and all(row[5] is not None for row in others)
+        query_vector = self.embed(query) if use_embeddings and query.strip() else None
+        if not query.strip() or (use_embeddings and query_vector is None):
+            # Nothing to score against (e.g. the startup prompt): most recently updated facts
+            recent = sorted(others, key=lambda row: row[4], reverse=True)[:limit - len(pinned)]
+            return [row[3] for row in pinned] + [row[3] for row in recent]
+
+        if query_vector is not None:
+            query_vector = np.asarray(query_vector, dtype=np.float32)
+            matrix = np.vstack([np.frombuffer(row[5], dtype=np.float32) for row in others])
+            scores = matrix @ query_vector
+        else:
+            query_words = set(WORD.findall(query.lower())) - STOPWORDS
+            scores = np.array([
+                len(query_words & set(WORD.findall(row[3].lower()))) for row in others
+            ], dtype=np.float32)
+        order = np.argsort(-scores, kind="stable")[:limit - len(pinned)]
+        return [row[3] for row in pinned] + [others[i][3] for i in order if scores[i] > 0]
+
+    def all_facts(self, user_id: str = DEFAULT_USER) -> list:
+        with self._lock:
+            return [{"key": row[1], "category": row[2], "text": row[3], "updated_at": row[4]}
+                    for row in self._rows(user_id)]
+
+
+def format_facts(facts: list) -> str:
+    if not facts:
+        return "No stored user facts."
+    return "\n".join(f"- {fact}" for fact in facts)
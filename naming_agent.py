@@ -1,17 +1,11 @@
-import os
 from dotenv import load_dotenv
-from google import genai
+from llm_backend import get_backend
 
 load_dotenv()
-API_KEY_BACKUP = os.getenv("GOOGLE_API_KEY")
-if not API_KEY_BACKUP:
-    raise ValueError("Missing GOOGLE_API_KEY in .env file")
 
 class NamingAgent:
-    def __init__(self, api_key: str = None):
-        if api_key is None:
-            api_key = API_KEY_BACKUP
-        self.client = genai.Client(api_key=api_key)
+    def __init__(self, api_key: str = None, backend=None):
+        self.backend = backend or get_backend(api_key)
 
     def generate_name(self, user_messages):
         """
@@ -33,11 +27,7 @@ Only output the name, no explanations.
 """
 
         try:
-            response = self.client.models.generate_content(
-                model="gemini-2.5-flash",
-                contents=prompt
-            )
-            name = response.text.strip().replace("\n", " ")
+            name = self.backend.generate(prompt, caller="naming").strip().replace("\n", " ")
             name = "".join(c for c in name if c.isalnum() or c in (' ', '-', '_')).strip()
             return name or "Unnamed_Conversation"
         except Exception as e:
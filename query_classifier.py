@@ -0,0 +1,230 @@
+import os
+import re
+import sys
+import json
+import time
+import threading
+from collections import OrderedDict
+import numpy as np
+from web_search import LIVE_PATTERN, normalize_query
+
+EXAMPLES_PATH = "classifier_examples.jsonl"
+CONFIDENCE_THRESHOLD = 0.85
+NEIGHBOURS = 5
+MAX_LEARNED_EXAMPLES = 1000   # newest distinct queries kept; the file is rewritten at twice this
+
+SMALL_TALK_PATTERN = re.compile(
+    r"^(hi+|hello+|hey+|yo|thanks?( you)?|thank u|thx|ok(ay)?|cool|great|nice|bye|goodbye|"
+    r"good (morning|afternoon|evening|night)|how are you|who are you|what can you do)[\s!.?]*$",
+    re.I
+)
+PERSONAL_PATTERN = re.compile(
+    r"\b(my (name|email|e-mail|phone|number|account|bank|address|portfolio|salary|age)|"
+    r"i (love|like|hate|prefer|dislike|own|hold|bought|sold|invest|am|have)|i'm|i've|remember|note that)\b",
+    re.I
+)
+# A live word ("rate", "now") only means live data when it is about something
+# with a quoted value, and not when the user asks for an explanation
+LIVE_SUBJECT_PATTERN = re.compile(
+    r"\b(price|prices|quote|trading at|worth|nav|sensex|nifty|bitcoin|btc|crypto|gold|silver|stocks?|shares?|"
+    r"index|forex|exchange rate|usd|inr|dollar|rupee|euro)\b",
+    re.I
+)
+EXPLANATION_PATTERN = re.compile(
+    r"\b(explain|how (does|do|is|are)|why|what (is|are) the difference|meaning of|define|affects?)\b", re.I)
+
+# Seed examples for the embedding model; grows with every LLM decision
+SEED_EXAMPLES = [
+    ("What is the current stock price of Tesla?", "yes"),
+    ("latest news on Nvidia", "yes"),
+    ("How did Sensex and Nifty close today?", "yes"),
+    ("What is the price of Bitcoin right now?", "yes"),
+    ("Is Tata Steel a good buy this week?", "yes"),
+    ("How does a SIP work?", "no"),
+    ("Explain the difference between mutual funds and ETFs", "no"),
+    ("What is intraday trading?", "no"),
+    ("What is rupee cost averaging?", "no"),
+    ("Give me tips for long-term retirement planning", "no"),
+]
+
+
+class QueryPreClassifier:
+    """
+    Cheap local decision for Need_web / update_user_data.
+
+    Rules handle small talk, personal statements and obviously live queries;
+    everything else goes to a k-nearest-neighbour vote over nomic embeddings
+    of previously decided queries. Each result carries a confidence, and the
+    caller falls back to the LLM when it is below the threshold.
+    """
+
+    def __init__(self, embed=None, examples_path: str = EXAMPLES_PATH,
+                 threshold: float = CONFIDENCE_THRESHOLD, k: int = NEIGHBOURS):
+        """embed(text) -> normalized 1-D numpy vector, or None for rules only"""
+        self.embed = embed
+        self.examples_path = examples_path
+        self.threshold = threshold
+        self.k = k
+        self._lock = threading.Lock()
+        # normalized query -> (query, label), oldest first; the latest label wins
+        self._learned = OrderedDict()
+        self._file_lines = 0
+        if examples_path and os.path.exists(examples_path):
+            with open(examples_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    self._file_lines += 1
+                    try:
+                        record = json.loads(line)
+                        self._remember(record["query"], record["Need_web"])
+                    except (ValueError, KeyError):
+                        continue
+        self._vectors = {}
+        self._matrix = None
+        self._labels = None
+
+    def _decision(self, need_web: str, update_user_data: bool, confidence: float, method: str) -> dict:
+        return {
+            "Need_web": need_web,
+            "update_user_data": update_user_data,
+            "new_info": None,
+            "confidence": confidence,
+            "method": method
+        }
+
+    def _remember(self, query: str, label: str) -> bool:
+        """Record a learned example; False if it was already known with that label."""
+        key = normalize_query(query)
+        if self._learned.get(key, (None, None))[1] == label:
+            return False
+        self._learned.pop(key, None)
+        self._learned[key] = (query, label)
+        while len(self._learned) > MAX_LEARNED_EXAMPLES:
+            self._learned.popitem(last=False)
+        return True
+
+    @property
+    def _examples(self) -> list:
+        return list(SEED_EXAMPLES) + list(self._learned.values())
+
+    def _ensure_matrix(self):
+        if self._matrix is None:
+            examples = self._examples
+            # Vectors are cached per query, so a rebuild only embeds new examples
+            for query, _ in examples:
+                if query not in self._vectors:
+                    self._vectors[query] = np.asarray(self.embed(query), dtype=np.float32)
+            self._vectors = {query: self._vectors[query] for query, _ in examples}
+            self._matrix = np.vstack([self._vectors[query] for query, _ in examples])
+            self._labels = np.array([label == "yes" for _, label in examples])
+
+    def classify(self, query: str) -> dict:
+        text = query.strip()
+        if not text or SMALL_TALK_PATTERN.match(text):
+            return self._decision("no", False, 0.98, "rules")
+        if PERSONAL_PATTERN.search(text):
+            # The fact itself still has to be extracted by the LLM
+            return self._decision("no", True, 0.0, "rules")
+        if LIVE_PATTERN.search(text) and LIVE_SUBJECT_PATTERN.search(text) and not EXPLANATION_PATTERN.search(text):
+            return self._decision("yes", False, 0.9, "rules")
+
+        if self.embed is None:
+            return self._decision("no", False, 0.0, "none")
+        with self._lock:
+            self._ensure_matrix()
+            scores = self._matrix @ np.asarray(self.embed(text), dtype=np.float32)
+            top = np.argsort(scores)[::-1][:self.k]
+            weights = np.clip(scores[top], 0.0, None)
+            total = float(weights.sum())
+            if total == 0.0:
+                return self._decision("no", False, 0.0, "embedding")
+            yes_share = float(weights[self._labels[top]].sum()) / total
+        need_web = "yes" if yes_share >= 0.5 else "no"
+        return self._decision(need_web, False, max(yes_share, 1.0 - yes_share), "embedding")
+
+    def is_confident(self, decision: dict) -> bool:
+        return decision["confidence"] >= self.threshold and not decision["update_user_data"]
+
+    def add_example(self, query: str, need_web: str):
+        """Learn from an LLM decision so similar queries can take the fast path next time."""
+        with self._lock:
+            if not self._remember(query, need_web):
+                return
+            self._matrix = None
+            if self.examples_path:
+                self._append_example(query, need_web)
+
+    def _append_example(self, query: str, need_web: str):
+        # Caller holds self._lock
+        if self._file_lines < 2 * MAX_LEARNED_EXAMPLES:
+            with open(self.examples_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"query": query, "Need_web": need_web}, ensure_ascii=False) + "\n")
+            self._file_lines += 1
+            return
+        # Compact to the distinct, newest examples
+        tmp = self.examples_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            for learned_query, label in self._learned.values():
+                f.write(json.dumps({"query": learned_query, "Need_web": label}, ensure_ascii=False) + "\n")
+        os.replace(tmp, self.examples_path)
+        self._file_lines = len(self._learned)
+
+
+# Offline evaluation: replay stored user queries against the LLM decision
+def load_stored_queries(folder: str = "conversation") -> list:
+    from conversation_log import load_conversation
+    queries = []
+    for name in sorted(os.listdir(folder)):
+        if not name.endswith((".json", ".jsonl")):
+            continue
+        data = load_conversation(os.path.join(folder, name))
+        for msg in data.get("chat", []):
+            if msg.get("role") == "user" and msg.get("content", "").strip():
+                queries.append(msg["content"])
+    return queries
+
+def evaluate(classifier: QueryPreClassifier, decision_agent, queries: list) -> dict:
+    fast, agree_web, agree_update = 0, 0, 0
+    local_seconds, llm_seconds_saved = 0.0, 0.0
+    for query in queries:
+        start = time.perf_counter()
+        local = classifier.classify(query)
+        local_seconds += time.perf_counter() - start
+
+        start = time.perf_counter()
+        reference = decision_agent.analyze_query(query, use_pre_classifier=False)
+        llm_seconds = time.perf_counter() - start
+
+        if classifier.is_confident(local):
+            fast += 1
+            llm_seconds_saved += llm_seconds
+            agree_web += local["Need_web"] == reference["Need_web"]
+            agree_update += local["update_user_data"] == reference["update_user_data"]
+    return {
+        "queries": len(queries),
+        "fast_path": fast,
+        "fast_path_rate": fast / len(queries) if queries else 0.0,
+        "need_web_agreement": agree_web / fast if fast else 0.0,
+        "update_user_data_agreement": agree_update / fast if fast else 0.0,
+        "llm_seconds_saved": llm_seconds_saved,
+        "local_seconds": local_seconds
+    }
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] != ["evaluate"]:
+        print("Usage: python query_classifier.py evaluate [--embeddings]")
+        sys.exit(1)
+    from evaluator import DecisionAgent
+    embed = None
+    if "--embeddings" in sys.argv:
+        import document_saver
+        embed = document_saver.embed_query_text
+    # Do not learn from the replay itself, or agreement would be inflated
+    classifier = QueryPreClassifier(embed=embed, examples_path=None)
+    report = evaluate(classifier, DecisionAgent(), load_stored_queries())
+    print(f"[INFO] {report['queries']} stored queries, {report['fast_path']} on the fast path "
+          f"({report['fast_path_rate']:.0%})")
+    print(f"[INFO] Agreement with the LLM on fast-path queries: Need_web {report['need_web_agreement']:.0%}, "
+          f"update_user_data {report['update_user_data_agreement']:.0%}")
+    print(f"[INFO] LLM time saved: {report['llm_seconds_saved']:.1f}s "
+          f"(local classifier took {report['local_seconds']:.2f}s total)")
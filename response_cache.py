@@ -0,0 +1,160 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+import numpy as np
+from web_search import DEFAULT_TTLS, classify_query
+
+RESPONSE_CACHE_PATH = "response_cache.sqlite3"
+SIMILARITY_THRESHOLD = 0.92
+WEB_TTL_SECONDS = 15 * 60               # at most; live quotes use web_search's shorter TTL
+EVERGREEN_TTL_SECONDS = 7 * 24 * 3600   # "how does SIP work" style answers
+MAX_ENTRIES = 5000
+DEFAULT_SCOPE = "default"
+
+
+class SemanticResponseCache:
+    """
+    Opt-in cache of previous answers, looked up by embedding similarity.
+
+    Entries expire after a TTL that depends on whether the answer needed a
+    web search; web answers never outlive the web search cache's TTL for the
+    query's class (60s for prices and indices). Entries are scoped (per
+    user) so answers that may draw on one user's memory are never served to
+    another. Vectors are normalized, so the lookup is a single dot product
+    against an in-memory matrix of all live entries.
+    """
+
+    def __init__(self, embed, path: str = RESPONSE_CACHE_PATH,
+                 threshold: float = SIMILARITY_THRESHOLD,
+                 web_ttl: float = WEB_TTL_SECONDS,
+                 evergreen_ttl: float = EVERGREEN_TTL_SECONDS,
+                 max_entries: int = MAX_ENTRIES):
+        """embed(text) -> normalized 1-D numpy vector"""
+        self.embed = embed
+        self.threshold = threshold
+        self.web_ttl = web_ttl
+        self.evergreen_ttl = evergreen_ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    query TEXT,
+                    answer TEXT,
+                    sources TEXT,
+                    need_web INTEGER,
+                    created_at REAL,
+                    expires_at REAL,
+                    latency REAL,
+                    embedding BLOB
+                )
+            """)
+            columns = [row[1] for row in self._conn.execute("PRAGMA table_info(responses)")]
+            if "scope" not in columns:
+                # Caches created before sessions were scoped belong to the default user
+                self._conn.execute(f"ALTER TABLE responses ADD COLUMN scope TEXT DEFAULT '{DEFAULT_SCOPE}'")
+            self._conn.execute("DELETE FROM responses WHERE expires_at < ?", (time.time(),))
+        self._load()
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+        self.lookup_seconds = 0.0
+
+    def _load(self):
+        rows = self._conn.execute("SELECT id, expires_at, scope, embedding FROM responses ORDER BY id").fetchall()
+        self._ids = [row[0] for row in rows]
+        self._expires = np.array([row[1] for row in rows], dtype=np.float64)
+        self._scopes = np.array([row[2] for row in rows], dtype=object)
+        if rows:
+            self._matrix = np.vstack([np.frombuffer(row[3], dtype=np.float32) for row in rows])
+        else:
+            self._matrix = None
+
+    def lookup(self, query: str, scope: str = DEFAULT_SCOPE):
+        """
+        Return (entry or None, query_embedding). The embedding is handed back
+        so a miss can be stored without embedding the query twice.
+        """
+        start = time.perf_counter()
+        embedding = np.asarray(self.embed(query), dtype=np.float32)
+        entry = None
+        with self._lock:
+            if self._matrix is not None and len(self._ids):
+                scores = self._matrix @ embedding
+                scores[self._expires < time.time()] = -1.0
+                scores[self._scopes != scope] = -1.0
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    row = self._conn.execute(
+                        "SELECT query, answer, sources, need_web, latency FROM responses WHERE id = ?",
+                        (self._ids[best],)
+                    ).fetchone()
+                    if row:
+                        entry = {
+                            "query": row[0],
+                            "answer": row[1],
+                            "sources": json.loads(row[2]),
+                            "need_web": bool(row[3]),
+                            "similarity": float(scores[best])
+                        }
+                        original_latency = row[4]
+            elapsed = time.perf_counter() - start
+            self.lookup_seconds += elapsed
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                entry["saved_seconds"] = max(original_latency - elapsed, 0.0)
+                self.saved_seconds += entry["saved_seconds"]
+        return entry, embedding
+
+    def store(self, query: str, answer: str, need_web: bool, latency: float,
+              sources=None, embedding=None, scope: str = DEFAULT_SCOPE):
+        if embedding is None:
+            embedding = self.embed(query)
+        embedding = np.asarray(embedding, dtype=np.float32)
+        now = time.time()
+        ttl = self.evergreen_ttl
+        if need_web:
+            ttl = min(self.web_ttl, DEFAULT_TTLS[classify_query(query)])
+        expires_at = now + ttl
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "INSERT INTO responses (query, answer, sources, need_web, created_at, expires_at, latency, "
+                "embedding, scope) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (query, answer, json.dumps(sources or []), int(need_web), now, expires_at, latency,
+                 embedding.tobytes(), scope)
+            )
+            new_id = cursor.lastrowid
+            removed = self._conn.execute("DELETE FROM responses WHERE expires_at < ?", (now,)).rowcount
+            removed += self._conn.execute(
+                "DELETE FROM responses WHERE id NOT IN (SELECT id FROM responses ORDER BY id DESC LIMIT ?)",
+                (self.max_entries,)
+            ).rowcount
+            if removed:
+                self._load()
+            else:
+                # Common case: just append the new row to the in-memory index
+                self._ids.append(new_id)
+                self._expires = np.append(self._expires, expires_at)
+                self._scopes = np.append(self._scopes, np.array([scope], dtype=object))
+                row = embedding.reshape(1, -1)
+                self._matrix = row if self._matrix is None else np.vstack([self._matrix, row])
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "saved_seconds": self.saved_seconds,
+            "avg_lookup_ms": 1000 * self.lookup_seconds / lookups if lookups else 0.0
+        }
+
+
+def cache_enabled() -> bool:
+    return os.getenv("RESPONSE_CACHE", "0") == "1"
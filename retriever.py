@@ -0,0 +1,87 @@
+import document_saver
+
+TOP_K_TEXT = 5
+TOP_K_IMAGES = 3
+
+
+def _source_filter(sources):
+    # Each modality has its own collection, so only the source needs filtering
+    sources = list(sources)
+    return {"source": sources[0]} if len(sources) == 1 else {"source": {"$in": sources}}
+
+
+def indexed_sources(sources) -> set:
+    """
+    Return the subset of source names that already have embeddings stored.
+    Looked up every time: documents can be removed or re-ingested at any
+    point, including by the ingestion daemon in another process.
+    """
+    found = set()
+    for source in sources:
+        for kind in document_saver.COLLECTION_NAMES:
+            result = document_saver.get_collection(kind).get(where={"source": source}, limit=1, include=[])
+            if result["ids"]:
+                found.add(source)
+                break
+    return found
+
+
+def _query(kind, embedding, n_results, where):
+    if embedding is None or n_results <= 0:
+        return []
+    result = document_saver.get_collection(kind).query(
+        query_embeddings=[embedding.tolist()],
+        n_results=n_results,
+        where=where,
+        include=["documents", "metadatas", "distances"]
+    )
+    hits = []
+    for doc_text, meta, dist in zip(result["documents"][0], result["metadatas"][0], result["distances"][0]):
+        hits.append({
+            "type": meta.get("type", kind),
+            "source": meta.get("source"),
+            "page": meta.get("page"),
+            "page_end": meta.get("page_end", meta.get("page")),
+            "text": doc_text,
+            "distance": dist
+        })
+    return hits
+
+
+def _has_images(sources) -> bool:
+    # Checked before embedding the query so CLIP is only loaded for documents with images
+    result = document_saver.get_collection("image").get(where=_source_filter(sources), limit=1, include=[])
+    return bool(result["ids"])
+
+
+def retrieve(query: str, sources, k_text: int = TOP_K_TEXT, k_images: int = TOP_K_IMAGES) -> list:
+    """
+    Retrieve the top-k text chunks (nomic embeddings) and image hits
+    (CLIP text->image) for the query, restricted to the given sources.
+    """
+    sources = list(sources)
+    if not sources:
+        return []
+    text_hits = _query("text", document_saver.embed_query_text(query), k_text, _source_filter(sources))
+    image_hits = []
+    if k_images > 0 and _has_images(sources):
+        # CLIP text features against the CLIP image collection
+        image_hits = _query("image", document_saver.embed_text_for_image_search(query), k_images,
+                            _source_filter(sources))
+    return text_hits + image_hits
+
+
+def format_context(hits) -> str:
+    lines = []
+    for hit in hits:
+        if hit["page"] is None:
+            location = hit["source"]
+        elif hit["page_end"] != hit["page"]:
+            location = f"{hit['source']}, pages {hit['page'] + 1}-{hit['page_end'] + 1}"
+        else:
+            location = f"{hit['source']}, page {hit['page'] + 1}"
+        if hit["type"] == "image":
+            lines.append(f"[Relevant image in {location}]")
+        else:
+            lines.append(f"[Excerpt from {location}]: {hit['text']}")
+    return "\n\n".join(lines)
@@ -0,0 +1,279 @@
+import os
+import re
+import sys
+import time
+import uuid
+import asyncio
+import threading
+from aiohttp import web, WSMsgType
+from chat_session import SharedResources, ChatSession
+
+CONVERSATION_ROOT = os.path.join("conversation", "users")
+UPLOAD_ROOT = "uploads"
+SESSION_IDLE_SECONDS = 30 * 60
+UPLOAD_CHUNK_BYTES = 1 << 16
+USER_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+class SessionManager:
+    """
+    Open chat sessions keyed by session id. Every user gets their own
+    conversation folder and memory scope; sessions never see each other's
+    history, documents or cached answers.
+    """
+
+    def __init__(self, resources: SharedResources, conversation_root: str = CONVERSATION_ROOT,
+                 upload_root: str = UPLOAD_ROOT, idle_seconds: float = SESSION_IDLE_SECONDS):
+        self.resources = resources
+        self.conversation_root = conversation_root
+        self.upload_root = upload_root
+        self.idle_seconds = idle_seconds
+        self._sessions = {}
+        self._last_used = {}
+        self._lock = threading.Lock()
+
+    def user_folder(self, user_id: str) -> str:
+        return os.path.join(self.conversation_root, user_id)
+
+    def create(self, user_id: str, conversation_file: str = None) -> str:
+        """Blocking: may replay a conversation log. Returns the new session id."""
+        folder = self.user_folder(user_id)
+        conversation_path = None
+        if conversation_file:
+            # Only files inside the user's own folder can be resumed
+            conversation_path = os.path.join(folder, os.path.basename(conversation_file))
+            if not os.path.exists(conversation_path):
+                raise FileNotFoundError(conversation_file)
+        session = ChatSession(self.resources, user_id=user_id, conversation_path=conversation_path, folder=folder)
+        session_id = uuid.uuid4().hex
+        with self._lock:
+            self._sessions[session_id] = session
+            self._last_used[session_id] = time.monotonic()
+        return session_id
+
+    def get(self, session_id: str) -> ChatSession:
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                self._last_used[session_id] = time.monotonic()
+            return session
+
+    def close(self, session_id: str) -> bool:
+        """Blocking: waits for the session's background work."""
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+            self._last_used.pop(session_id, None)
+        if session is None:
+            return False
+        session.close()
+        return True
+
+    def idle_sessions(self) -> list:
+        cutoff = time.monotonic() - self.idle_seconds
+        with self._lock:
+            return [sid for sid, used in self._last_used.items() if used < cutoff]
+
+    def close_all(self):
+        with self._lock:
+            session_ids = list(self._sessions)
+        for session_id in session_ids:
+            self.close(session_id)
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+def _json_error(status: int, message: str):
+    return web.json_response({"error": message}, status=status)
+
+def _turn_payload(session: ChatSession, turn: dict) -> dict:
+    return {
+        "response": turn["response"],
+        "web_sources": turn["web_sources"],
+        "timings": turn["timings"],
+        "cached": turn["cached"] is not None,
+        "conversation_id": session.conversation_id,
+        "conversation_name": session.conversation_data["conversation_name"]
+    }
+
+def _session_or_error(request):
+    """Look up the session and check it belongs to the caller (X-User-Id header)."""
+    manager = request.app["sessions"]
+    session = manager.get(request.match_info["session_id"])
+    if session is None:
+        return None, _json_error(404, "unknown session")
+    if request.headers.get("X-User-Id") != session.user_id:
+        return None, _json_error(403, "session belongs to another user")
+    return session, None
+
+
+# Handlers
+async def health(request):
+    return web.json_response({"status": "ok", "sessions": len(request.app["sessions"])})
+
+async def metrics(request):
+    """Per-caller LLM call counters and latency percentiles, for monitoring."""
+    backend = request.app["sessions"].resources.backend
+    return web.json_response({"sessions": len(request.app["sessions"]), "llm": backend.stats.snapshot()})
+
+async def create_session(request):
+    body = await request.json()
+    user_id = str(body.get("user_id", ""))
+    if not USER_ID_PATTERN.match(user_id):
+        return _json_error(400, "user_id must be 1-64 letters, digits, '_' or '-'")
+    manager = request.app["sessions"]
+    try:
+        session_id = await asyncio.to_thread(manager.create, user_id, body.get("conversation_file"))
+    except FileNotFoundError:
+        return _json_error(404, "conversation not found")
+    session = manager.get(session_id)
+    return web.json_response({"session_id": session_id, "conversation_id": session.conversation_id}, status=201)
+
+async def list_conversations(request):
+    user_id = request.headers.get("X-User-Id", "")
+    if not USER_ID_PATTERN.match(user_id):
+        return _json_error(400, "missing or invalid X-User-Id header")
+    import conversation_log
+    folder = request.app["sessions"].user_folder(user_id)
+    if not os.path.isdir(folder):
+        return web.json_response([])
+    convos = await asyncio.to_thread(conversation_log.list_conversations, folder)
+    return web.json_response(convos)
+
+async def post_message(request):
+    session, error = _session_or_error(request)
+    if error:
+        return error
+    body = await request.json()
+    text = str(body.get("text", "")).strip()
+    if not text:
+        return _json_error(400, "text is required")
+    try:
+        turn = await session.ask_async(text)
+    except Exception as e:
+        print(f"[ERROR] Failed to generate AI response: {e}")
+        return _json_error(502, "failed to generate a response")
+    return web.json_response(_turn_payload(session, turn))
+
+async def upload_document(request):
+    session, error = _session_or_error(request)
+    if error:
+        return error
+    reader = await request.multipart()
+    field = await reader.next()
+    if field is None or not field.filename:
+        return _json_error(400, "expected a multipart file field")
+    folder = os.path.join(request.app["upload_root"], session.user_id)
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, f"{uuid.uuid4().hex[:8]}_{os.path.basename(field.filename)}")
+    # Stream to disk instead of holding the request body in memory
+    with open(path, "wb") as f:
+        while True:
+            chunk = await field.read_chunk(UPLOAD_CHUNK_BYTES)
+            if not chunk:
+                break
+            f.write(chunk)
+    doc_ref = await asyncio.to_thread(session.upload, path)
+    print(f"[INFO] Uploaded document for {session.user_id}: {path}")
+    return web.json_response({"filename": doc_ref["filename"], "sha256": doc_ref["sha256"]}, status=201)
+
+async def delete_session(request):
+    session, error = _session_or_error(request)
+    if error:
+        return error
+    await asyncio.to_thread(request.app["sessions"].close, request.match_info["session_id"])
+    return web.json_response({"closed": True})
+
+async def websocket(request):
+    """
+    One socket per session. Client sends {"text": ...}; the server replies
+    with {"type": "token"} events while the answer streams, then one
+    {"type": "done"} event carrying the same payload as the HTTP endpoint.
+    """
+    manager = request.app["sessions"]
+    session = manager.get(request.query.get("session_id", ""))
+    if session is None or request.query.get("user_id") != session.user_id:
+        return _json_error(403, "unknown session or wrong user")
+    ws = web.WebSocketResponse(heartbeat=30)
+    await ws.prepare(request)
+    loop = asyncio.get_running_loop()
+
+    async for msg in ws:
+        if msg.type != WSMsgType.TEXT:
+            continue
+        text = str(msg.json().get("text", "")).strip()
+        if not text:
+            await ws.send_json({"type": "error", "error": "text is required"})
+            continue
+        # Tokens arrive on a worker thread; a single sender keeps them in order
+        queue = asyncio.Queue()
+
+        def on_token(token):
+            loop.call_soon_threadsafe(queue.put_nowait, token)
+
+        async def send_tokens():
+            while True:
+                token = await queue.get()
+                if token is None:
+                    return
+                await ws.send_json({"type": "token", "text": token})
+
+        sender = asyncio.create_task(send_tokens())
+        try:
+            turn = await session.ask_async(text, on_token=on_token)
+        except Exception as e:
+            print(f"[ERROR] Failed to generate AI response: {e}")
+            turn = None
+        queue.put_nowait(None)
+        await sender
+        if turn is None:
+            await ws.send_json({"type": "error", "error": "failed to generate a response"})
+        else:
+            await ws.send_json(dict(_turn_payload(session, turn), type="done"))
+    return ws
+
+
+async def _reap_idle_sessions(app):
+    manager = app["sessions"]
+    while True:
+        await asyncio.sleep(60)
+        for session_id in manager.idle_sessions():
+            await asyncio.to_thread(manager.close, session_id)
+            print(f"[INFO] Closed idle session {session_id}")
+
+async def _start_background(app):
+    app["reaper"] = asyncio.create_task(_reap_idle_sessions(app))
+
+async def _cleanup(app):
+    app["reaper"].cancel()
+    await asyncio.to_thread(app["sessions"].close_all)
+    if app["close_resources"]:
+        app["sessions"].resources.close()
+
+
+def create_app(resources: SharedResources, conversation_root: str = CONVERSATION_ROOT,
+               upload_root: str = UPLOAD_ROOT, close_resources: bool = True) -> web.Application:
+    app = web.Application(client_max_size=64 * 1024 * 1024)
+    app["sessions"] = SessionManager(resources, conversation_root, upload_root)
+    app["upload_root"] = upload_root
+    app["close_resources"] = close_resources
+    app.router.add_get("/health", health)
+    app.router.add_get("/metrics", metrics)
+    app.router.add_get("/conversations", list_conversations)
+    app.router.add_post("/sessions", create_session)
+    app.router.add_post("/sessions/{session_id}/messages", post_message)
+    app.router.add_post("/sessions/{session_id}/uploads", upload_document)
+    app.router.add_delete("/sessions/{session_id}", delete_session)
+    app.router.add_get("/ws", websocket)
+    app.on_startup.append(_start_background)
+    app.on_cleanup.append(_cleanup)
+    return app
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else int(os.getenv("PORT", "8080"))
+    # Concurrent sessions share the stage pool, so size it for several turns at once
+    resources = SharedResources.from_env(stage_workers=int(os.getenv("STAGE_WORKERS", "32")))
+    web.run_app(create_app(resources), port=port)
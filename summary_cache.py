@@ -0,0 +1,117 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+SUMMARY_CACHE_DIR = "summary_cache"
+MAX_MEMORY_ENTRIES = 64
+MAX_DISK_BYTES = 50 * 1024 * 1024
+
+
+def hash_bytes(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+class SummaryCache:
+    """
+    Content-addressed cache for document summaries.
+    Key = sha256(document bytes) + model name + prompt, so the same document
+    is summarized once and reused across turns and resumed conversations.
+    Entries live in a bounded in-memory LRU and as JSON files on disk,
+    evicted least-recently-used first once the disk budget is exceeded.
+    """
+
+    def __init__(self, folder: str = SUMMARY_CACHE_DIR,
+                 max_memory_entries: int = MAX_MEMORY_ENTRIES,
+                 max_disk_bytes: int = MAX_DISK_BYTES):
+        self.folder = folder
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(self.folder, exist_ok=True)
+        self._disk_sizes = {}
+        for name in os.listdir(self.folder):
+            if name.endswith(".json"):
+                self._disk_sizes[name[:-5]] = os.path.getsize(os.path.join(self.folder, name))
+
+    @staticmethod
+    def make_key(doc_hash: str, model: str, prompt: str) -> str:
+        return hash_bytes(f"{doc_hash}\0{model}\0{prompt}".encode("utf-8"))
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.folder, f"{key}.json")
+
+    def _remember(self, key: str, summary: str):
+        self._memory[key] = summary
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key: str):
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+            if key not in self._disk_sizes:
+                return None
+            path = self._path(key)
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    summary = json.load(f)["summary"]
+            except (OSError, ValueError, KeyError):
+                self._disk_sizes.pop(key, None)
+                return None
+            # Touch the file so disk eviction sees it as recently used
+            os.utime(path, None)
+            self._remember(key, summary)
+            return summary
+
+    def put(self, key: str, summary: str, filename: str = None):
+        entry = {
+            "summary": summary,
+            "filename": filename,
+            "created_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        }
+        with self._lock:
+            self._remember(key, summary)
+            path = self._path(key)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+            self._disk_sizes[key] = os.path.getsize(path)
+            self._evict_disk()
+
+    def _evict_disk(self):
+        total = sum(self._disk_sizes.values())
+        if total <= self.max_disk_bytes:
+            return
+        by_age = sorted(
+            self._disk_sizes,
+            key=lambda k: os.path.getmtime(self._path(k)) if os.path.exists(self._path(k)) else 0
+        )
+        for key in by_age:
+            if total <= self.max_disk_bytes:
+                break
+            total -= self._disk_sizes.pop(key)
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def get_or_create(self, doc_hash: str, model: str, prompt: str, generate, filename: str = None):
+        """
+        Return the cached summary, or call generate() once and cache its result.
+        generate may be None, or return None, when the document is no longer available.
+        """
+        key = self.make_key(doc_hash, model, prompt)
+        summary = self.get(key)
+        if summary is not None or generate is None:
+            return summary
+        summary = generate()
+        if summary:
+            self.put(key, summary, filename=filename)
+        return summary
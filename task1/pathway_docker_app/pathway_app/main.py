@@ -1,8 +1,198 @@
-import numpy as np
+"""
+Streaming ingestion daemon. Watches a documents folder with Pathway and
+keeps the RAG vector store in sync: new and modified files are extracted
+and embedded incrementally through document_saver.ingest_document, and
+deleted files are removed with document_saver.delete_document. Runs as its
+own process, so chat sessions never wait on extraction or embedding.
+
+    WATCH_DIR=documents python task1/pathway_docker_app/pathway_app/main.py
+"""
+import os
+import sys
+import json
+import time
+import threading
+
+
+def _find_app_root() -> str:
+    """The folder holding document_saver.py: RAG_APP_ROOT, else the nearest parent."""
+    if os.getenv("RAG_APP_ROOT"):
+        return os.path.abspath(os.getenv("RAG_APP_ROOT"))
+    folder = os.path.dirname(os.path.abspath(__file__))
+    while not os.path.exists(os.path.join(folder, "document_saver.py")):
+        parent = os.path.dirname(folder)
+        if parent == folder:
+            raise RuntimeError("document_saver.py not found; set RAG_APP_ROOT")
+        folder = parent
+    return folder
+
+APP_ROOT = _find_app_root()
+# Resolved against the directory the daemon was started from, before the chdir below
+WATCH_DIR = os.path.abspath(os.getenv("WATCH_DIR", "documents"))
+STATE_PATH = os.path.abspath(os.getenv("INGEST_STATE_PATH", "ingest_state.json"))
+SETTLE_SECONDS = float(os.getenv("INGEST_SETTLE_SECONDS", "2"))   # wait for copies in progress to finish
+AUTOCOMMIT_MS = int(os.getenv("INGEST_AUTOCOMMIT_MS", "1000"))
+IGNORED_PREFIXES = (".", "~$")
+IGNORED_SUFFIXES = (".tmp", ".part", ".crdownload")
+
+# document_saver uses paths relative to the app root (embeddings7/, chunks/)
+sys.path.insert(0, APP_ROOT)
+os.chdir(APP_ROOT)
+
+
+def is_ignored(path: str) -> bool:
+    name = os.path.basename(path)
+    return name.startswith(IGNORED_PREFIXES) or name.endswith(IGNORED_SUFFIXES)
+
+
+class IngestionWorker:
+    """
+    Applies file changes to the vector store on one background thread.
+    Changes are coalesced per path (latest wins), so a file saved several
+    times while a batch is embedding is ingested once, and the Pathway
+    engine never blocks on embedding.
+    """
+
+    def __init__(self, state_path: str = STATE_PATH, settle_seconds: float = SETTLE_SECONDS):
+        import document_saver
+        # Spawned, not forked: this process runs Pathway engine threads and
+        # torch, which a forked extraction worker would inherit mid-state.
+        # Safe here because this module only starts the daemon under __main__.
+        document_saver.EXTRACT_START_METHOD = "spawn"
+        self.document_saver = document_saver
+        self.batcher = document_saver.IngestionBatcher()
+        self.state_path = state_path
+        self.settle_seconds = settle_seconds
+        self.state = self._load_state()
+        self._pending = {}
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="ingestion-worker", daemon=True)
+
+    def _load_state(self) -> dict:
+        """{path: sha256} of files this daemon has ingested, so deletions survive restarts."""
+        if not os.path.exists(self.state_path):
+            return {}
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_state(self):
+        tmp = self.state_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(tmp, self.state_path)
+
+    def start(self):
+        # Files removed while the daemon was down are never reported by the watcher
+        for path in list(self.state):
+            if not os.path.exists(path):
+                self.submit(path, "delete")
+        self._thread.start()
+
+    def submit(self, path: str, action: str):
+        with self._cond:
+            self._pending[path] = action
+            self._cond.notify()
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        self._thread.join()
+
+    def _take_ready(self) -> dict:
+        """Pop changes whose file has not been touched for settle_seconds."""
+        now = time.time()
+        ready = {}
+        for path, action in list(self._pending.items()):
+            try:
+                settled = action == "delete" or now - os.path.getmtime(path) >= self.settle_seconds
+            except OSError:
+                # Gone again before we got to it
+                self._pending[path] = action = "delete"
+                settled = True
+            if settled:
+                ready[path] = self._pending.pop(path)
+        return ready
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._stopped:
+                    self._cond.wait()
+                if self._stopped and not self._pending:
+                    return
+                ready = self._take_ready()
+                if not ready:
+                    self._cond.wait(self.settle_seconds)
+                    continue
+            try:
+                self._apply(ready)
+            except Exception as e:
+                # Keep watching; the files are retried when they change again or on restart
+                print(f"[ERROR] Failed to apply {len(ready)} file changes: {e}")
+
+    def _apply(self, changes: dict):
+        start = time.perf_counter()
+        ingested = {}
+        for path, action in changes.items():
+            try:
+                if action == "delete":
+                    removed = self.document_saver.delete_document(self.document_saver.document_id(path))
+                    self.state.pop(path, None)
+                    print(f"[INFO] {os.path.basename(path)} deleted: removed {removed} entries.")
+                else:
+                    doc_hash = self.document_saver.hash_file(path)
+                    self.document_saver.ingest_document(path, self.batcher)
+                    ingested[path] = doc_hash
+            except Exception as e:
+                print(f"[ERROR] Failed to {action} {path}: {e}")
+        # Embed what is queued now instead of waiting for full batches; a file
+        # only counts as ingested once its chunks are actually stored
+        try:
+            self.batcher.flush()
+            self.state.update(ingested)
+        except Exception as e:
+            print(f"[ERROR] Failed to embed {len(ingested)} changed files: {e}")
+        try:
+            self._save_state()
+        except OSError as e:
+            print(f"[ERROR] Failed to save {self.state_path}: {e}")
+        print(f"[INFO] Applied {len(changes)} file changes in {time.perf_counter() - start:.1f}s.")
+
 
 def main():
-    
-    print("I am Ayush")
-    
+    import pathway as pw
+
+    os.makedirs(WATCH_DIR, exist_ok=True)
+    worker = IngestionWorker()
+    worker.start()
+
+    # Only metadata is read: extraction opens the files itself, page by page
+    files = pw.io.fs.read(WATCH_DIR, format="only_metadata", mode="streaming",
+                          autocommit_duration_ms=AUTOCOMMIT_MS)
+    changes = {}
+
+    def on_change(key, row, time, is_addition):
+        path = os.path.abspath(row["_metadata"]["path"].as_str())
+        if is_ignored(path):
+            return
+        # A modification arrives as a retraction plus an addition in the same batch
+        if is_addition or path not in changes:
+            changes[path] = "upsert" if is_addition else "delete"
+
+    def on_time_end(time):
+        for path, action in changes.items():
+            worker.submit(path, action)
+        changes.clear()
+
+    pw.io.subscribe(files, on_change=on_change, on_time_end=on_time_end, on_end=worker.stop)
+    print(f"[INFO] Watching {WATCH_DIR} for document changes.")
+    pw.run(monitoring_level=pw.MonitoringLevel.NONE)
+
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,137 @@
+import asyncio
+import time
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+
+
+class TurnOrchestrator:
+    """
+    Runs the independent stages of a chat turn concurrently.
+
+    The decision agent's local pre-classifier runs first; when it is
+    confident the turn needs no LLM decision and no speculative search.
+    Otherwise the decision call, web search and document context start
+    together; the web search is speculative and its result is dropped if the
+    decision says it is not needed. Work that does not affect the answer (naming, memory
+    updates) is handed to a background pool so it stays off the critical path.
+    Blocking agent calls run on a persistent stage pool, so a cancelled
+    speculative call still finishes upstream but is never awaited and does
+    not hold up the end of the turn.
+    """
+
+    def __init__(self, decision_agent, web_agent, speculative_web: bool = True,
+                 stage_workers: int = 8, background_workers: int = 2):
+        self.decision_agent = decision_agent
+        self.web_agent = web_agent
+        self.speculative_web = speculative_web
+        self._stages = ThreadPoolExecutor(max_workers=stage_workers, thread_name_prefix="turn-stage")
+        self._background = ThreadPoolExecutor(max_workers=background_workers, thread_name_prefix="turn-bg")
+
+    async def _timed(self, timings: dict, name: str, func, *args):
+        start = time.perf_counter()
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(self._stages, func, *args)
+        except asyncio.CancelledError:
+            # A dropped speculative stage was not part of this turn
+            timings[f"{name}_cancelled"] = time.perf_counter() - start
+            raise
+        except Exception:
+            timings[name] = time.perf_counter() - start
+            raise
+        timings[name] = time.perf_counter() - start
+        return result
+
+    async def _web_search(self, timings: dict, user_input: str) -> dict:
+        try:
+            return await self._timed(timings, "web_search", self.web_agent.query, user_input)
+        except Exception as e:
+            print(f"[ERROR] Web query failed: {e}")
+            return {"text": "", "sources": []}
+
+    async def _decide(self, timings: dict, user_input: str):
+        """The pre-classifier's confident decision, or None when the LLM has to decide."""
+        if getattr(self.decision_agent, "pre_classifier", None) is None:
+            return None
+        return await self._timed(timings, "pre_classifier", self.decision_agent.local_decision, user_input)
+
+    async def run_turn(self, user_input: str, build_doc_context, answer) -> dict:
+        """
+        build_doc_context(user_input) -> list of context strings
+        answer(user_input, doc_context, web_context, web_sources) -> response text,
+            or a dict with the text under "text" plus answer metrics (e.g. streaming stats)
+        """
+        timings = {}
+        turn_start = time.perf_counter()
+
+        doc_task = asyncio.create_task(
+            self._timed(timings, "doc_context", build_doc_context, user_input))
+        web_task = None
+        try:
+            decision = await self._decide(timings, user_input)
+            if decision is None:
+                # Only pay for a speculative search when the answer is actually in doubt
+                decision_task = asyncio.create_task(self._timed(
+                    timings, "decision", partial(self.decision_agent.analyze_query, user_input, local_checked=True)))
+                if self.speculative_web:
+                    web_task = asyncio.create_task(self._web_search(timings, user_input))
+                decision = await decision_task
+        except Exception:
+            for task in (doc_task, web_task):
+                if task is not None:
+                    task.cancel()
+            raise
+        need_web = decision["Need_web"] == "yes"
+
+        web_result = {"text": "", "sources": []}
+        if need_web:
+            if web_task is None:
+                web_task = asyncio.create_task(self._web_search(timings, user_input))
+            web_result = await web_task
+        elif web_task is not None:
+            web_task.cancel()
+
+        doc_context = await doc_task
+
+        response = await self._timed(
+            timings, "answer", answer, user_input, doc_context, web_result["text"], web_result["sources"])
+        timings["total"] = time.perf_counter() - turn_start
+        answer_stats = {}
+        if isinstance(response, dict):
+            answer_stats = {k: v for k, v in response.items() if k != "text"}
+            response = response["text"]
+
+        return {
+            "decision": decision,
+            "response": response,
+            "answer_stats": answer_stats,
+            "web_context": web_result["text"],
+            "web_sources": web_result["sources"],
+            "timings": timings
+        }
+
+    def run(self, user_input: str, build_doc_context, answer) -> dict:
+        return asyncio.run(self.run_turn(user_input, build_doc_context, answer))
+
+    def submit_background(self, name: str, func, *args):
+        """Run func off the critical path and report its latency once it finishes."""
+        start = time.perf_counter()
+
+        def _done(future):
+            elapsed = time.perf_counter() - start
+            if future.exception() is not None:
+                print(f"[ERROR] Background stage '{name}' failed: {future.exception()}")
+            else:
+                print(f"[TIMING] {name}={elapsed:.2f}s (background)")
+
+        future = self._background.submit(func, *args)
+        future.add_done_callback(_done)
+        return future
+
+    def shutdown(self):
+        """Wait for background work (naming, memory) before the session is saved."""
+        self._background.shutdown(wait=True)
+        self._stages.shutdown(wait=False)
+
+
+def format_timings(timings: dict) -> str:
+    return " ".join(f"{name}={seconds:.2f}s" for name, seconds in timings.items())
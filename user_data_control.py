@@ -1,21 +1,14 @@
 import os
-from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.messages import SystemMessage, HumanMessage
-from google import genai
-from google.genai import types
 import tiktoken
 from dotenv import load_dotenv
+from llm_backend import get_backend
 load_dotenv()
 USER_MEMORY_PATH = "user_details.txt"
 TOKEN_LIMIT = 2000
 
-API_KEY = os.getenv("GOOGLE_API_KEY")
-if not API_KEY:
-    raise ValueError("Missing GOOGLE_API_KEY in environment variables")
-
 enc = tiktoken.encoding_for_model("gpt-4")
-genai_client = genai.Client(api_key=API_KEY)
-model = ChatGoogleGenerativeAI(model="gemini-2.5-flash", google_api_key=API_KEY)
+backend = get_backend()
 
 def load_user_memory() -> str:
     if not os.path.exists(USER_MEMORY_PATH):
@@ -48,8 +41,7 @@ Return the updated memory as plain text.
     human_prompt = HumanMessage(content=memory_text)
 
     try:
-        result = model.invoke([system_prompt, human_prompt])
-        summarized_text = str(result.content)
+        summarized_text = backend.chat([system_prompt, human_prompt], caller="memory_summary")
 
         # Safety fallback: truncate if AI still exceeds limit
         if count_tokens(summarized_text) > TOKEN_LIMIT:
@@ -1,40 +1,109 @@
-import os
+import re
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
 from dotenv import load_dotenv
-from google.genai import Client
+from llm_backend import get_backend
 load_dotenv()
+
+# Freshness per query class, in seconds
+DEFAULT_TTLS = {
+    "live": 60,          # prices, rates, indices
+    "news": 15 * 60,     # headlines and recent updates
+    "general": 60 * 60   # everything else
+}
+MAX_CACHED_QUERIES = 512
+LIVE_PATTERN = re.compile(
+    r"\b(price|prices|rate|rates|live|now|current|currently|today|nav|sensex|nifty|bitcoin|btc|crypto)\b", re.I)
+NEWS_PATTERN = re.compile(r"\b(news|latest|update|updates|headlines?|recent|this week)\b", re.I)
+
+def normalize_query(query: str) -> str:
+    query = re.sub(r"\s+", " ", query.strip().lower())
+    return query.strip(" ?!.,")
+
+def classify_query(query: str) -> str:
+    if LIVE_PATTERN.search(query):
+        return "live"
+    if NEWS_PATTERN.search(query):
+        return "news"
+    return "general"
+
+
+class QueryCache:
+    """
+    Time-bounded result cache with in-flight request coalescing: concurrent
+    callers asking the same normalized query share one upstream call.
+    Failures are never cached.
+    """
+
+    def __init__(self, ttls: dict = None, max_entries: int = MAX_CACHED_QUERIES):
+        self.ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def get_or_fetch(self, key: str, query_class: str, fetch) -> dict:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                return entry[1]
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._inflight[key] = future
+        if not owner:
+            return future.result()
+
+        try:
+            result = fetch()
+        except BaseException as e:
+            with self._lock:
+                self._inflight.pop(key, None)
+            future.set_exception(e)
+            raise
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttls.get(query_class, self.ttls["general"]), result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._inflight.pop(key, None)
+        future.set_result(result)
+        return result
+
+
+# Shared by every webQuery in the process (chat loop, news agent, ...)
+_shared_cache = QueryCache()
+
+
 class webQuery:
-    def __init__(self, api_key: str = None):
-        if api_key is None:
-            api_key = os.getenv("GOOGLE_API_KEY")
-        if not api_key:
-            raise ValueError("API key not provided and GOOGLE_API_KEY not set in environment.")
-        self.client = Client(api_key=api_key)
+    def __init__(self, api_key: str = None, cache: QueryCache = None, ttls: dict = None, backend=None,
+                 caller: str = "web_search"):
+        self.backend = backend or get_backend(api_key)
+        self.caller = caller
+        if cache is None:
+            cache = QueryCache(ttls) if ttls else _shared_cache
+        self.cache = cache
+
     def query(self, user_query: str) -> dict:
         """
         Returns a dictionary with:
         - 'text': AI answer
         - 'sources': list of website titles or "title (URL)" if URL exists
+        Results are served from the cache while fresh for the query's class.
         """
-        response = self.client.models.generate_content(
-            model="gemini-2.5-flash",
-            contents=user_query,
-            config={"tools": [{"google_search": {}}]}
+        result = self.cache.get_or_fetch(
+            normalize_query(user_query),
+            classify_query(user_query),
+            lambda: self._search(user_query)
         )
-        sources = []
-        try:
-            chunks = response.candidates[0].grounding_metadata.grounding_chunks
-            for chunk in chunks:
-                if hasattr(chunk, "web"):
-                    title = getattr(chunk.web, "title", None)
-                    url = getattr(chunk.web, "url", None)
-                    if title:
-                        if url:
-                            sources.append(f"{title} ({url})")
-                        else:
-                            sources.append(title)
-        except Exception:
-            sources = []
-        return {"text": response.text, "sources": sources}
+        return {"text": result["text"], "sources": list(result["sources"])}
+
+    def _search(self, user_query: str) -> dict:
+        return self.backend.grounded_search(user_query, caller=self.caller)
 
 
 # # --- Example usage ---